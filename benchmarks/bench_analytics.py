@@ -0,0 +1,80 @@
+"""
+Analytics endpoint over a growing ticket history: the old raw-table aggregation
+(five COUNTs, an Avg and a TruncDate group-by) against the rollup-backed view.
+
+    python -m benchmarks.bench_analytics --rows 10000 100000 --days 90
+"""
+import argparse
+from datetime import timedelta
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F
+from django.db.models.functions import TruncDate
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.models import Place, Queue, Ticket, TicketRollup, User
+
+
+def populate(rows, days):
+    owner = User.objects.create(username=f"bench-owner-{rows}", role="place_admin")
+    place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    statuses = ("used", "used", "canceled", "active")
+    Ticket.objects.bulk_create(
+        [Ticket(queue=queue, user=owner, number=i + 1, status=statuses[i % 4]) for i in range(rows)],
+        batch_size=5000,
+    )
+    # created_at با auto_now_add پر می‌شود؛ تیکت‌ها روی چند روز پخش می‌شوند
+    now = timezone.now()
+    per_day = rows // days + 1
+    for day in range(days):
+        created = now - timedelta(days=day, hours=day % 24)
+        Ticket.objects.filter(queue=queue, number__gt=day * per_day, number__lte=(day + 1) * per_day).update(
+            created_at=created, called_at=created + timedelta(minutes=5 + day % 7),
+        )
+    TicketRollup.rebuild(queue_ids=[queue.id])
+    return owner, place
+
+
+def raw_analytics(place_id):
+    qs = Ticket.objects.filter(queue__place_id=place_id)
+    qs.count()
+    qs.filter(status="used").count()
+    qs.filter(status="canceled").count()
+    qs.filter(status="active").count()
+    qs.filter(called_at__isnull=False).annotate(
+        wait_time=ExpressionWrapper(F("called_at") - F("created_at"), output_field=DurationField())
+    ).aggregate(avg_wait=Avg("wait_time"))
+    list(qs.annotate(date=TruncDate("created_at")).values("date").annotate(count=Count("id")).order_by("date"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = []
+    with benchmark_database():
+        for rows in args.rows:
+            owner, place = populate(rows, args.days)
+            client = APIClient()
+            client.force_authenticate(owner)
+            url = reverse("analytics")
+            cases = (
+                ("raw tickets (old)", lambda: raw_analytics(place.id)),
+                ("rollups, daily", lambda: client.get(url, {"place_id": place.id})),
+                ("rollups, weekly", lambda: client.get(url, {"place_id": place.id, "interval": "weekly"})),
+            )
+            for strategy, fn in cases:
+                result = measure(fn, repeat=args.repeat)
+                results.append({"rows": rows, "strategy": strategy,
+                                "p50_ms": result["p50_ms"], "p95_ms": result["p95_ms"]})
+    print_table(results, list(results[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+End-of-day cleanup: cancel N leftover tickets with N admin PATCHes vs. one batch request.
+
+    python -m benchmarks.bench_batch --tickets 500
+"""
+import argparse
+import time
+
+from benchmarks.common import benchmark_database, print_table
+
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.models import OutboxEvent, Place, Queue, Ticket, User
+from core.outbox import dispatch_pending
+from core.utils import place_broadcaster
+
+
+def make_queue(owner, tickets, name):
+    place = Place.objects.create(owner=owner, name=name, latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    users = User.objects.bulk_create([User(username=f"{name}-{i}", email=f"{name}-{i}@example.com")
+                                      for i in range(tickets)])
+    for user in users:
+        queue.issue_ticket(user)
+    OutboxEvent.objects.all().delete()
+    return queue, list(Ticket.objects.filter(queue=queue).values_list("id", flat=True))
+
+
+def run(name, fn):
+    reset_queries()
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        requests = fn()
+        request_s = time.perf_counter() - start
+        outbox = OutboxEvent.objects.count()
+        start = time.perf_counter()
+        while dispatch_pending():
+            pass
+        dispatch_s = time.perf_counter() - start
+    return {
+        "strategy": name,
+        "requests": requests,
+        "request_s": round(request_s, 3),
+        "dispatch_s": round(dispatch_s, 3),
+        "outbox_events": outbox,
+        "queries": len(ctx),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickets", type=int, default=500)
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        with override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"):
+            owner = User.objects.create(username="bench-owner", role="place_admin")
+            client = APIClient()
+            client.force_authenticate(owner)
+
+            queue, ids = make_queue(owner, args.tickets, "single")
+            url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+
+            def one_by_one():
+                for ticket_id in ids:
+                    client.patch(url, {"ticket_id": ticket_id, "action": "cancel"})
+                return len(ids)
+
+            rows.append(run("PATCH per ticket", one_by_one))
+
+            queue, ids = make_queue(owner, args.tickets, "batch")
+            url = reverse("admin-tickets-batch", kwargs={"queue_id": queue.id})
+
+            def batch():
+                client.post(url, {"ticket_ids": ids, "action": "cancel"}, format="json")
+                return 1
+
+            rows.append(run("batch", batch))
+            place_broadcaster.flush()
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Caller-side cost of channel-layer sends: inline ``group_send`` (WS_DISPATCH_QUEUE_SIZE=0,
+the old behaviour) versus the background ``channel_dispatcher`` queue.
+
+Each send is what a view or the outbox does per notification; the caller's time is what
+an HTTP worker is blocked for. "drain" is the time until the dispatcher has delivered
+everything to the layer.
+
+    python -m benchmarks.bench_dispatch --sends 2000 --redis-delay-ms 2
+    python -m benchmarks.bench_dispatch --layer redis --redis-url redis://127.0.0.1:6379/0
+"""
+import argparse
+import time
+from contextlib import ExitStack
+
+from benchmarks.common import print_table, summarize
+from benchmarks.redis_standin import RedisStandin
+
+from django.test.utils import override_settings
+from core.utils import channel_dispatcher, send_ws_notification
+
+
+def channel_layers(layer, redis_url=None, standin=None):
+    if layer == "redis-standin":
+        return {"default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {"hosts": [standin.url]},
+        }}
+    return {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [redis_url]}}}
+
+
+def run(mode, sends, queue_size):
+    with override_settings(WS_DISPATCH_QUEUE_SIZE=0 if mode == "inline" else queue_size):
+        before = channel_dispatcher.stats()
+        samples = []
+        start = time.perf_counter()
+        for n in range(sends):
+            t = time.perf_counter()
+            send_ws_notification(n % 500, {"type": "notification", "message": f"ticket {n}"})
+            samples.append(time.perf_counter() - t)
+        caller = time.perf_counter() - start
+        channel_dispatcher.flush(timeout=600)
+        total = time.perf_counter() - start
+        after = channel_dispatcher.stats()
+    return {
+        "mode": mode,
+        **summarize(samples),
+        "caller_s": round(caller, 3),
+        "drain_s": round(total, 3),
+        "sends_per_s": round(sends / total, 1),
+        "dropped": after["dropped"] - before["dropped"],
+        "max_depth": after["max_queue_depth"],
+        "avg_latency_ms": round(after["avg_dispatch_latency_ms"], 2) if mode == "dispatcher" else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layer", choices=["redis-standin", "redis"], default="redis-standin")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/0", help="Used with --layer redis.")
+    parser.add_argument("--redis-delay-ms", type=float, default=0, help="Stand-in PUBLISH reply delay.")
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    with ExitStack() as stack:
+        standin = None
+        if args.layer == "redis-standin":
+            standin = stack.enter_context(RedisStandin(delay_ms=args.redis_delay_ms))
+        stack.enter_context(override_settings(CHANNEL_LAYERS=channel_layers(args.layer, args.redis_url, standin)))
+        rows = [run(mode, args.sends, args.queue_size) for mode in ("inline", "dispatcher")]
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
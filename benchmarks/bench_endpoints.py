@@ -0,0 +1,224 @@
+"""
+Endpoint benchmark suite over a synthetic dataset.
+
+Each case is run sequentially `--repeat` times and reports throughput, p50/p95/p99 latency
+and SQL queries per request. Results are printed and saved as JSON so runs can be compared.
+
+    python -m benchmarks.bench_endpoints --tickets 1000000 --places 500
+    python -m benchmarks.bench_endpoints --existing   # configured database, after generate_synthetic_data
+
+By default a throwaway database is filled with ``manage.py generate_synthetic_data``.
+With --existing the configured database is used as is (join and call cases write to it).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import benchmark_database, percentile, print_table
+
+import django
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import Place, Queue, Ticket, TicketStatus, User
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def run_case(name, fn, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    durations, queries, errors = [], [], 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            ok = fn()
+            durations.append(time.perf_counter() - start)
+        queries.append(len(ctx))
+        errors += not ok
+    total = sum(durations)
+    return {
+        "case": name,
+        "n": repeat,
+        "errors": errors,
+        "throughput_rps": round(repeat / total, 1) if total else None,
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p95_ms": round(percentile(durations, 95) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "queries_mean": round(sum(queries) / len(queries), 2),
+        "queries_max": max(queries),
+    }
+
+
+def pick_targets():
+    """مکان با بیشترین تیکت، صفی که join در آن نوبت می‌دهد و مدیر مکان."""
+    place = Place.objects.filter(queues__is_open=True).annotate(n=Count("queues__tickets")).order_by("-n").first()
+    if place is None:
+        raise SystemExit("no open queue found; run manage.py generate_synthetic_data first")
+    queue = Queue.objects.filter(place=place, is_open=True).select_related("place").latest("created_at")
+    return queue, place.owner
+
+
+def http_cases(queue, admin, repeat):
+    place = queue.place
+    admin_client = APIClient()
+    admin_client.force_authenticate(admin)
+    anonymous = APIClient()
+
+    def ok(response):
+        return response.status_code < 400
+
+    # کاربران تازه برای join، هر درخواست یک کاربر
+    stamp = int(time.time() * 1000)
+    joiners = iter(User.objects.bulk_create(
+        [User(username=f"bench-join-{stamp}-{i}", password="!") for i in range(repeat + 2)]
+    ))
+    join_url = reverse("join-queue", kwargs={"place_id": place.id})
+
+    def join():
+        client = APIClient()
+        client.force_authenticate(next(joiners))
+        return ok(client.post(join_url))
+
+    tickets_url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+
+    def waiting_tickets():
+        # بعد از join خوانده می‌شود تا نوبت‌های تازه هم فراخوانی شوند
+        yield from Ticket.objects.filter(
+            queue=queue, status=TicketStatus.ACTIVE, called_at__isnull=True,
+        ).order_by("number").values_list("id", flat=True)
+
+    waiting = waiting_tickets()
+
+    def call_next():
+        ticket_id = next(waiting, None)
+        if ticket_id is None:
+            return False
+        return ok(admin_client.patch(tickets_url, {"ticket_id": ticket_id, "action": "call"}))
+
+    nearby_url = reverse("places-nearby")
+    analytics_url = reverse("analytics")
+    week_ago = (timezone.now() - timedelta(days=7)).isoformat()
+    return [
+        ("nearby r=5km", lambda: ok(anonymous.get(
+            nearby_url, {"lat": place.latitude, "lon": place.longitude, "radius": 5}))),
+        ("nearby r=20km limit=20", lambda: ok(anonymous.get(
+            nearby_url, {"lat": place.latitude, "lon": place.longitude, "radius": 20, "limit": 20}))),
+        ("join queue", join),
+        ("admin tickets page", lambda: ok(admin_client.get(tickets_url))),
+        ("admin tickets ?status=active", lambda: ok(admin_client.get(tickets_url, {"status": "active"}))),
+        ("admin call ticket", call_next),
+        ("analytics daily", lambda: ok(admin_client.get(analytics_url, {"place_id": place.id}))),
+        ("analytics weekly", lambda: ok(admin_client.get(analytics_url, {"place_id": place.id, "interval": "weekly"}))),
+        ("analytics last 7 days", lambda: ok(admin_client.get(
+            analytics_url, {"place_id": place.id, "start_date": week_ago}))),
+    ]
+
+
+def websocket_cases(queue, admin):
+    from smartqueue.asgi import application
+
+    token = str(AccessToken.for_user(admin))
+
+    async def connect(path, expect_message):
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        if connected and expect_message:
+            await communicator.receive_from(timeout=5)
+        await communicator.disconnect()
+        return connected
+
+    return [
+        ("ws queue connect + snapshot",
+         lambda: async_to_sync(connect)(f"/ws/queue/{queue.place_id}/", True)),
+        ("ws notifications connect (JWT)",
+         lambda: async_to_sync(connect)(f"/ws/notifications/?token={token}", False)),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    queue, admin = pick_targets()
+    dataset = {
+        "places": Place.objects.count(),
+        "queues": Queue.objects.count(),
+        "tickets": Ticket.objects.count(),
+        "users": User.objects.count(),
+        "target_queue_tickets": queue.tickets.count(),
+    }
+    cases = http_cases(queue, admin, args.repeat) + websocket_cases(queue, admin)
+    selected = [c for c in cases if not args.only or any(key in c[0] for key in args.only)]
+    results = [run_case(name, fn, args.repeat) for name, fn in selected]
+    return dataset, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--existing", action="store_true", help="Benchmark the configured database as is.")
+    parser.add_argument("--places", type=int, default=200)
+    parser.add_argument("--queues-per-place", type=int, default=2)
+    parser.add_argument("--tickets", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name contains one of these strings.")
+    parser.add_argument("--output", help="JSON file (default: benchmarks/results/endpoints-<timestamp>.json).")
+    args = parser.parse_args()
+
+    generate_seconds = None
+    if args.existing:
+        dataset, results = run_suite(args)
+    else:
+        with benchmark_database():
+            start = time.perf_counter()
+            call_command(
+                "generate_synthetic_data", places=args.places, queues_per_place=args.queues_per_place,
+                tickets=args.tickets, users=args.users, days=args.days, prefix="bench",
+            )
+            generate_seconds = round(time.perf_counter() - start, 1)
+            dataset, results = run_suite(args)
+
+    print_table(results, list(results[0]))
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "existing_database": args.existing,
+            "repeat": args.repeat,
+            "generate_seconds": generate_seconds,
+        },
+        "dataset": dataset,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"endpoints-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nsaved {output}")
+
+
+if __name__ == "__main__":
+    main()
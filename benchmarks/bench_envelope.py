@@ -0,0 +1,98 @@
+"""
+WebSocket fan-out cost for one place group: per-consumer json.dumps vs. encode-once envelopes.
+
+    python -m benchmarks.bench_envelope --subscribers 5000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import print_table
+
+from channels.layers import InMemoryChannelLayer
+from core.consumers import QueueConsumer
+from core.utils import encode_envelope
+
+
+def sample_payload(tickets=20):
+    return {
+        "type": "batch",
+        "events": [
+            {"type": "ticket_called", "seq": i, "ticket": {
+                "id": i, "queue": 1, "user": f"customer-{i}", "number": i, "status": "active",
+                "cancel_reason": None, "created_at": "2025-08-18T09:00:00Z", "called_at": "2025-08-18T09:05:00Z",
+                "completed_at": None,
+            }}
+            for i in range(tickets)
+        ],
+    }
+
+
+class SinkConsumer(QueueConsumer):
+    """QueueConsumer whose outgoing frames are counted instead of written to a socket."""
+
+    def __init__(self):
+        super().__init__()
+        self.snapshot_seq = 0
+        self.sent = 0
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        self.sent += 1
+
+
+async def legacy_handler(consumer, event):
+    # the pre-envelope QueueConsumer.queue_update body
+    await consumer.send(text_data=json.dumps(event.get("data"), ensure_ascii=False))
+
+
+async def run_handlers(consumers, handler, message):
+    for consumer in consumers:
+        await handler(consumer, message)
+
+
+async def layer_fan_out(subscribers, message):
+    layer = InMemoryChannelLayer(capacity=10)
+    channels = [await layer.new_channel() for _ in range(subscribers)]
+    for channel in channels:
+        await layer.group_add("place_1", channel)
+    start = time.perf_counter()
+    await layer.group_send("place_1", message)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--tickets", type=int, default=20, help="events per batch frame")
+    args = parser.parse_args()
+
+    payload = sample_payload(args.tickets)
+    consumers = [SinkConsumer() for _ in range(args.subscribers)]
+    legacy = {"type": "queue_update", "data": payload}
+
+    rows = []
+    for name, make_message, handler in (
+        ("legacy dict + json.dumps per consumer", lambda: legacy, legacy_handler),
+        ("envelope encoded once", lambda: encode_envelope("queue_update", payload, seq=args.tickets),
+         lambda c, m: c.queue_update(m)),
+    ):
+        start = time.perf_counter()
+        message = make_message()
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        asyncio.run(run_handlers(consumers, handler, message))
+        handlers = time.perf_counter() - start
+        layer = asyncio.run(layer_fan_out(args.subscribers, message))
+        rows.append({
+            "strategy": name,
+            "subscribers": args.subscribers,
+            "encode_ms": round(encode * 1000, 3),
+            "consumers_ms": round(handlers * 1000, 1),
+            "inmemory_group_send_ms": round(layer * 1000, 1),
+        })
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
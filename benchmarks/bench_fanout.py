@@ -0,0 +1,314 @@
+"""
+WebSocket fan-out load harness: thousands of QueueConsumer (display screens on one place_{id}
+group) and NotificationConsumer (one per customer) connections through the ASGI application.
+
+Ticket events are driven through the real views (admin PATCH "call", then the outbox dispatch),
+and every frame is timestamped when it reaches a communicator. Reported per layer:
+
+- connect rate, and traced Python memory per connection (tracemalloc over --memory-sample connections)
+- call -> screen / owner delivery latency (p50/p95/p99, and until the last screen has it)
+- raw group_send to the place group: time spent in group_send and until full delivery
+
+    python -m benchmarks.bench_fanout --screens 2000 --users 500 --events 20
+    python -m benchmarks.bench_fanout --layer redis-standin --window-ms 0
+    python -m benchmarks.bench_fanout --layer redis --redis-url redis://127.0.0.1:6379/0
+    python -m benchmarks.bench_fanout --trace /tmp/fanout.jsonl && python manage.py trace_report --file /tmp/fanout.jsonl
+
+redis-standin runs channels_redis.pubsub.RedisPubSubChannelLayer against the in-process RESP
+server in benchmarks.redis_standin; --layer redis uses RedisChannelLayer on a real server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime
+
+from benchmarks.bench_endpoints import RESULTS_DIR, git_commit
+from benchmarks.common import benchmark_database, print_table, summarize
+from benchmarks.redis_standin import RedisStandin
+
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import Place, Queue, Ticket, TicketStatus, User, UserRoles
+from core.outbox import dispatch_pending
+from core.utils import encode_envelope, place_broadcaster
+
+DELIVERY_TIMEOUT = 30
+
+
+def channel_layers(layer, redis_url=None, standin=None):
+    if layer == "inmemory":
+        return {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+    if layer == "redis-standin":
+        return {"default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {"hosts": [standin.url]},
+        }}
+    return {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [redis_url]}}}
+
+
+def build_dataset(users):
+    admin = User.objects.create(username="fanout-admin", password="!", role=UserRoles.PLACE_ADMIN)
+    place = Place.objects.create(owner=admin, name="fanout", latitude=35.7, longitude=51.4)
+    queue = Queue.objects.create(place=place, name="fanout")
+    customers = User.objects.bulk_create([User(username=f"fanout-{i}", password="!") for i in range(users)])
+    Ticket.objects.bulk_create([
+        Ticket(queue=queue, user=user, number=number, status=TicketStatus.ACTIVE)
+        for number, user in enumerate(customers, start=1)
+    ])
+    queue.update_statistics()
+    tickets = list(Ticket.objects.filter(queue=queue).order_by("number").values_list("id", "user_id"))
+    return queue, admin, customers, tickets
+
+
+class Tracker:
+    """
+    زمان رسیدن اولین فریم هر کلید به هر گیرنده؛ وقتی همه‌ی expected گیرنده رسیدند event ست می‌شود.
+    """
+
+    def __init__(self):
+        self.started = {}
+        self.expected = {}
+        self.arrivals = {}
+        self.done = {}
+        self.other_frames = 0
+
+    def expect(self, key, receivers):
+        self.started[key] = time.perf_counter()
+        self.expected[key] = receivers
+        self.arrivals[key] = {}
+        self.done[key] = asyncio.Event()
+
+    def arrived(self, key, receiver, at):
+        arrivals = self.arrivals.get(key)
+        if arrivals is None or receiver in arrivals:
+            return
+        arrivals[receiver] = at - self.started[key]
+        if len(arrivals) >= self.expected[key]:
+            self.done[key].set()
+
+    async def wait(self, key):
+        try:
+            await asyncio.wait_for(self.done[key].wait(), DELIVERY_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        return list(self.arrivals[key].values())
+
+
+def screen_keys(frame):
+    events = frame["events"] if frame.get("type") == "batch" else [frame]
+    for event in events:
+        if event.get("type") == "ticket_called":
+            yield ("call", event["ticket"]["id"])
+        elif event.get("type") == "bench_ping":
+            yield ("ping", event["n"])
+
+
+def user_keys(frame):
+    if frame.get("type") == "ticket_called":
+        yield ("owner", frame["ticket"]["id"])
+
+
+async def read_frames(communicator, receiver, keys, tracker):
+    while True:
+        message = await communicator.output_queue.get()
+        if message["type"] != "websocket.send":
+            return
+        at = time.perf_counter()
+        matched = False
+        for key in keys(json.loads(message["text"])):
+            tracker.arrived(key, receiver, at)
+            matched = True
+        tracker.other_frames += not matched
+
+
+async def connect_all(application, paths, batch):
+    communicators = []
+    for start in range(0, len(paths), batch):
+        chunk = [WebsocketCommunicator(application, path) for path in paths[start:start + batch]]
+        results = await asyncio.gather(*(c.connect(timeout=DELIVERY_TIMEOUT) for c in chunk))
+        if not all(connected for connected, _ in results):
+            raise SystemExit("websocket connection refused")
+        communicators.extend(chunk)
+    return communicators
+
+
+async def measure_connect(application, paths, batch, sample):
+    """
+    حافظه روی sample اتصال اول با tracemalloc اندازه‌گیری می‌شود (tracemalloc اتصال را چند برابر
+    کند می‌کند)، زمان اتصال روی بقیه.
+    """
+    sample = min(sample, len(paths))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    communicators = await connect_all(application, paths[:sample], batch)
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    timed = paths[sample:] or paths[:sample]
+    start = time.perf_counter()
+    if paths[sample:]:
+        communicators += await connect_all(application, paths[sample:], batch)
+    else:
+        await asyncio.gather(*(c.disconnect() for c in communicators))
+        communicators = await connect_all(application, paths, batch)
+    elapsed = time.perf_counter() - start
+    return communicators, {
+        "connections": len(paths),
+        "connects_per_s": round(len(timed) / elapsed, 1),
+        "memory_sample": sample,
+        "kb_per_connection": round(traced / sample / 1024, 2),
+    }
+
+
+def latency_row(name, samples, expected):
+    row = {"case": name, **summarize(samples), "expected": expected}
+    row["max_ms"] = round(max(samples) * 1000, 3) if samples else None
+    return row
+
+
+async def run(args, queue, admin, customers, tickets):
+    from smartqueue.asgi import application
+
+    place_id = queue.place_id
+    screens, screen_memory = await measure_connect(
+        application, [f"/ws/queue/{place_id}/"] * args.screens, args.connect_batch, args.memory_sample,
+    )
+    tokens = [str(AccessToken.for_user(user)) for user in customers]
+    users, user_memory = await measure_connect(
+        application, [f"/ws/notifications/?token={token}" for token in tokens], args.connect_batch, args.memory_sample,
+    )
+
+    tracker = Tracker()
+    owner_index = {user.id: i for i, user in enumerate(customers)}
+    readers = [asyncio.create_task(read_frames(c, i, screen_keys, tracker)) for i, c in enumerate(screens)]
+    readers += [asyncio.create_task(read_frames(c, i, user_keys, tracker)) for i, c in enumerate(users)]
+    await asyncio.sleep(0.1)  # snapshot frames
+
+    client = APIClient()
+    client.force_authenticate(admin)
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+    patch = sync_to_async(client.patch)
+    dispatch = sync_to_async(dispatch_pending)
+
+    screen_samples, screen_last, owner_samples, http_samples = [], [], [], []
+    for ticket_id, user_id in tickets[:args.events]:
+        tracker.expect(("call", ticket_id), len(screens))
+        tracker.expect(("owner", ticket_id), 1 if user_id in owner_index else 0)
+        start = time.perf_counter()
+        response = await patch(url, {"ticket_id": ticket_id, "action": "call"})
+        http_samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f"call failed: {response.status_code} {response.content[:200]}")
+        await dispatch()
+        arrivals = await tracker.wait(("call", ticket_id))
+        screen_samples += arrivals
+        if len(arrivals) == len(screens):
+            screen_last.append(max(arrivals))
+        owner_samples += await tracker.wait(("owner", ticket_id))
+    other_frames = tracker.other_frames
+
+    layer = get_channel_layer()
+    send_samples, ping_samples, ping_last = [], [], []
+    for n in range(args.pings):
+        message = encode_envelope("queue_update", {"type": "bench_ping", "n": n})
+        tracker.expect(("ping", n), len(screens))
+        start = time.perf_counter()
+        await layer.group_send(f"place_{place_id}", message)
+        send_samples.append(time.perf_counter() - start)
+        arrivals = await tracker.wait(("ping", n))
+        ping_samples += arrivals
+        if len(arrivals) == len(screens):
+            ping_last.append(max(arrivals))
+
+    for reader in readers:
+        reader.cancel()
+    for start in range(0, len(screens + users), args.connect_batch):
+        await asyncio.gather(*(c.disconnect() for c in (screens + users)[start:start + args.connect_batch]))
+
+    events = min(args.events, len(tickets))
+    latencies = [
+        latency_row("call http (admin PATCH)", http_samples, events),
+        latency_row("call -> screen", screen_samples, events * len(screens)),
+        latency_row("call -> last screen", screen_last, events),
+        latency_row("call -> owner", owner_samples, events),
+        latency_row("group_send (await)", send_samples, args.pings),
+        latency_row("group_send -> screen", ping_samples, args.pings * len(screens)),
+        latency_row("group_send -> last screen", ping_last, args.pings),
+    ]
+    memory = [{"consumer": "QueueConsumer", **screen_memory}, {"consumer": "NotificationConsumer", **user_memory}]
+    return memory, latencies, other_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layer", choices=["inmemory", "redis-standin", "redis"], default="inmemory")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/0", help="Used with --layer redis.")
+    parser.add_argument("--screens", type=int, default=1000, help="QueueConsumer connections on one place.")
+    parser.add_argument("--users", type=int, default=200, help="Customers, each with a ticket and a notification socket.")
+    parser.add_argument("--events", type=int, default=20, help="Tickets called through the admin API.")
+    parser.add_argument("--pings", type=int, default=20, help="Raw group_send messages to the place group.")
+    parser.add_argument("--window-ms", type=int, help="Override QUEUE_BROADCAST_WINDOW_MS.")
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--memory-sample", type=int, default=200, help="Connections traced with tracemalloc.")
+    parser.add_argument("--output", help="JSON file (default: benchmarks/results/fanout-<timestamp>.json).")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Enable core.tracing and write spans here (summarize with manage.py trace_report).")
+    args = parser.parse_args()
+
+    with ExitStack() as stack:
+        standin = stack.enter_context(RedisStandin()) if args.layer == "redis-standin" else None
+        overrides = {
+            "CHANNEL_LAYERS": channel_layers(args.layer, args.redis_url, standin),
+            "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+        }
+        if args.window_ms is not None:
+            overrides["QUEUE_BROADCAST_WINDOW_MS"] = args.window_ms
+        if args.trace:
+            overrides.update(TRACE_ENABLED=True, TRACE_FILE=os.path.abspath(args.trace))
+        stack.enter_context(override_settings(**overrides))
+        stack.enter_context(benchmark_database())
+        queue, admin, customers, tickets = build_dataset(args.users)
+        memory, latencies, other_frames = async_to_sync(run)(args, queue, admin, customers, tickets)
+        window_ms = place_broadcaster.get_window() * 1000
+
+    print(f"layer={args.layer} screens={args.screens} users={args.users} window={window_ms:g}ms\n")
+    print_table(memory, list(memory[0]))
+    print()
+    print_table(latencies, list(latencies[0]))
+    print(f"\nother frames (snapshots, stats, eta_update): {other_frames}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "layer": args.layer,
+            "screens": args.screens,
+            "users": args.users,
+            "window_ms": window_ms,
+        },
+        "memory": memory,
+        "latency": latencies,
+        "other_frames": other_frames,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"fanout-{args.layer}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nsaved {output}")
+
+
+if __name__ == "__main__":
+    main()
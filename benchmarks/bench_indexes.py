@@ -0,0 +1,103 @@
+"""
+Hot-path queries with and without the indexes from core/migrations/0002_hot_path_indexes.
+
+The same synthetic history is timed twice: first with the indexes dropped
+(FK and unique_together indexes only, as before), then with them created.
+
+    python -m benchmarks.bench_indexes --tickets 500000 --notifications 200000
+"""
+import argparse
+import random
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+from django.db import connection
+from django.utils import timezone
+from core.models import Notification, Place, Queue, Ticket, TicketStatus, User
+
+HOT_PATH_INDEXES = {
+    Ticket: ("ticket_queue_status_idx", "ticket_active_user_idx", "ticket_queue_created_idx"),
+    Queue: ("queue_open_latest_idx",),
+    Notification: ("notification_user_created_idx", "notification_unread_idx"),
+}
+
+
+def populate(tickets, notifications, queues, users):
+    rng = random.Random(1)
+    people = User.objects.bulk_create([User(username=f"bench-{i}") for i in range(users)], batch_size=5000)
+    places = Place.objects.bulk_create([
+        Place(owner=people[i], name=f"p{i}", latitude=0, longitude=0) for i in range(queues // 2)
+    ])
+    all_queues = Queue.objects.bulk_create([
+        Queue(place=places[i % len(places)], is_open=i % 2 == 0) for i in range(queues)
+    ])
+    start = timezone.now() - timezone.timedelta(days=90)
+    Ticket.objects.bulk_create([
+        Ticket(queue=all_queues[i % queues], user=people[rng.randrange(users)], number=i + 1,
+               # بیشتر تیکت‌ها تمام‌شده‌اند؛ تعداد کمی فعال
+               status=TicketStatus.ACTIVE if rng.random() < 0.02 else rng.choice((TicketStatus.USED, TicketStatus.CANCELED)))
+        for i in range(tickets)
+    ], batch_size=5000)
+    Ticket.objects.update(created_at=start)
+    Notification.objects.bulk_create([
+        Notification(user=people[rng.randrange(users)], title="t", message="m", is_read=rng.random() < 0.9)
+        for _ in range(notifications)
+    ], batch_size=5000)
+    return all_queues[0], people[0]
+
+
+def analyze():
+    if connection.vendor in ("sqlite", "postgresql"):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+
+def set_indexes(enabled):
+    with connection.schema_editor() as editor:
+        for model, names in HOT_PATH_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    (editor.add_index if enabled else editor.remove_index)(model, index)
+    analyze()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickets", type=int, default=200_000)
+    parser.add_argument("--notifications", type=int, default=100_000)
+    parser.add_argument("--queues", type=int, default=50)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        queue, user = populate(args.tickets, args.notifications, args.queues, args.users)
+        now = timezone.now()
+        cases = {
+            "active tickets of queue": lambda: list(
+                Ticket.objects.filter(queue=queue, status=TicketStatus.ACTIVE).order_by("number")[:50]),
+            "join: user has active ticket": lambda: Ticket.objects.filter(
+                queue=queue, user=user, status=TicketStatus.ACTIVE).exists(),
+            "queue tickets by created_at": lambda: Ticket.objects.filter(
+                queue=queue, created_at__gte=now - timezone.timedelta(days=1)).count(),
+            "latest open queue of place": lambda: Queue.objects.filter(
+                place_id=queue.place_id, is_open=True).latest("created_at"),
+            "notifications page": lambda: list(
+                Notification.objects.filter(user=user).order_by("-created_at", "-id")[:50]),
+            "unread notifications page": lambda: list(
+                Notification.objects.filter(user=user, is_read=False).order_by("-created_at", "-id")[:50]),
+        }
+        results = {}
+        for label, enabled in (("before_ms", False), ("after_ms", True)):
+            set_indexes(enabled)
+            for name, fn in cases.items():
+                results.setdefault(name, {})[label] = measure(fn, repeat=args.repeat)["p50_ms"]
+        for name, timing in results.items():
+            rows.append({"query": name, **timing,
+                         "speedup": f"{timing['before_ms'] / max(timing['after_ms'], 1e-6):.1f}x"})
+    print_table(rows, ["query", "before_ms", "after_ms", "speedup"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Concurrent ticket joins: old ``Max("number") + 1`` allocation vs. Queue.issue_ticket.
+
+    python -m benchmarks.bench_join --joins 500 --threads 16
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import benchmark_database, print_table
+
+from django.db import connection, IntegrityError, OperationalError
+from django.db.models import Max
+from core.models import Place, Queue, Ticket, User
+
+
+def max_plus_one(queue, user):
+    last_num = Ticket.objects.filter(queue=queue).aggregate(Max("number"))["number__max"] or 0
+    return Ticket.objects.create(queue=queue, user=user, number=last_num + 1)
+
+
+def atomic_allocator(queue, user):
+    return queue.issue_ticket(user)
+
+
+def run(strategy, queue, users, threads):
+    def join(user):
+        try:
+            strategy(queue, user)
+            return None
+        except (IntegrityError, OperationalError) as exc:
+            return type(exc).__name__
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        errors = [e for e in pool.map(join, users) if e]
+    elapsed = time.perf_counter() - start
+
+    numbers = list(Ticket.objects.filter(queue=queue).values_list("number", flat=True))
+    return {
+        "strategy": strategy.__name__,
+        "joins": len(users),
+        "threads": threads,
+        "created": len(numbers),
+        "errors": len(errors),
+        "duplicates": len(numbers) - len(set(numbers)),
+        "joins_per_s": round(len(users) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--joins", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        owner = User.objects.create(username="bench-owner", role="place_admin")
+        place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+        users = User.objects.bulk_create([User(username=f"bench-{i}") for i in range(args.joins)])
+        for strategy in (max_plus_one, atomic_allocator):
+            queue = Queue.objects.create(place=place)
+            rows.append(run(strategy, queue, users, args.threads))
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+NearbyPlacesView lookup: full table scan with per-row haversine vs. core.geo.nearby_places.
+
+    python -m benchmarks.bench_nearby --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+from core.geo import geocell, haversine, nearby_places
+from core.models import Place, User
+
+
+def populate(owner, count, batch_size=5000):
+    rnd = random.Random(count)
+    Place.objects.all().delete()
+    for start in range(0, count, batch_size):
+        batch = []
+        for _ in range(min(batch_size, count - start)):
+            # مکان‌ها در محدوده‌ی ایران پخش می‌شوند
+            lat, lon = rnd.uniform(25, 40), rnd.uniform(44, 63)
+            batch.append(Place(owner=owner, name="p", latitude=lat, longitude=lon, geocell=geocell(lat, lon)))
+        Place.objects.bulk_create(batch)
+
+
+def full_scan(lat, lon, radius):
+    return [p for p in Place.objects.all() if haversine(lat, lon, p.latitude, p.longitude) <= radius]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--radius", type=float, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    lat, lon = 35.7, 51.4
+    rows = []
+    with benchmark_database():
+        owner = User.objects.create(username="bench-owner", role="place_admin")
+        for size in args.sizes:
+            populate(owner, size)
+            # full scan is slow at large sizes, a few samples are enough
+            scan = measure(lambda: full_scan(lat, lon, args.radius), repeat=max(1, args.repeat // 5), warmup=0)
+            indexed = measure(lambda: nearby_places(Place.objects.all(), lat, lon, args.radius), repeat=args.repeat)
+            knn = measure(lambda: nearby_places(Place.objects.all(), lat, lon, args.radius, limit=args.limit), repeat=args.repeat)
+            rows.append({
+                "places": size,
+                "full_scan_p50_ms": scan["p50_ms"],
+                "indexed_p50_ms": indexed["p50_ms"],
+                "indexed_p95_ms": indexed["p95_ms"],
+                f"k{args.limit}_p50_ms": knn["p50_ms"],
+                "speedup": round(scan["p50_ms"] / max(indexed["p50_ms"], 1e-6), 1),
+            })
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Ticket and notification listings at large history sizes:
+unpaginated (old), OFFSET pagination at increasing depth, and keyset cursors.
+
+    python -m benchmarks.bench_pagination --rows 100000
+"""
+import argparse
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.models import Notification, Place, Queue, Ticket, User
+from core.serializers import NotificationSerializer, TicketSerializer
+
+
+def populate(rows):
+    owner = User.objects.create(username="bench-owner", role="place_admin")
+    customer = User.objects.create(username="bench-customer")
+    place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    Ticket.objects.bulk_create(
+        [Ticket(queue=queue, user=customer, number=i + 1, status="used") for i in range(rows)], batch_size=5000,
+    )
+    Notification.objects.bulk_create(
+        [Notification(user=customer, title="t", message="m") for _ in range(rows)], batch_size=5000,
+    )
+    return owner, customer, queue
+
+
+def cursor_at(client, url, depth, page_size):
+    """Follow cursors until roughly `depth` rows deep and return that page's URL."""
+    next_url = f"{url}?page_size=200"
+    for _ in range(depth // 200):
+        next_url = client.get(next_url).json()["next"]
+    return next_url.replace("page_size=200", f"page_size={page_size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        owner, customer, queue = populate(args.rows)
+        admin_client, customer_client = APIClient(), APIClient()
+        admin_client.force_authenticate(owner)
+        customer_client.force_authenticate(customer)
+        tickets_url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+        notifications_url = reverse("notifications")
+        deep = args.rows * 9 // 10
+
+        cases = [
+            ("tickets", "unpaginated (old)", lambda: TicketSerializer(
+                Ticket.objects.filter(queue=queue).order_by("number"), many=True).data),
+            ("tickets", "offset, first page", lambda: TicketSerializer(
+                Ticket.objects.filter(queue=queue).order_by("number")[:args.page_size], many=True).data),
+            ("tickets", f"offset at {deep}", lambda: TicketSerializer(
+                Ticket.objects.filter(queue=queue).order_by("number")[deep:deep + args.page_size], many=True).data),
+            ("notifications", "unpaginated (old)", lambda: NotificationSerializer(
+                Notification.objects.filter(user=customer).order_by("-created_at"), many=True).data),
+            ("notifications", f"offset at {deep}", lambda: NotificationSerializer(
+                Notification.objects.filter(user=customer).order_by("-created_at", "-id")[deep:deep + args.page_size],
+                many=True).data),
+        ]
+        for name, client, url in (("tickets", admin_client, tickets_url),
+                                  ("notifications", customer_client, notifications_url)):
+            first = f"{url}?page_size={args.page_size}"
+            cases.append((name, "keyset, first page", lambda c=client, u=first: c.get(u)))
+            deep_url = cursor_at(client, url, deep, args.page_size)
+            cases.append((name, f"keyset at {deep}", lambda c=client, u=deep_url: c.get(u)))
+
+        for listing, strategy, fn in cases:
+            repeat = 3 if "unpaginated" in strategy else args.repeat
+            result = measure(fn, repeat=repeat, warmup=1)
+            rows.append({"listing": listing, "strategy": strategy, "rows": args.rows,
+                         "p50_ms": result["p50_ms"], "p95_ms": result["p95_ms"]})
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Write latency under analytics load, with the heavy read views on the primary vs. on a
+read replica (core.db.ReplicaRouter).
+
+Two SQLite files stand in for primary and replica: the test database is populated,
+then copied with the sqlite3 backup API to the replica file (a static copy, so there
+is no replication lag to tolerate here). Reader processes hammer the analytics view
+over an hourly range and the admin ticket list; the main process measures queue
+joins (POST /api/queues/<id>/join/). With rollback-journal SQLite a reader's SHARED
+lock holds off the writer's commit, which is the contention the replica removes.
+
+    python -m benchmarks.bench_replica --readers 4 --writes 200
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+
+os.environ.setdefault("SMARTQUEUE_REPLICA_DB", os.path.join(tempfile.gettempdir(), "smartqueue_bench_replica.sqlite3"))
+
+from benchmarks.common import benchmark_database, print_table, summarize  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from core.models import Place, Queue, Ticket, TicketRollup, User  # noqa: E402
+
+
+def populate(rows, days):
+    owner = User.objects.create(username="bench-owner", role="place_admin")
+    analyst = User.objects.create(username="bench-analyst", role="super_admin")
+    place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    statuses = ("used", "used", "canceled", "active")
+    Ticket.objects.bulk_create(
+        [Ticket(queue=queue, user=owner, number=i + 1, status=statuses[i % 4]) for i in range(rows)],
+        batch_size=5000,
+    )
+    now = timezone.now()
+    per_day = rows // days + 1
+    for day in range(days):
+        created = now - timedelta(days=day, hours=day % 24)
+        Ticket.objects.filter(queue=queue, number__gt=day * per_day, number__lte=(day + 1) * per_day).update(
+            created_at=created, called_at=created + timedelta(minutes=5 + day % 7),
+        )
+    TicketRollup.rebuild(queue_ids=[queue.id])
+    Queue.objects.filter(pk=queue.pk).update(last_ticket_number=rows)
+    return owner, analyst, place, queue
+
+
+def copy_to_replica():
+    connections.close_all()
+    source = sqlite3.connect(str(settings.DATABASES["default"]["NAME"]))
+    target = sqlite3.connect(str(settings.DATABASES["replica"]["NAME"]))
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+
+
+def reader(replicas, owner_id, analyst_id, place_id, queue_id, days, stop, counter):
+    connections.close_all()  # inherited from the parent process
+    settings.DATABASE_REPLICAS = replicas
+    owner, analyst = APIClient(), APIClient()
+    owner.force_authenticate(User.objects.get(pk=owner_id))
+    analyst.force_authenticate(User.objects.get(pk=analyst_id))
+    analytics = reverse("analytics")
+    tickets = reverse("admin-tickets", kwargs={"queue_id": queue_id})
+    start_date = (timezone.now() - timedelta(days=days)).isoformat()
+    done = 0
+    while not stop.is_set():
+        analyst.get(analytics, {"place_id": place_id, "start_date": start_date})
+        owner.get(tickets, {"status": "used"})
+        done += 2
+    with counter.get_lock():
+        counter.value += done
+
+
+def run(mode, replicas, readers, writes, owner, analyst, place, queue, days):
+    settings.DATABASE_REPLICAS = replicas
+    users = User.objects.bulk_create([User(username=f"bench-{mode}-{i}") for i in range(writes)])
+    context = multiprocessing.get_context("fork")
+    stop, counter = context.Event(), context.Value("i", 0)
+    connections.close_all()
+    processes = [
+        context.Process(target=reader, args=(replicas, owner.id, analyst.id, place.id, queue.id, days, stop, counter))
+        for _ in range(readers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.5 if readers else 0)
+
+    url = reverse("join-queue", kwargs={"place_id": place.id})
+    client = APIClient()
+    samples = []
+    start = time.perf_counter()
+    for user in users:
+        client.force_authenticate(user)
+        begin = time.perf_counter()
+        response = client.post(url)
+        samples.append(time.perf_counter() - begin)
+        assert response.status_code == 201, response.content
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for process in processes:
+        process.join()
+    result = summarize(samples)
+    return {
+        "reads_on": mode,
+        "readers": readers,
+        "writes": writes,
+        "write_p50_ms": result["p50_ms"],
+        "write_p95_ms": result["p95_ms"],
+        "write_p99_ms": result["p99_ms"],
+        "reads_per_s": round(counter.value / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        owner, analyst, place, queue = populate(args.rows, args.days)
+        copy_to_replica()
+        cases = (
+            ("idle", [], 0),
+            ("primary", [], args.readers),
+            ("replica", ["replica"], args.readers),
+        )
+        for mode, replicas, readers in cases:
+            rows.append(run(mode, replicas, readers, args.writes, owner, analyst, place, queue, args.days))
+        connections["replica"].close()
+    os.remove(settings.DATABASES["replica"]["NAME"])
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
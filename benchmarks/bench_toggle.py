@@ -0,0 +1,77 @@
+"""
+Queue close/open fan-out: the old per-ticket loop vs. toggle_open + bulk outbox dispatch.
+
+    python -m benchmarks.bench_toggle --sizes 100 1000 10000
+"""
+import argparse
+import time
+
+from benchmarks.common import benchmark_database, print_table
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from core.models import Notification, Place, Queue, Ticket, User
+from core.outbox import dispatch_pending
+from core.utils import create_notification, send_ws_notification, send_email_notification
+from core.views import QueueAdminViewSet
+
+
+def per_ticket_loop(queue):
+    # the original toggle_open body
+    queue.is_open = not queue.is_open
+    queue.save()
+    title = "تغییر وضعیت صف"
+    message = f"صف {queue.name} اکنون {'باز' if queue.is_open else 'بسته'} است."
+    for t in queue.tickets.filter(status="active"):
+        create_notification(t.user, title, message)
+        send_ws_notification(t.user.id, {"title": title, "message": message})
+        if t.user.email:
+            send_email_notification(title, message, [t.user.email])
+
+
+def bulk_outbox(queue):
+    QueueAdminViewSet.toggle_open(queue)
+    while dispatch_pending():
+        pass
+
+
+def populate(place, size):
+    queue = Queue.objects.create(place=place)
+    users = User.objects.bulk_create(
+        [User(username=f"q{queue.id}-{i}", email=f"q{queue.id}-{i}@example.com") for i in range(size)]
+    )
+    Ticket.objects.bulk_create(
+        [Ticket(queue=queue, user=u, number=i + 1) for i, u in enumerate(users)], batch_size=1000,
+    )
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000])
+    args = parser.parse_args()
+
+    rows = []
+    with benchmark_database():
+        owner = User.objects.create(username="bench-owner", role="place_admin")
+        place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+        for size in args.sizes:
+            for strategy in (per_ticket_loop, bulk_outbox):
+                queue = populate(place, size)
+                Notification.objects.all().delete()
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    strategy(queue)
+                    elapsed = time.perf_counter() - start
+                rows.append({
+                    "active_tickets": size,
+                    "strategy": strategy.__name__,
+                    "seconds": round(elapsed, 3),
+                    "queries": len(queries),
+                    "notifications": Notification.objects.count(),
+                })
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
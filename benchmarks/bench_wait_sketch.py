@@ -0,0 +1,110 @@
+"""
+Wait-time percentiles: DDSketch (core.sketch) against exact NumPy percentiles.
+
+Accuracy is the relative error of p50/p90/p99 on synthetic wait distributions, against
+rank-based ("lower") exact percentiles, which is what the sketch estimates.
+Speed compares answering percentiles for a place from merged sketch bins in the
+database against loading every called ticket and running np.percentile.
+
+    python -m benchmarks.bench_wait_sketch --rows 10000 100000
+"""
+import argparse
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from benchmarks.common import benchmark_database, measure, print_table
+
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.utils import timezone
+from core.models import Place, Queue, Ticket, TicketRollup, TicketWaitBin, User
+from core.sketch import DEFAULT_QUANTILES, WaitSketch
+
+DISTRIBUTIONS = {
+    "lognormal": lambda rng, n: rng.lognormal(mean=5, sigma=1.2, size=n),
+    "exponential": lambda rng, n: rng.exponential(scale=300, size=n),
+    "bimodal": lambda rng, n: np.concatenate([rng.normal(60, 10, n // 2).clip(1), rng.normal(1800, 300, n - n // 2)]),
+}
+
+
+def accuracy(rows, rng):
+    results = []
+    for name, sample in DISTRIBUTIONS.items():
+        values = sample(rng, rows)
+        start = time.perf_counter()
+        # اسکچ 24 بخش جدا (مثل بازه‌های ساعتی) که ادغام می‌شوند
+        sketch = WaitSketch()
+        for part in np.array_split(values, 24):
+            sketch.merge(WaitSketch.from_values(part.tolist()))
+        estimates = sketch.quantiles()
+        sketch_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        exact = np.percentile(values, [q * 100 for q in DEFAULT_QUANTILES], method="lower")
+        numpy_ms = (time.perf_counter() - start) * 1000
+        row = {"distribution": name, "rows": rows, "bins": len(sketch.bins)}
+        for (key, estimate), value in zip(estimates.items(), exact):
+            row[f"{key}_err_%"] = round(abs(estimate - value) / value * 100, 3)
+        row.update({"build+merge_ms": round(sketch_ms, 1), "numpy_ms": round(numpy_ms, 2)})
+        results.append(row)
+    return results
+
+
+def populate(rows, days, rng):
+    owner = User.objects.create(username=f"bench-owner-{rows}", role="place_admin")
+    place = Place.objects.create(owner=owner, name="bench", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    Ticket.objects.bulk_create(
+        [Ticket(queue=queue, user=owner, number=i + 1, status="used") for i in range(rows)], batch_size=5000,
+    )
+    now = timezone.now()
+    waits = DISTRIBUTIONS["lognormal"](rng, rows)
+    tickets = list(Ticket.objects.filter(queue=queue).order_by("number"))
+    for i, ticket in enumerate(tickets):
+        ticket.created_at = now - timedelta(days=i % days, hours=i % 24)
+        ticket.called_at = ticket.created_at + timedelta(seconds=float(waits[i]))
+    Ticket.objects.bulk_update(tickets, ["created_at", "called_at"], batch_size=5000)
+    TicketRollup.rebuild(queue_ids=[queue.id])
+    return place
+
+
+def exact_from_tickets(place_id):
+    waits = Ticket.objects.filter(queue__place_id=place_id, called_at__isnull=False).annotate(
+        wait=ExpressionWrapper(F("called_at") - F("created_at"), output_field=DurationField())
+    ).values_list("wait", flat=True)
+    values = np.fromiter((w.total_seconds() for w in waits), dtype=float)
+    return np.percentile(values, [q * 100 for q in DEFAULT_QUANTILES], method="lower")
+
+
+def from_sketch_bins(place_id):
+    bins = TicketWaitBin.objects.filter(place_id=place_id, granularity="day")
+    return TicketWaitBin.sketch(bins).quantiles()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    rows = []
+    for n in args.rows:
+        rows += accuracy(n, rng)
+    print_table(rows, list(rows[0]))
+    print()
+
+    rows = []
+    with benchmark_database():
+        for n in args.rows:
+            place = populate(n, args.days, rng)
+            for strategy, fn in (("exact, tickets + numpy", lambda: exact_from_tickets(place.id)),
+                                 ("merged sketch bins", lambda: from_sketch_bins(place.id))):
+                result = measure(fn, repeat=args.repeat, warmup=1)
+                rows.append({"rows": n, "strategy": strategy, "p50_ms": result["p50_ms"], "p95_ms": result["p95_ms"]})
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+A minimal local Redis stand-in for benchmarks: a RESP2 server with just enough
+commands (PING, CLIENT, SELECT, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, FLUSHALL) for
+``channels_redis.pubsub.RedisPubSubChannelLayer``.
+
+Messages still go through the real channels_redis/redis-py code, msgpack and a
+loopback TCP hop, so this measures the layer's serialization and network overhead
+without needing a redis-server binary. Use --redis-url in the harness for a real Redis.
+``delay_ms`` holds every PUBLISH reply to simulate a slow or distant Redis.
+
+    with RedisStandin() as server:
+        layers = {"default": {"BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+                              "CONFIG": {"hosts": [server.url]}}}
+"""
+import asyncio
+import threading
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.strip().split()  # inline command
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+class RedisStandin:
+
+    def __init__(self, host="127.0.0.1", port=0, delay_ms=0):
+        self.host = host
+        self.port = port
+        self.delay_ms = delay_ms
+        self.subscribers = {}  # channel -> set of writers
+        self.published = 0
+        self.clients = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="redis-standin", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # close connections still open from other loops (e.g. channel_dispatcher)
+            for writer in list(self.clients):
+                writer.close()
+            tasks = asyncio.all_tasks(self._loop)
+            self._loop.run_until_complete(asyncio.wait(tasks, timeout=1) if tasks else asyncio.sleep(0))
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        subscribed = set()
+        self.clients.add(writer)
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                command, args = args[0].upper(), args[1:]
+                if command == b"SUBSCRIBE":
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode([b"subscribe", channel, len(subscribed)]))
+                elif command == b"UNSUBSCRIBE":
+                    for channel in args or list(subscribed):
+                        self.subscribers.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(encode([b"unsubscribe", channel, len(subscribed)]))
+                elif command == b"PUBLISH":
+                    channel, message = args
+                    receivers = self.subscribers.get(channel, ())
+                    frame = encode([b"message", channel, message])
+                    for receiver in receivers:
+                        receiver.write(frame)
+                    self.published += 1
+                    if self.delay_ms:
+                        await asyncio.sleep(self.delay_ms / 1000)
+                    writer.write(encode(len(receivers)))
+                elif command == b"PING":
+                    writer.write(encode([b"pong", b""]) if subscribed else b"+PONG\r\n")
+                elif command in (b"CLIENT", b"SELECT", b"FLUSHALL", b"FLUSHDB"):
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % command)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            for channel in subscribed:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
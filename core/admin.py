@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Place, Queue, Ticket, Notification
+from .models import User, Place, Queue, Ticket, Notification, OutboxEvent, TicketRollup
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -29,3 +29,13 @@ class TicketAdmin(admin.ModelAdmin):
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ("user", "title", "channel", "is_read", "created_at")
     list_filter = ("channel", "is_read")
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "available_at", "sent_at")
+    list_filter = ("kind", "status")
+
+@admin.register(TicketRollup)
+class TicketRollupAdmin(admin.ModelAdmin):
+    list_display = ("queue", "granularity", "bucket_start", "total_count", "used_count", "canceled_count")
+    list_filter = ("granularity",)
@@ -0,0 +1,45 @@
+"""
+بررسی backendهایی که باید بین پروسه‌ها مشترک باشند.
+
+dispatch_outbox پروسه‌ی جدایی است و پیام‌های وب‌سوکت را با group_send روی لایه‌ی کانال
+می‌فرستد؛ با InMemoryChannelLayer این پیام‌ها هرگز به پروسه‌ی ASGI نمی‌رسند ولی رویداد
+ارسال‌شده ثبت می‌شود. seq فید مکان‌ها (core.feed)، نسخه‌ی کاربرهای وب‌سوکت و pin خواندن از
+replica هم در cache جنگو هستند و با cache محلی هر پروسه دنباله و باطل‌سازی خودش را دارد.
+در DEBUG فقط هشدار داده می‌شود، در production خطا.
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+PROCESS_LOCAL_CHANNEL_LAYERS = ("channels.layers.InMemoryChannelLayer",)
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def process_local_backends():
+    """نام backendهای تنظیم‌شده‌ای که فقط داخل همین پروسه دیده می‌شوند."""
+    found = []
+    layer = getattr(settings, "CHANNEL_LAYERS", {}).get("default", {}).get("BACKEND")
+    if layer in PROCESS_LOCAL_CHANNEL_LAYERS:
+        found.append(f"CHANNEL_LAYERS ({layer})")
+    cache = caches["default"]
+    if isinstance(cache, PROCESS_LOCAL_CACHES):
+        found.append(f"CACHES ({type(cache).__name__})")
+    return found
+
+
+@checks.register(checks.Tags.compatibility)
+def check_shared_backends(app_configs, **kwargs):
+    backends = process_local_backends()
+    if not backends:
+        return []
+    level, check_id = (checks.Warning, "core.W001") if settings.DEBUG else (checks.Error, "core.E001")
+    return [
+        level(
+            f"{', '.join(backends)} is process-local; WebSocket pushes, place feed sequence "
+            "numbers and user cache invalidation will not be shared between processes.",
+            hint="Set REDIS_URL to use the Redis channel layer and cache.",
+            id=check_id,
+        )
+    ]
@@ -1,26 +1,86 @@
 import json
-import jwt
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
 from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from urllib.parse import parse_qs 
-from django.core.exceptions import ObjectDoesNotExist
-from rest_framework_simplejwt.tokens import AccessToken
 from django.conf import settings
+from .feed import place_feed, build_place_snapshot
+from .metrics import ws_connections
+from .tracing import close_traces
+from .utils import encode_envelope
 
 
 User = get_user_model()
 
 
-class QueueConsumer(AsyncWebsocketConsumer):
+class EnvelopeMixin:
+    """
+    ارسال پیام‌های encode_envelope بدون سریال‌سازی مجدد.
+    کلاینت با ?format=msgpack فریم باینری می‌گیرد (اگر WS_ENVELOPE_MSGPACK فعال باشد)،
+    بقیه فریم JSON همان پیام را؛ هر دو یک بار در encode_envelope ساخته شده‌اند.
+    """
+
+    @staticmethod
+    def is_envelope(event):
+        return "text" in event
+
+    def wants_msgpack(self):
+        query_params = parse_qs(self.scope.get("query_string", b"").decode())
+        return query_params.get("format", [None])[0] == "msgpack"
+
+    async def send_envelope(self, message):
+        if getattr(self, "binary", False) and "bytes" in message:
+            await self.send(bytes_data=message["bytes"])
+        else:
+            await self.send(text_data=message["text"])
+
+
+class ConnectionGaugeMixin:
+    """شمارش اتصال‌های پذیرفته‌شده در گیج smartqueue_websocket_connections به تفکیک کلاس مصرف‌کننده."""
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        self.counted = True
+        ws_connections.inc(consumer=type(self).__name__)
+
+    async def websocket_disconnect(self, message):
+        if getattr(self, "counted", False):
+            self.counted = False
+            ws_connections.dec(consumer=type(self).__name__)
+        await super().websocket_disconnect(message)
+
+
+class QueueConsumer(ConnectionGaugeMixin, EnvelopeMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        User = self.scope["user"].__class__
+        self.binary = self.wants_msgpack()
         self.place_id = self.scope['url_route']['kwargs']['place_id']
         self.group_name = f"place_{self.place_id}"
+        self.snapshot_seq = 0
 
+        # اول عضو گروه می‌شویم تا رویدادی بین snapshot و اتصال از دست نرود
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
+        since = self.get_since()
+        missed = await sync_to_async(place_feed.since)(self.place_id, since) if since is not None else None
+        if missed is None:
+            snapshot = await database_sync_to_async(build_place_snapshot)(self.place_id)
+            self.snapshot_seq = snapshot["seq"]
+            await self.send_envelope(encode_envelope("queue_update", snapshot))
+        else:
+            self.snapshot_seq = since
+            if missed:
+                await self.send_envelope(encode_envelope("queue_update", {"type": "batch", "events": missed}))
+                self.snapshot_seq = missed[-1]["seq"]
+
+    def get_since(self):
+        query_params = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(query_params["since"][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
@@ -32,39 +92,51 @@ class QueueConsumer(AsyncWebsocketConsumer):
         """
         pass
 
+    def is_new(self, event):
+        # رویدادهایی که قبلاً در snapshot/replay آمده‌اند دوباره فرستاده نمی‌شوند
+        return not isinstance(event, dict) or event.get("seq", self.snapshot_seq + 1) > self.snapshot_seq
+
     async def queue_update(self, event):
         """
         دریافت آپدیت صف از group_send و ارسال آن به کلاینت.
         """
+        if self.is_envelope(event):
+            # فریم از قبل سریال شده؛ فقط اگر جدیدتر از snapshot باشد ارسال می‌شود.
+            # در فریم‌های batch ممکن است چند رویداد تکراری باشد، کلاینت با seq آن‌ها را رد می‌کند.
+            seq = event.get("seq")
+            if seq is None or seq > self.snapshot_seq:
+                await self.send_envelope(event)
+                close_traces(event, type(self).__name__)
+            return
+
         data = event.get("data")
+        if isinstance(data, dict) and data.get("type") == "batch":
+            events = [e for e in data["events"] if self.is_new(e)]
+            if not events:
+                return
+            data = {**data, "events": events}
+        elif not self.is_new(data):
+            return
         await self.send(text_data=json.dumps(data, ensure_ascii=False))
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(ConnectionGaugeMixin, EnvelopeMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        query_string = self.scope.get('query_string', b'').decode()
-        query_params = parse_qs(query_string)
-        token = query_params.get('token', [None])[0]
-
-        if not token:
-            await self.close(code=4001)  # No token provided
+        self.binary = self.wants_msgpack()
+        # کاربر توسط JWTAuthMiddleware (smartqueue/asgi.py) یک بار decode و از کش خوانده می‌شود
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            if self.scope.get("auth_error", "missing") == "missing":
+                await self.close(code=4001)  # No token provided
+            else:
+                await self.close(code=4003)  # Invalid token
             return
 
-        try:
-            # استفاده از SimpleJWT برای اعتبارسنجی توکن
-            access = AccessToken(token)
-            user_id = access["user_id"]
-
-            # واکشی یوزر از دیتابیس
-            self.user = await sync_to_async(User.objects.get)(id=user_id)
-
-            # ساختن group مخصوص این یوزر
-            self.group_name = f"user_{self.user.id}"
-            await self.channel_layer.group_add(self.group_name, self.channel_name)
-            await self.accept()
-
-        except Exception as e:
-            await self.close(code=4003)  # Invalid token or other error
+        self.user = user
+        # ساختن group مخصوص این یوزر
+        self.group_name = f"user_{self.user.id}"
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
 
     async def disconnect(self, close_code):
         if hasattr(self, "group_name"):
@@ -74,5 +146,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
 
     async def send_notification(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        if self.is_envelope(event):
+            await self.send_envelope(event)
+            close_traces(event, type(self).__name__)
+        else:
+            await self.send(text_data=json.dumps(event["message"]))
 
@@ -0,0 +1,116 @@
+"""
+مسیریابی خواندن‌ها به نسخه‌های فقط‌خواندنی دیتابیس (DATABASE_REPLICAS).
+
+فقط view‌ها و کدهایی که صریحاً اجازه داده‌اند (ReplicaReadMixin یا read_replica) از replica
+می‌خوانند؛ بقیه‌ی خواندن‌ها و همه‌ی نوشتن‌ها روی default هستند. کاربری که چیزی نوشته
+(ReplicaPinMiddleware) تا REPLICA_STICKY_SECONDS از default می‌خواند تا تأخیر replication
+نوشته‌ی خودش را از او پنهان نکند. pin در cache جنگو است؛ با چند پروسه باید cache مشترک باشد.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import registry
+
+_replica = contextvars.ContextVar("read_replica", default=None)  # (alias, عمق atomic در شروع)
+
+replica_reads = registry.counter(
+    "smartqueue_db_replica_reads_total", "Reads routed to a read replica.", ("alias",))
+
+
+def replica_aliases():
+    return [alias for alias in getattr(settings, "DATABASE_REPLICAS", ()) if alias in settings.DATABASES]
+
+
+def pin_key(user_id):
+    return f"db-pin:{user_id}"
+
+
+def pin_primary(user_id):
+    seconds = getattr(settings, "REPLICA_STICKY_SECONDS", 10)
+    if user_id is not None and seconds > 0:
+        cache.set(pin_key(user_id), True, seconds)
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(pin_key(user_id)) is not None
+
+
+def start_replica_reads(user_id=None):
+    """
+    از این به بعد خواندن‌های همین thread/context از یک replica (ثابت برای کل درخواست)؛
+    token برای end_replica_reads، یا None اگر replica نداریم یا کاربر pin شده است.
+    """
+    aliases = replica_aliases()
+    if not aliases or is_pinned(user_id):
+        return None
+    return _replica.set((random.choice(aliases), len(connections[DEFAULT_DB_ALIAS].atomic_blocks)))
+
+
+def end_replica_reads(token):
+    if token is not None:
+        _replica.reset(token)
+
+
+@contextmanager
+def read_replica(user_id=None):
+    """برای querysetهای فقط‌خواندنی خارج از view‌ها (گزارش‌ها، دستورات مدیریتی)."""
+    token = start_replica_reads(user_id)
+    try:
+        state = _replica.get()
+        yield state and state[0]
+    finally:
+        end_replica_reads(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _replica.get()
+        if state is None:
+            return None
+        alias, depth = state
+        if len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > depth:
+            # داخل تراکنشی که بعد از شروع باز شده (select_for_update، خواندن بعد از نوشتن) همیشه primary
+            return None
+        replica_reads.inc(alias=alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicaها کپی default هستند
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # جدول‌های replica از طریق replication ساخته می‌شوند
+        return db not in getattr(settings, "DATABASE_REPLICAS", ())
+
+
+class ReplicaReadMixin:
+    """
+    view‌ای که درخواست‌های GET/HEAD آن (یا فقط replica_actions در ViewSet) از replica می‌خوانند.
+    احراز هویت و permissionها قبل از آن و روی default انجام می‌شوند.
+    """
+
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_token = None
+        if request.method in SAFE_METHODS and (
+            self.replica_actions is None or getattr(self, "action", None) in self.replica_actions
+        ):
+            user = getattr(request, "user", None)
+            self._replica_token = start_replica_reads(user.pk if user is not None else None)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        end_replica_reads(getattr(self, "_replica_token", None))
+        self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
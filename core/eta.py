@@ -0,0 +1,251 @@
+"""
+موقعیت در صف و زمان تخمینی فراخوانی (ETA) برای هر تیکت.
+
+- نرخ سرویس هر صف: میانگین نمایی (EWMA) فاصله‌ی بین دو سرویس متوالی (فراخوانی یا تکمیل تیکت
+  منتظر)؛ در Queue.service_interval_ewma ذخیره و توسط core.signals به‌روز می‌شود.
+- موقعیت: درخت Fenwick روی شماره‌ی تیکت‌های منتظر (ACTIVE و فراخوانی‌نشده)، O(log n) برای
+  درج/حذف/شمارش. ایندکس در حافظه‌ی همین پروسه است، با سیگنال‌ها نگه‌داری و بعد از ETA_INDEX_TTL
+  ثانیه از دیتابیس دوباره خوانده می‌شود تا تغییرات پروسه‌های دیگر هم دیده شوند.
+- ETA‌ی جدید فقط وقتی بیش از ETA_PUSH_THRESHOLD_SECONDS تغییر کند به گروه user_{id} فرستاده می‌شود.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from .models import Queue, TicketStatus
+from .utils import send_ws_messages
+
+
+def is_waiting(status, called_at):
+    return status == TicketStatus.ACTIVE and called_at is None
+
+
+class PositionIndex:
+    """
+    درخت Fenwick روی شماره‌ی تیکت‌ها (با آفست base)؛ ahead(n) تعداد شماره‌های کوچک‌تر از n است.
+    """
+
+    def __init__(self, numbers=()):
+        self.numbers = set(numbers)
+        self._rebuild()
+
+    def _rebuild(self):
+        self.base = min(self.numbers, default=1)
+        size = max(64, 2 * (max(self.numbers, default=1) - self.base + 1))
+        tree = [0] * (size + 1)
+        for number in self.numbers:
+            tree[number - self.base + 1] += 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _update(self, number, delta):
+        i, size = number - self.base + 1, len(self.tree) - 1
+        while i <= size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def add(self, number):
+        if number in self.numbers:
+            return
+        self.numbers.add(number)
+        if number < self.base or number - self.base + 1 >= len(self.tree):
+            self._rebuild()
+        else:
+            self._update(number, 1)
+
+    def discard(self, number):
+        if number in self.numbers:
+            self.numbers.remove(number)
+            self._update(number, -1)
+
+    def ahead(self, number):
+        i = min(number - self.base, len(self.tree) - 1)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def __len__(self):
+        return len(self.numbers)
+
+
+class QueueETA:
+
+    def __init__(self, interval, last_service_at, waiting):
+        self.interval = interval
+        self.last_service_at = last_service_at
+        self.loaded_at = time.monotonic()
+        self.tickets = {ticket_id: (number, user_id) for ticket_id, number, user_id in waiting}
+        self.index = PositionIndex(number for number, _ in self.tickets.values())
+        # آخرین ETA که برای هر تیکت فرستاده (یا در پاسخ API دیده) شده
+        self.pushed = {}
+
+    def estimate(self, ahead, now=None):
+        if self.interval is None:
+            return None
+        now = now or timezone.now()
+        next_call = now + timedelta(seconds=self.interval)
+        if self.last_service_at is not None:
+            next_call = max(now, self.last_service_at + timedelta(seconds=self.interval))
+        return next_call + timedelta(seconds=self.interval * ahead)
+
+
+class ETAEngine:
+
+    def __init__(self, alpha=None, ttl=None, threshold=None):
+        self.alpha = alpha
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._queues = {}
+
+    def get_alpha(self):
+        return self.alpha if self.alpha is not None else getattr(settings, "ETA_EWMA_ALPHA", 0.3)
+
+    def get_ttl(self):
+        return self.ttl if self.ttl is not None else getattr(settings, "ETA_INDEX_TTL", 30)
+
+    def get_threshold(self):
+        return self.threshold if self.threshold is not None else getattr(settings, "ETA_PUSH_THRESHOLD_SECONDS", 60)
+
+    def reset(self):
+        with self._lock:
+            self._queues.clear()
+
+    def invalidate(self, queue_id):
+        with self._lock:
+            self._queues.pop(queue_id, None)
+
+    def _state(self, queue_id):
+        with self._lock:
+            state = self._queues.get(queue_id)
+            if state is not None and time.monotonic() - state.loaded_at < self.get_ttl():
+                return state
+        # یک کوئری: صف با LEFT JOIN روی تیکت‌های منتظرش
+        rows = list(Queue.objects.filter(pk=queue_id).annotate(
+            waiting=FilteredRelation(
+                "tickets", condition=Q(tickets__status=TicketStatus.ACTIVE, tickets__called_at__isnull=True),
+            ),
+        ).values_list("service_interval_ewma", "last_service_at", "waiting__id", "waiting__number", "waiting__user_id"))
+        if not rows:
+            return None
+        waiting = [(ticket_id, number, user_id) for _, _, ticket_id, number, user_id in rows if ticket_id is not None]
+        fresh = QueueETA(rows[0][0], rows[0][1], waiting)
+        with self._lock:
+            if state is not None:
+                fresh.pushed = state.pushed
+            self._queues[queue_id] = fresh
+        return fresh
+
+    def position(self, ticket):
+        """
+        جایگاه تیکت منتظر در صف (1 = نفر بعدی)؛ None برای تیکت‌های غیرمنتظر.
+        """
+        if not is_waiting(ticket.status, ticket.called_at):
+            return None
+        state = self._state(ticket.queue_id)
+        if state is None:
+            return None
+        with self._lock:
+            return state.index.ahead(ticket.number) + 1
+
+    def estimated_call_at(self, ticket):
+        if not is_waiting(ticket.status, ticket.called_at):
+            return None
+        state = self._state(ticket.queue_id)
+        if state is None:
+            return None
+        with self._lock:
+            eta = state.estimate(state.index.ahead(ticket.number))
+            state.pushed.setdefault(ticket.id, eta)
+        return eta
+
+    def record_service(self, queue, at):
+        """
+        به‌روزرسانی EWMA فاصله‌ی سرویس صف؛ فاصله‌های بیشتر از ETA_MAX_SERVICE_INTERVAL (صف بیکار) نادیده گرفته می‌شوند.
+        """
+        interval = queue.service_interval_ewma
+        if queue.last_service_at is not None:
+            sample = (at - queue.last_service_at).total_seconds()
+            if 0 < sample <= getattr(settings, "ETA_MAX_SERVICE_INTERVAL", 3600):
+                alpha = self.get_alpha()
+                interval = sample if interval is None else alpha * sample + (1 - alpha) * interval
+        if queue.last_service_at is not None and at < queue.last_service_at:
+            at = queue.last_service_at
+        Queue.objects.filter(pk=queue.pk).update(service_interval_ewma=interval, last_service_at=at)
+        queue.service_interval_ewma, queue.last_service_at = interval, at
+        with self._lock:
+            state = self._queues.get(queue.pk)
+            if state is not None:
+                state.interval, state.last_service_at = interval, at
+
+    def tickets_changed(self, queue_id, changes):
+        """
+        از core.signals بعد از ذخیره/حذف تیکت‌ها؛ changes لیست (ticket, old_state, new_state) با state
+        همان Ticket.rollup_state() (None = وجود ندارد). ایندکس حافظه را به‌روز می‌کند و زمان آخرین سرویس
+        (تیکت منتظری که فراخوانی یا تکمیل شد) یا None را برمی‌گرداند؛ record_service و push_updates
+        را core.signals صدا می‌زند.
+        """
+        serviced = None
+        with self._lock:
+            state = self._queues.get(queue_id)
+            for ticket, old_state, new_state in changes:
+                # wait_seconds (state[2]) فقط وقتی None است که تیکت فراخوانی نشده باشد
+                was_waiting = old_state is not None and is_waiting(old_state[1], old_state[2])
+                now_waiting = new_state is not None and is_waiting(new_state[1], new_state[2])
+                if was_waiting == now_waiting:
+                    continue
+                if state is not None:
+                    if now_waiting:
+                        state.tickets[ticket.pk] = (ticket.number, ticket.user_id)
+                        state.index.add(ticket.number)
+                    else:
+                        state.tickets.pop(ticket.pk, None)
+                        state.pushed.pop(ticket.pk, None)
+                        state.index.discard(ticket.number)
+                if was_waiting and new_state is not None and new_state[1] != TicketStatus.CANCELED:
+                    at = ticket.called_at or ticket.completed_at or timezone.now()
+                    serviced = at if serviced is None else max(serviced, at)
+        return serviced
+
+    def push_updates(self, queue_id):
+        """
+        ارسال ETA‌ی تیکت‌هایی که بیش از آستانه تغییر کرده‌اند به user_{id}.
+        """
+        state = self._state(queue_id)
+        if state is None:
+            return 0
+        threshold = self.get_threshold()
+        now = timezone.now()
+        messages = []
+        with self._lock:
+            for ahead, (ticket_id, (number, user_id)) in enumerate(
+                sorted(state.tickets.items(), key=lambda item: item[1][0])
+            ):
+                eta = state.estimate(ahead, now)
+                last = state.pushed.get(ticket_id, eta)
+                state.pushed.setdefault(ticket_id, eta)
+                if eta == last or (eta and last and abs((eta - last).total_seconds()) <= threshold):
+                    continue
+                state.pushed[ticket_id] = eta
+                messages.append((user_id, {
+                    "type": "eta_update",
+                    "ticket_id": ticket_id,
+                    "queue_id": queue_id,
+                    "position": ahead + 1,
+                    "estimated_call_at": eta,
+                }))
+        if messages:
+            send_ws_messages(messages)
+        return len(messages)
+
+
+eta_engine = ETAEngine()
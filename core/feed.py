@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Queue, Ticket, TicketStatus
+
+
+class PlaceFeed:
+    """
+    شماره‌ی ترتیبی (seq) صعودی برای رویدادهای هر مکان و یک بافر محدود از آخرین رویدادها،
+    تا کلاینتی که با ?since=<seq> دوباره وصل می‌شود فقط رویدادهای از دست رفته را بگیرد.
+
+    seq با cache.incr از cache جنگو گرفته می‌شود تا پروسه‌های وب و dispatch_outbox یک دنباله‌ی
+    مشترک داشته باشند (با چند پروسه cache باید مشترک باشد، مثل Redis). شمارنده‌ی گم‌شده (evict)
+    از زمان فعلی به میکروثانیه شروع می‌شود تا seq به عقب برنگردد.
+    بافر در حافظه‌ی همین پروسه است و رویدادهای پروسه‌های دیگر را ندارد؛ اگر رویدادهای بعد از
+    seq درخواستی پشت سر هم در بافر نباشند snapshot فرستاده می‌شود.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def get_size(self):
+        if self.size is not None:
+            return self.size
+        return getattr(settings, "QUEUE_REPLAY_BUFFER_SIZE", 500)
+
+    @staticmethod
+    def key(place_id):
+        return f"place-feed-seq:{place_id}"
+
+    def next_seq(self, place_id):
+        key = self.key(place_id)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1_000_000), None)
+            return cache.incr(key)
+
+    def stamp(self, place_id, data: dict):
+        place_id = int(place_id)
+        with self._lock:
+            # زیر lock تا بافر این پروسه به ترتیب seq بماند
+            seq = self.next_seq(place_id)
+            event = {**data, "seq": seq}
+            buffer = self._buffers.get(place_id)
+            if buffer is None or buffer.maxlen != self.get_size():
+                buffer = self._buffers[place_id] = deque(buffer or (), maxlen=self.get_size())
+            buffer.append(event)
+        return event
+
+    def current(self, place_id):
+        return cache.get(self.key(int(place_id)), 0)
+
+    def since(self, place_id, seq):
+        """
+        رویدادهای بعد از seq، یا None اگر فاصله از بافر بیشتر باشد (باید snapshot فرستاد).
+        """
+        place_id = int(place_id)
+        current = self.current(place_id)
+        if seq == current:
+            return []
+        if seq < 0 or seq > current:
+            return None
+        with self._lock:
+            missed = [event for event in self._buffers.get(place_id, ()) if event["seq"] > seq]
+        # رویدادی از پروسه‌ی دیگر یا بیرون از بافر جا افتاده
+        if [event["seq"] for event in missed] != list(range(seq + 1, current + 1)):
+            return None
+        return missed
+
+
+place_feed = PlaceFeed()
+
+
+def build_place_snapshot(place_id):
+    """
+    وضعیت فعلی صف‌های یک مکان به صورت فشرده برای ارسال هنگام اتصال.
+    seq قبل از کوئری خوانده می‌شود؛ رویدادهای بعد از آن به هر حال به کلاینت می‌رسند.
+    """
+    seq = place_feed.current(place_id)
+    queues = [
+        {
+            "id": q.id,
+            "name": q.name,
+            "is_open": q.is_open,
+            "stats": {
+                "processed_count": q.processed_count,
+                "total_tickets": q.total_tickets,
+                "last_ticket_number": q.last_ticket_number,
+                "average_wait_time": q.average_wait_time.total_seconds(),
+            },
+        }
+        for q in Queue.objects.filter(place_id=place_id).order_by("id")
+    ]
+    tickets = [
+        {
+            "id": t["id"],
+            "queue_id": t["queue_id"],
+            "number": t["number"],
+            "called_at": t["called_at"].isoformat() if t["called_at"] else None,
+        }
+        for t in Ticket.objects.filter(queue__place_id=place_id, status=TicketStatus.ACTIVE)
+        .order_by("queue_id", "number").values("id", "queue_id", "number", "called_at")
+    ]
+    return {"type": "snapshot", "seq": seq, "place_id": int(place_id), "queues": queues, "tickets": tickets}
@@ -0,0 +1,127 @@
+from math import radians, cos, sin, asin, sqrt, floor
+
+import numpy as np
+from django.db.models import Q
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.32
+
+# اندازه‌ی هر خانه‌ی شبکه (درجه) ≈ 11 کیلومتر
+CELL_SIZE = 0.1
+# اگر محدوده‌ی جستجو خانه‌های بیشتری پوشش دهد فقط bounding box استفاده می‌شود
+MAX_CELLS = 256
+# حداکثر نتایجی که با یک id__in واکشی می‌شوند
+IN_BULK_MAX = 500
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    return R * c
+
+
+def haversine_many(lat, lon, lats, lons):
+    """
+    فاصله‌ی یک نقطه تا آرایه‌ای از نقاط (کیلومتر)، به صورت برداری با NumPy.
+    """
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _lat_index(lat):
+    return min(int(floor((lat + 90) / CELL_SIZE)), int(round(180 / CELL_SIZE)) - 1)
+
+
+def _lon_index(lon):
+    return int(floor((lon + 180) / CELL_SIZE)) % int(round(360 / CELL_SIZE))
+
+
+def geocell(lat, lon):
+    return f"{_lat_index(lat)}:{_lon_index(lon)}"
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    محدوده‌ی (lat_min, lat_max, [(lon_min, lon_max), ...]) که دایره را پوشش می‌دهد.
+    اگر محدوده از نصف‌النهار 180 عبور کند به دو بازه شکسته می‌شود.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    cos_lat = min(cos(radians(lat_min)), cos(radians(lat_max)))
+    if lat_min <= -90 or lat_max >= 90 or cos_lat <= 1e-9:
+        return lat_min, lat_max, [(-180.0, 180.0)]
+    dlon = radius_km / (KM_PER_DEGREE * cos_lat)
+    if dlon >= 180:
+        return lat_min, lat_max, [(-180.0, 180.0)]
+
+    lon_min, lon_max = lon - dlon, lon + dlon
+    if lon_min < -180:
+        return lat_min, lat_max, [(lon_min + 360, 180.0), (-180.0, lon_max)]
+    if lon_max > 180:
+        return lat_min, lat_max, [(lon_min, 180.0), (-180.0, lon_max - 360)]
+    return lat_min, lat_max, [(lon_min, lon_max)]
+
+
+def cells_for_bbox(lat_min, lat_max, lon_ranges):
+    """
+    لیست خانه‌های شبکه که bounding box را پوشش می‌دهند، یا None اگر تعدادشان زیاد باشد.
+    """
+    lat_cells = range(_lat_index(lat_min), _lat_index(lat_max) + 1)
+    lon_cells = []
+    for lon_min, lon_max in lon_ranges:
+        start, end = int(floor((lon_min + 180) / CELL_SIZE)), int(floor((lon_max + 180) / CELL_SIZE))
+        lon_cells.extend(i % int(round(360 / CELL_SIZE)) for i in range(start, end + 1))
+    if len(lat_cells) * len(lon_cells) > MAX_CELLS:
+        return None
+    return [f"{i}:{j}" for i in lat_cells for j in dict.fromkeys(lon_cells)]
+
+
+def bbox_filter(lat, lon, radius_km):
+    lat_min, lat_max, lon_ranges = bounding_box(lat, lon, radius_km)
+    lon_q = Q()
+    for lon_min, lon_max in lon_ranges:
+        lon_q |= Q(longitude__gte=lon_min, longitude__lte=lon_max)
+    q = Q(latitude__gte=lat_min, latitude__lte=lat_max) & lon_q
+
+    cells = cells_for_bbox(lat_min, lat_max, lon_ranges)
+    if cells is not None:
+        q &= Q(geocell__in=cells)
+    return q
+
+
+def nearby_places(queryset, lat, lon, radius_km, limit=None):
+    """
+    مکان‌های داخل شعاع radius_km مرتب بر اساس فاصله: لیست (place, distance_km).
+
+    ابتدا با خانه‌های شبکه و bounding box در SQL کاندیدها انتخاب می‌شوند،
+    سپس فاصله‌ی دقیق به صورت برداری محاسبه و نتایج نهایی واکشی می‌شوند (همیشه دو کوئری).
+    """
+    candidates = queryset.filter(bbox_filter(lat, lon, radius_km))
+    rows = list(candidates.values_list("id", "latitude", "longitude"))
+    if not rows:
+        return []
+
+    ids, lats, lons = (np.asarray(col) for col in zip(*rows))
+    distances = haversine_many(lat, lon, lats.astype(float), lons.astype(float))
+    inside = np.flatnonzero(distances <= radius_km)
+
+    if limit is not None and limit < len(inside):
+        nearest = np.argpartition(distances[inside], limit)[:limit]
+        inside = inside[nearest]
+    inside = inside[np.argsort(distances[inside], kind="stable")]
+
+    result_ids = [int(ids[i]) for i in inside]
+    if len(result_ids) <= IN_BULK_MAX:
+        places = queryset.in_bulk(result_ids)
+    else:
+        # برای نتایج زیاد همان کاندیدها دوباره خوانده می‌شوند تا IN بزرگ (چند کوئری در SQLite) ساخته نشود
+        wanted = set(result_ids)
+        places = {p.id: p for p in candidates if p.id in wanted}
+    return [(places[int(ids[i])], float(distances[i])) for i in inside]
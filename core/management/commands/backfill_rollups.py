@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import TicketRollup
+
+
+def parse_bound(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"invalid date: {value}")
+        moment = timezone.datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Rebuild hourly/daily ticket rollups used by the analytics endpoint from the tickets table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", type=int, action="append", dest="queues", help="Queue id (repeatable).")
+        parser.add_argument("--since", help="Start date/datetime (rounded down to the day).")
+        parser.add_argument("--until", help="End date/datetime (rounded up to the day).")
+
+    def handle(self, *args, **options):
+        start = parse_bound(options["since"]) if options["since"] else None
+        end = parse_bound(options["until"]) if options["until"] else None
+        rows = TicketRollup.rebuild(queue_ids=options["queues"], start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"rebuilt {rows} rollup row(s)"))
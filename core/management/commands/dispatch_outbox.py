@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.checks import process_local_backends
+from core.outbox import dispatch_pending
+
+
+class Command(BaseCommand):
+    help = "Deliver pending outbox events (notifications, WebSocket pushes, emails) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument("--once", action="store_true", help="Drain the outbox and exit.")
+
+    def handle(self, *args, **options):
+        backends = process_local_backends()
+        if backends:
+            # پیام‌های این پروسه به مصرف‌کننده‌های پروسه‌ی ASGI نمی‌رسند ولی ارسال‌شده ثبت می‌شوند
+            raise CommandError(f"{', '.join(backends)} is process-local; set REDIS_URL before running dispatch_outbox.")
+        total = 0
+        while True:
+            count = dispatch_pending(batch_size=options["batch_size"], max_attempts=options["max_attempts"])
+            total += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(self.style.SUCCESS(f"dispatched {total} outbox event(s)"))
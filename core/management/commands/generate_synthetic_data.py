@@ -0,0 +1,154 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.geo import KM_PER_DEGREE, geocell
+from core.models import Place, Queue, Ticket, TicketRollup, TicketStatus, User, UserRoles
+
+
+@contextmanager
+def explicit_timestamps(model, field_name="created_at"):
+    """
+    bulk_create با created_at دلخواه؛ auto_now_add موقتاً خاموش می‌شود.
+    """
+    field = model._meta.get_field(field_name)
+    auto_now_add = field.auto_now_add
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic dataset (places, queues, users and tickets spread over a time range) "
+        "with bulk_create, then rebuild queue statistics and analytics rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--places", type=int, default=100)
+        parser.add_argument("--queues-per-place", type=int, default=2)
+        parser.add_argument("--tickets", type=int, default=100_000, help="Total tickets across all queues.")
+        parser.add_argument("--users", type=int, default=10_000, help="Customer accounts.")
+        parser.add_argument("--days", type=int, default=90, help="Tickets are spread over the last N days.")
+        parser.add_argument("--lat", type=float, default=35.7, help="Center latitude of the generated places.")
+        parser.add_argument("--lon", type=float, default=51.4, help="Center longitude of the generated places.")
+        parser.add_argument("--radius-km", type=float, default=30.0)
+        parser.add_argument("--prefix", default="synthetic", help="Username/place name prefix (must be unused).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"users with prefix {options['prefix']!r} already exist; pick another --prefix")
+        if options["places"] < 1 or options["queues_per_place"] < 1:
+            raise CommandError("--places and --queues-per-place must be at least 1")
+
+        self.rng = random.Random(options["seed"])
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            admins, customers = self.create_users(options)
+            queues = self.create_places(options, admins)
+        tickets = self.create_tickets(options, queues, customers)
+
+        queue_ids = [q.id for q in queues]
+        for queue in Queue.objects.filter(id__in=queue_ids):
+            queue.update_statistics()
+        rollups = TicketRollup.rebuild(queue_ids=queue_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"created {len(admins)} admins, {len(customers)} customers, {options['places']} places, "
+            f"{len(queues)} queues, {tickets} tickets, {rollups} rollup rows "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def create_users(self, options):
+        prefix = options["prefix"]
+        # رمز غیرقابل استفاده؛ هش کردن رمز برای هزاران کاربر کند است
+        admins = User.objects.bulk_create([
+            User(username=f"{prefix}-admin-{i}", password="!", role=UserRoles.PLACE_ADMIN)
+            for i in range(max(1, options["places"] // 10))
+        ], batch_size=self.batch_size)
+        customers = User.objects.bulk_create([
+            User(username=f"{prefix}-{i}", email=f"{prefix}-{i}@example.com", password="!")
+            for i in range(options["users"])
+        ], batch_size=self.batch_size)
+        return admins, customers
+
+    def create_places(self, options, admins):
+        places = []
+        for i in range(options["places"]):
+            # توزیع یکنواخت در دایره حول مرکز
+            distance = options["radius_km"] * math.sqrt(self.rng.random())
+            bearing = self.rng.uniform(0, 2 * math.pi)
+            lat = options["lat"] + distance * math.cos(bearing) / KM_PER_DEGREE
+            lon = options["lon"] + distance * math.sin(bearing) / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+            # bulk_create از Place.save() رد نمی‌شود؛ geocell از همان مختصات ذخیره‌شده (گرد‌شده)
+            lat, lon = round(lat, 6), round(lon, 6)
+            places.append(Place(
+                owner=admins[i % len(admins)], name=f"{options['prefix']} place {i}",
+                latitude=lat, longitude=lon, geocell=geocell(lat, lon),
+            ))
+        places = Place.objects.bulk_create(places, batch_size=self.batch_size)
+        return Queue.objects.bulk_create([
+            Queue(place=place, name=f"Queue {j + 1}")
+            for place in places for j in range(options["queues_per_place"])
+        ], batch_size=self.batch_size)
+
+    def create_tickets(self, options, queues, customers):
+        now = timezone.now()
+        span = options["days"] * 86400
+        # تیکت‌های چند ساعت اخیر هنوز در صف هستند
+        active_since = now - timedelta(hours=2)
+        per_queue, extra = divmod(options["tickets"], len(queues))
+
+        created = 0
+        batch = []
+        with explicit_timestamps(Ticket):
+            for index, queue in enumerate(queues):
+                count = per_queue + (index < extra)
+                offsets = sorted(self.rng.random() * span for _ in range(count))
+                for number, offset in enumerate(offsets, start=1):
+                    batch.append(self.make_ticket(queue, number, now - timedelta(seconds=span - offset),
+                                                  active_since, customers))
+                    if len(batch) >= self.batch_size:
+                        created += self.flush(batch)
+            created += self.flush(batch)
+        return created
+
+    def make_ticket(self, queue, number, created_at, active_since, customers):
+        user = customers[self.rng.randrange(len(customers))] if customers else queue.place.owner
+        wait = timedelta(seconds=self.rng.lognormvariate(math.log(300), 0.8))
+        ticket = Ticket(queue=queue, user=user, number=number, created_at=created_at)
+        if created_at >= active_since:
+            ticket.status = TicketStatus.ACTIVE
+            if self.rng.random() < 0.2:
+                ticket.called_at = min(created_at + wait, timezone.now())
+        elif self.rng.random() < 0.85:
+            ticket.status = TicketStatus.USED
+            ticket.called_at = created_at + wait
+            ticket.completed_at = ticket.called_at + timedelta(seconds=self.rng.expovariate(1 / 240))
+        else:
+            ticket.status = TicketStatus.CANCELED
+            ticket.completed_at = created_at + wait
+        return ticket
+
+    def flush(self, batch):
+        if not batch:
+            return 0
+        Ticket.objects.bulk_create(batch, batch_size=self.batch_size)
+        count = len(batch)
+        batch.clear()
+        if self.verbosity > 1:
+            self.stdout.write(f"  +{count} tickets")
+        return count
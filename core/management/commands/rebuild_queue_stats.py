@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Queue
+
+COUNTERS = ("processed_count", "total_tickets", "last_ticket_number", "wait_seconds_total", "wait_samples")
+
+
+class Command(BaseCommand):
+    help = "Check incremental queue statistics against a full recompute and rebuild drifted counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", type=int, action="append", dest="queues", help="Queue id (repeatable).")
+        parser.add_argument("--check", action="store_true", help="Only report drift, do not write.")
+
+    def handle(self, *args, **options):
+        queues = Queue.objects.all().order_by("id")
+        if options["queues"]:
+            queues = queues.filter(id__in=options["queues"])
+
+        drifted = 0
+        for queue in queues.iterator():
+            expected = queue.compute_statistics()
+            expected["last_ticket_number"] = max(expected["last_ticket_number"], queue.last_ticket_number)
+            diff = {
+                field: (getattr(queue, field), expected[field])
+                for field in COUNTERS
+                if abs(getattr(queue, field) - expected[field]) > 1e-6
+            }
+            if not diff:
+                continue
+
+            drifted += 1
+            details = ", ".join(f"{field}: {have} != {want}" for field, (have, want) in diff.items())
+            self.stdout.write(self.style.WARNING(f"queue {queue.id}: {details}"))
+            if not options["check"]:
+                queue.update_statistics()
+
+        if drifted and options["check"]:
+            self.stdout.write(self.style.ERROR(f"{drifted} queue(s) have drifted statistics"))
+        elif drifted:
+            self.stdout.write(self.style.SUCCESS(f"rebuilt statistics for {drifted} queue(s)"))
+        else:
+            self.stdout.write(self.style.SUCCESS("queue statistics are consistent"))
@@ -0,0 +1,97 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 3)
+
+
+def load_traces(path):
+    traces = defaultdict(list)
+    try:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span["trace_id"]].append(span)
+    except FileNotFoundError:
+        raise CommandError(f"trace file not found: {path}")
+    return traces
+
+
+def summarize(traces, view=None):
+    """
+    برای هر view: مدت درخواست و فاصله‌ی اقدام تا اولین/آخرین صفحه (ws.deliver)؛
+    و برای هر نام span: تعداد و مدت.
+    """
+    by_view = defaultdict(lambda: {"http": [], "first": [], "last": [], "deliveries": 0})
+    by_span = defaultdict(list)
+    for spans in traces.values():
+        root = next((s for s in spans if s["parent_id"] is None), None)
+        if root is None:
+            continue  # trace از بیرون آمده یا ریشه هنوز نوشته نشده
+        label = root["attrs"].get("view", root["name"])
+        if view and label != view:
+            continue
+        row = by_view[f'{root["attrs"].get("method", "")} {label}'.strip()]
+        row["http"].append(root["duration_ms"])
+        e2e = [s["attrs"]["e2e_ms"] for s in spans if s["name"] == "ws.deliver" and s["attrs"].get("e2e_ms") is not None]
+        if e2e:
+            row["first"].append(min(e2e))
+            row["last"].append(max(e2e))
+            row["deliveries"] += len(e2e)
+        for span in spans:
+            if span["name"] != "ws.deliver":
+                by_span[span["name"]].append(span["duration_ms"])
+
+    views = [{
+        "view": name,
+        "traces": len(row["http"]),
+        "http_p50_ms": percentile(row["http"], 50),
+        "http_p95_ms": percentile(row["http"], 95),
+        "deliveries": row["deliveries"],
+        "first_screen_p50_ms": percentile(row["first"], 50),
+        "first_screen_p95_ms": percentile(row["first"], 95),
+        "last_screen_p50_ms": percentile(row["last"], 50),
+        "last_screen_p95_ms": percentile(row["last"], 95),
+    } for name, row in sorted(by_view.items())]
+    spans = [{
+        "span": name,
+        "count": len(durations),
+        "mean_ms": round(sum(durations) / len(durations), 3),
+        "p95_ms": percentile(durations, 95),
+    } for name, durations in sorted(by_span.items(), key=lambda item: -sum(item[1]))]
+    return views, spans
+
+
+class Command(BaseCommand):
+    help = "Summarize spans written by core.tracing: request latency and action-to-screen latency per view."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="JSONL trace file (default: settings.TRACE_FILE).")
+        parser.add_argument("--view", help="Only traces whose root view has this url name.")
+        parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+
+    def handle(self, *args, **options):
+        path = options["file"] or str(getattr(settings, "TRACE_FILE", "traces.jsonl"))
+        views, spans = summarize(load_traces(path), options["view"])
+        if options["json"]:
+            self.stdout.write(json.dumps({"views": views, "spans": spans}, indent=2))
+            return
+        for rows in (views, spans):
+            if not rows:
+                continue
+            columns = list(rows[0])
+            widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+            self.stdout.write("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+            for row in rows:
+                self.stdout.write("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+            self.stdout.write("")
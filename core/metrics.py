@@ -0,0 +1,294 @@
+"""
+رجیستری ساده‌ی متریک‌ها (Counter، Gauge، Histogram) با خروجی متنی Prometheus در /api/metrics.
+
+مقدارها در حافظه‌ی همین پروسه نگه داشته می‌شوند؛ با چند worker هر پروسه جدا scrape می‌شود.
+هزینه‌ی هر observe یک lock و یک bisect است؛ بودجه‌ی سربار (50µs برای هر درخواست، 5µs برای هر کوئری)
+با benchmarks/bench_metrics.py سنجیده می‌شود.
+"""
+import bisect
+import hmac
+import ipaddress
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple([str(labels[name]) for name in self.labelnames])
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def get(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return None if state is None else {"count": sum(state[0]), "sum": state[1]}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in sorted(items):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f"metric {metric.name!r} already registered with another type or labels")
+        return existing
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn):
+        """تابعی که پیش از هر scrape گیج‌ها را به‌روز می‌کند (مقدارهایی که فقط هنگام خواندن معنی دارند)."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        failed = 0
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception:
+                failed += 1
+        scrape_errors.set(failed)
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+scrape_errors = registry.gauge(
+    "smartqueue_metrics_collector_errors", "Collectors that failed during the last scrape.")
+
+http_request_seconds = registry.histogram(
+    "smartqueue_http_request_duration_seconds", "HTTP request latency by view.", ("view", "method", "status"))
+db_queries_per_request = registry.histogram(
+    "smartqueue_db_queries_per_request", "SQL queries executed per HTTP request.", ("view",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144))
+db_seconds_per_request = registry.histogram(
+    "smartqueue_db_time_per_request_seconds", "Time spent in SQL per HTTP request.", ("view",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+group_send_seconds = registry.histogram(
+    "smartqueue_group_send_batch_seconds", "Duration of one batch of channel-layer group_send calls.")
+group_send_failures = registry.counter(
+    "smartqueue_group_send_failures_total", "group_send calls that raised.")
+dispatch_latency_seconds = registry.histogram(
+    "smartqueue_channel_dispatch_latency_seconds", "Time from enqueue to group_send completion per message.")
+dispatch_dropped = registry.counter(
+    "smartqueue_channel_dispatch_dropped_total", "Messages dropped because the dispatch queue was full.")
+dispatch_queue_depth = registry.gauge(
+    "smartqueue_channel_dispatch_queue_depth", "Messages waiting in the channel dispatcher queue.")
+dispatch_batch_size = registry.histogram(
+    "smartqueue_channel_dispatch_batch_size", "Messages sent per channel dispatcher batch.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+broadcast_flush_seconds = registry.histogram(
+    "smartqueue_broadcast_flush_seconds", "Time from the first event of a place window to its frame being sent.")
+broadcast_batch_size = registry.histogram(
+    "smartqueue_broadcast_batch_size", "Events per coalesced place frame.",
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+
+ws_connections = registry.gauge(
+    "smartqueue_websocket_connections", "Open WebSocket connections.", ("consumer",))
+ws_auth_cache = registry.counter(
+    "smartqueue_ws_auth_cache_total", "WebSocket user cache lookups by result (hit or miss).", ("result",))
+ws_connect_seconds = registry.histogram(
+    "smartqueue_ws_connect_seconds", "WebSocket authentication time per connection.", ("auth",))
+place_active_tickets = registry.gauge(
+    "smartqueue_place_active_tickets", "Active tickets per place.", ("place_id",))
+
+
+@registry.collector
+def collect_dispatcher():
+    from .utils import channel_dispatcher
+    dispatch_queue_depth.set(channel_dispatcher.stats()["queue_depth"])
+
+
+_active_tickets_expires = 0.0
+
+
+@registry.collector
+def collect_active_tickets():
+    from django.db.models import Count
+    from .models import Queue, Ticket, TicketStatus
+
+    # GROUP BY حداکثر یک بار در هر METRICS_ACTIVE_TICKETS_TTL ثانیه؛ scrapeهای بین آن مقدار قبلی گیج را می‌گیرند
+    global _active_tickets_expires
+    now = time.monotonic()
+    if now < _active_tickets_expires:
+        return
+    _active_tickets_expires = now + getattr(settings, "METRICS_ACTIVE_TICKETS_TTL", 30)
+
+    # شمارش روی ایندکس جزئی تیکت‌های فعال، بعد نگاشت صف به مکان در پایتون
+    per_queue = dict(
+        Ticket.objects.filter(status=TicketStatus.ACTIVE).order_by().values_list("queue_id").annotate(n=Count("id"))
+    )
+    places = Queue.objects.filter(id__in=per_queue).values_list("id", "place_id")
+    counts = {}
+    for queue_id, place_id in places:
+        counts[place_id] = counts.get(place_id, 0) + per_queue[queue_id]
+    place_active_tickets.clear()
+    for place_id, n in counts.items():
+        place_active_tickets.set(n, place_id=place_id)
+
+
+class QueryTimer:
+    """execute_wrapper که تعداد و زمان کوئری‌های SQL یک درخواست را جمع می‌زند."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+def client_allowed(request):
+    """
+    با METRICS_TOKEN فقط هدر Authorization: Bearer <token>؛ وگرنه فقط آدرس‌های METRICS_ALLOWED_IPS
+    (IP یا شبکه، پیش‌فرض loopback) تا آمار هر مکان بدون تنظیم عمومی نشود.
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+    return any(address in ipaddress.ip_network(network, strict=False) for network in allowed)
+
+
+def metrics_view(request):
+    if not client_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -1,43 +1,391 @@
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+from logging.handlers import RotatingFileHandler
 from urllib.parse import parse_qs
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
-from jwt import decode as jwt_decode
 from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .db import pin_primary, replica_aliases
+from .tracing import start_trace
+from .metrics import (
+    QueryTimer, db_queries_per_request, db_seconds_per_request, http_request_seconds, view_label, ws_auth_cache,
+    ws_connect_seconds,
+)
 
 User = get_user_model()
 
-@database_sync_to_async
-def get_user(token):
+
+class UserCache:
+    """
+    کش LRU با TTL برای کاربرهای اتصال‌های وب‌سوکت؛ با ذخیره/حذف کاربر باطل می‌شود (core.signals).
+
+    کش در حافظه‌ی هر پروسه است؛ برای باطل شدن در پروسه‌های دیگر هر کاربر یک شماره‌ی نسخه در
+    cache جنگو دارد (با چند پروسه cache باید مشترک باشد) که با هر ذخیره/حذف بالا می‌رود و
+    در هر اتصال با نسخه‌ی ورودی کش مقایسه می‌شود. TTL فقط پشتوانه است (مثلاً evict شدن نسخه).
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # کلید str(user_id) است چون claim توکن رشته است و pk عدد
+        self._items = OrderedDict()  # user_id -> (expires_at, user, version)
+        self.hits = 0
+        self.misses = 0
+
+    def get_maxsize(self):
+        return self.maxsize if self.maxsize is not None else getattr(settings, "WS_USER_CACHE_SIZE", 10000)
+
+    def get_ttl(self):
+        return self.ttl if self.ttl is not None else getattr(settings, "WS_USER_CACHE_TTL", 300)
+
+    @staticmethod
+    def version_key(user_id):
+        return f"ws-user-version:{user_id}"
+
+    async def version(self, user_id):
+        return await cache.aget(self.version_key(user_id), 0)
+
+    def get(self, user_id, version=0):
+        user_id = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[0] < now or item[2] != version:
+                self._items.pop(user_id, None)
+                self.misses += 1
+                item = None
+            else:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+        ws_auth_cache.inc(result="miss" if item is None else "hit")
+        return None if item is None else item[1]
+
+    def set(self, user_id, user, version=0):
+        user_id = str(user_id)
+        with self._lock:
+            self._items[user_id] = (time.monotonic() + self.get_ttl(), user, version)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.get_maxsize():
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(str(user_id), None)
+        try:
+            cache.incr(self.version_key(user_id))
+        except ValueError:
+            # هنوز نسخه‌ای نبود (یا evict شده)؛ ورودی‌های نسخه‌ی 0 کهنه می‌شوند
+            cache.set(self.version_key(user_id), 1, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+user_cache = UserCache()
+
+connect_metrics = {"connects": 0, "rejected": 0, "total_latency_ms": 0.0, "max_latency_ms": 0.0}
+
+
+def ws_auth_stats():
+    connects = connect_metrics["connects"]
+    return {
+        **connect_metrics,
+        "avg_latency_ms": connect_metrics["total_latency_ms"] / connects if connects else 0.0,
+        "cache_hits": user_cache.hits,
+        "cache_misses": user_cache.misses,
+        "cache_hit_ratio": user_cache.hit_ratio,
+    }
+
+
+def decode_user_id(token):
+    """
+    اعتبارسنجی و decode توکن فقط یک بار؛ None اگر توکن نامعتبر باشد.
+    """
     try:
-        # validate token (raises if invalid)
-        UntypedToken(token)
-        decoded = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded.get("user_id") or decoded.get("user_id")  # depending on token payload
-        user = User.objects.filter(id=user_id).first()
-        return user
-    except (TokenError, InvalidToken, Exception):
+        return AccessToken(token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+@database_sync_to_async
+def fetch_user(user_id):
+    return User.objects.filter(id=user_id, is_active=True).first()
+
+
+async def get_user(token):
+    user_id = decode_user_id(token)
+    if user_id is None:
         return None
+    # نسخه قبل از کوئری خوانده می‌شود؛ ذخیره‌ای که بعد از آن برسد ورودی را کهنه می‌کند
+    version = await user_cache.version(user_id)
+    user = user_cache.get(user_id, version)
+    if user is None:
+        user = await fetch_user(user_id)
+        if user is not None:
+            user_cache.set(user_id, user, version)
+    return user
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     """
     Middleware to authenticate WebSocket connections by ?token=<JWT>
+    scope["auth_error"] is "missing" or "invalid" when no user could be resolved.
     """
 
     async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
         query_string = scope.get("query_string", b"").decode()
         qs = parse_qs(query_string)
         token_list = qs.get("token", None)
-        if token_list:
-            token = token_list[0]
-            user = await get_user(token)
-            if user:
-                scope["user"] = user
-            else:
-                scope["user"] = None
-        else:
-            # keep existing scope user (AnonymousUser) if any
-            scope["user"] = None
+        user = await get_user(token_list[0]) if token_list else None
+
+        scope = dict(scope)
+        scope["user"] = user or AnonymousUser()
+        if user is None:
+            scope["auth_error"] = "invalid" if token_list else "missing"
+
+        elapsed = time.perf_counter() - start
+        ws_connect_seconds.observe(elapsed, auth=scope.get("auth_error", "ok"))
+        latency_ms = elapsed * 1000
+        connect_metrics["connects"] += 1
+        connect_metrics["rejected"] += user is None and bool(token_list)
+        connect_metrics["total_latency_ms"] += latency_ms
+        connect_metrics["max_latency_ms"] = max(connect_metrics["max_latency_ms"], latency_ms)
         return await super().__call__(scope, receive, send)
+
+
+class MetricsMiddleware:
+    """
+    latency هر view و تعداد/زمان کوئری‌های SQL هر درخواست برای /api/metrics (core.metrics).
+    با METRICS_ENABLED = False کلاً از زنجیره‌ی middleware حذف می‌شود.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        # مثل connection.execute_wrapper ولی بدون context manager برای هر اتصال
+        conns = connections.all()
+        for conn in conns:
+            conn.execute_wrappers.append(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            for conn in conns:
+                conn.execute_wrappers.remove(timer)
+        elapsed = time.perf_counter() - start
+        view = view_label(request)
+        http_request_seconds.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        db_queries_per_request.observe(timer.count, view=view)
+        db_seconds_per_request.observe(timer.seconds, view=view)
+        return response
+
+
+def project_stack(limit=8):
+    """فریم‌های کد خود پروژه (نه site-packages و نه همین middleware) در محل اجرای کوئری."""
+    base = str(settings.BASE_DIR) + os.sep
+    frames = [
+        f"{frame.filename[len(base):]}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base) and "site-packages" not in frame.filename
+        and frame.filename != __file__
+    ]
+    return frames[-limit:]
+
+
+class QueryProfiler(QueryTimer):
+    """
+    مثل QueryTimer به‌علاوه‌ی top_n کندترین کوئری‌ها و تعداد تکرار هر SQL؛
+    با capture_stacks محل صدا زدن هر کوئری‌ی کند در کد پروژه هم ثبت می‌شود.
+    stack فقط برای کوئری‌هایی گرفته می‌شود که وارد top_n شوند.
+    """
+
+    __slots__ = ("top_n", "capture_stacks", "slowest", "statements")
+
+    def __init__(self, top_n=5, capture_stacks=False):
+        super().__init__()
+        self.top_n = top_n
+        self.capture_stacks = capture_stacks
+        self.slowest = []  # min-heap از (seconds, index, sql, stack)
+        self.statements = Counter() if capture_stacks else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if self.statements is not None:
+                self.statements[sql] += 1
+            if len(self.slowest) < self.top_n or elapsed > self.slowest[0][0]:
+                item = (elapsed, self.count, sql, project_stack() if self.capture_stacks else None)
+                if len(self.slowest) < self.top_n:
+                    heapq.heappush(self.slowest, item)
+                else:
+                    heapq.heapreplace(self.slowest, item)
+
+    def report(self):
+        slowest = sorted(self.slowest, reverse=True)
+        report = {
+            "queries": self.count,
+            "db_ms": round(self.seconds * 1000, 3),
+            "slowest": [
+                {"ms": round(seconds * 1000, 3), "index": index, "sql": sql[:2000], "stack": stack}
+                for seconds, index, sql, stack in slowest
+            ],
+        }
+        if self.statements is not None:
+            # SQLهای تکراری معمولاً نشانه‌ی N+1 هستند
+            report["repeated"] = [
+                {"count": n, "sql": sql[:500]} for sql, n in self.statements.most_common(3) if n > 1
+            ]
+        return report
+
+
+_slow_log_lock = threading.Lock()
+_slow_log_handler = None
+
+
+def slow_request_logger():
+    """
+    logger مخصوص درخواست‌های کند؛ اگر در LOGGING برایش handler تعریف نشده باشد
+    یک RotatingFileHandler روی SQL_PROFILE_LOG_FILE می‌گیرد (هر خط یک JSON).
+    """
+    global _slow_log_handler
+    logger = logging.getLogger("smartqueue.sql_profile")
+    path = os.path.abspath(getattr(settings, "SQL_PROFILE_LOG_FILE", "slow_requests.log"))
+    with _slow_log_lock:
+        if _slow_log_handler is not None and _slow_log_handler.baseFilename != path:
+            logger.removeHandler(_slow_log_handler)
+            _slow_log_handler.close()
+            _slow_log_handler = None
+        if _slow_log_handler is None and not logger.handlers:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _slow_log_handler = RotatingFileHandler(
+                path, encoding="utf-8",
+                maxBytes=getattr(settings, "SQL_PROFILE_LOG_MAX_BYTES", 10 * 1024 * 1024),
+                backupCount=getattr(settings, "SQL_PROFILE_LOG_BACKUPS", 5),
+            )
+            _slow_log_handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(_slow_log_handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+
+class SQLProfilingMiddleware:
+    """
+    تعداد، زمان کل و کندترین کوئری‌های SQL هر درخواست.
+
+    - SQL_PROFILE_HEADERS: هدرهای X-Query-Count و X-DB-Time (میلی‌ثانیه) روی پاسخ.
+    - از هر SQL_PROFILE_SAMPLE_RATE درخواست، stack کوئری‌ها گرفته می‌شود و اگر درخواست
+      بیشتر از SQL_PROFILE_SLOW_MS طول بکشد در slow_request_logger() نوشته می‌شود.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SQL_PROFILE_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < getattr(settings, "SQL_PROFILE_SAMPLE_RATE", 0.01)
+        profiler = QueryProfiler(getattr(settings, "SQL_PROFILE_TOP_N", 5), capture_stacks=sampled)
+        start = time.perf_counter()
+        conns = connections.all()
+        for conn in conns:
+            conn.execute_wrappers.append(profiler)
+        try:
+            response = self.get_response(request)
+        finally:
+            for conn in conns:
+                conn.execute_wrappers.remove(profiler)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if getattr(settings, "SQL_PROFILE_HEADERS", False):
+            response["X-Query-Count"] = str(profiler.count)
+            response["X-DB-Time"] = f"{profiler.seconds * 1000:.3f}"
+        if sampled and elapsed_ms >= getattr(settings, "SQL_PROFILE_SLOW_MS", 500):
+            slow_request_logger().info(json.dumps({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "method": request.method,
+                "path": request.path,
+                "view": view_label(request),
+                "status": response.status_code,
+                "duration_ms": round(elapsed_ms, 3),
+                **profiler.report(),
+            }, ensure_ascii=False))
+        return response
+
+
+class TracingMiddleware:
+    """
+    span ریشه‌ی هر درخواست (core.tracing)؛ با هدر X-Trace-Id همان trace ادامه پیدا می‌کند
+    و شناسه‌ی trace در پاسخ برمی‌گردد. با TRACE_ENABLED = False از زنجیره حذف می‌شود.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "TRACE_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trace_id = request.headers.get("X-Trace-Id")
+        if trace_id and not (len(trace_id) <= 32 and trace_id.isalnum()):
+            trace_id = None
+        with start_trace("http", trace_id, method=request.method, path=request.path) as span:
+            response = self.get_response(request)
+            if span is not None:
+                span.attrs["view"] = view_label(request)
+                span.attrs["status"] = response.status_code
+                response["X-Trace-Id"] = span.trace_id
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    بعد از هر درخواست نوشتنی موفق، کاربر REPLICA_STICKY_SECONDS ثانیه از default می‌خواند (core.db).
+    بدون DATABASE_REPLICAS از زنجیره حذف می‌شود.
+    """
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            # DRF کاربر احراز‌شده با JWT را روی request جنگو هم می‌گذارد
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                pin_primary(user.pk)
+        return response
@@ -0,0 +1,205 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:36
+
+import django.contrib.auth.models
+import django.contrib.auth.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('role', models.CharField(choices=[('customer', 'Customer'), ('place_admin', 'Place Admin'), ('super_admin', 'Super Admin')], default='customer', max_length=20)),
+                ('phone', models.CharField(blank=True, max_length=20, null=True)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('channel', models.CharField(choices=[('websocket', 'WebSocket'), ('email', 'Email'), ('push', 'Push')], default='websocket', max_length=20)),
+                ('extra_data', models.JSONField(blank=True, null=True)),
+                ('is_read', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('queue', 'Queue')], max_length=20)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('id',),
+                'indexes': [models.Index(fields=['status', 'available_at'], name='outbox_pending_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geocell', models.CharField(blank=True, db_index=True, editable=False, max_length=16)),
+                ('logo', models.ImageField(blank=True, null=True, upload_to='place_logos/')),
+                ('opening_time', models.TimeField(default='09:00')),
+                ('closing_time', models.TimeField(default='18:00')),
+                ('max_concurrent_queues', models.PositiveIntegerField(default=1)),
+                ('ticket_interval_minutes', models.PositiveIntegerField(default=5)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='places', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Queue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='Default', max_length=255)),
+                ('is_open', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_count', models.PositiveIntegerField(default=0)),
+                ('total_tickets', models.PositiveIntegerField(default=0)),
+                ('last_ticket_number', models.PositiveIntegerField(default=0)),
+                ('wait_seconds_total', models.FloatField(default=0)),
+                ('wait_samples', models.PositiveIntegerField(default=0)),
+                ('service_interval_ewma', models.FloatField(blank=True, null=True)),
+                ('last_service_at', models.DateTimeField(blank=True, null=True)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queues', to='core.place')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Ticket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('used', 'Used'), ('canceled', 'Canceled')], default='active', max_length=20)),
+                ('cancel_reason', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('called_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tickets', to='core.queue')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tickets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('number',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('total_count', models.IntegerField(default=0)),
+                ('active_count', models.IntegerField(default=0)),
+                ('used_count', models.IntegerField(default=0)),
+                ('canceled_count', models.IntegerField(default=0)),
+                ('wait_count', models.IntegerField(default=0)),
+                ('wait_seconds_total', models.FloatField(default=0)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='core.place')),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='core.queue')),
+            ],
+            options={
+                'ordering': ('bucket_start',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketWaitBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('bin', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wait_bins', to='core.place')),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wait_bins', to='core.queue')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['latitude', 'longitude'], name='place_lat_lon_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ticket',
+            unique_together={('queue', 'number')},
+        ),
+        migrations.AddIndex(
+            model_name='ticketrollup',
+            index=models.Index(fields=['place', 'granularity', 'bucket_start'], name='rollup_place_bucket_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketrollup',
+            index=models.Index(fields=['granularity', 'bucket_start'], name='rollup_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ticketrollup',
+            unique_together={('queue', 'granularity', 'bucket_start')},
+        ),
+        migrations.AddIndex(
+            model_name='ticketwaitbin',
+            index=models.Index(fields=['place', 'granularity', 'bucket_start'], name='waitbin_place_bucket_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketwaitbin',
+            index=models.Index(fields=['granularity', 'bucket_start'], name='waitbin_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ticketwaitbin',
+            unique_together={('queue', 'granularity', 'bucket_start', 'bin')},
+        ),
+    ]
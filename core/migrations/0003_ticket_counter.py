@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='counter',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_ticket_counter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='kind',
+            field=models.CharField(choices=[('user', 'User'), ('queue', 'Queue'), ('batch', 'Batch')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+from django.db.models import IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def seed_last_ticket_number(apps, schema_editor):
+    # allocate_ticket_number به last_ticket_number اعتماد می‌کند؛ صف‌های قدیمی آن را به‌روز نداشتند
+    Queue = apps.get_model("core", "Queue")
+    Ticket = apps.get_model("core", "Ticket")
+    highest = (
+        Ticket.objects.filter(queue_id=OuterRef("pk")).order_by()
+        .values("queue_id").annotate(n=Max("number")).values("n")
+    )
+    Queue.objects.update(last_ticket_number=Greatest(
+        "last_ticket_number", Coalesce(Subquery(highest, output_field=IntegerField()), Value(0)),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_outbox_batch_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_last_ticket_number, migrations.RunPython.noop),
+    ]
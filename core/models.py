@@ -1,7 +1,16 @@
-from django.db import models
+import operator
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-from django.db.models import JSONField
+from django.db.models import JSONField, F, Q, Value, Count, Max, Sum, ExpressionWrapper, DurationField, Case, When
+from django.db.models.functions import Greatest, TruncHour, TruncDay
+from django.dispatch import Signal
+from .geo import geocell
+from .sketch import WaitSketch, bin_index
+from .tracing import traced
 
 
 class UserRoles:
@@ -42,6 +51,8 @@ class Place(models.Model):
     description = models.TextField(blank=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    # خانه‌ی شبکه‌ی جغرافیایی برای جستجوی نزدیک‌ترین مکان‌ها (core.geo)
+    geocell = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
     logo = models.ImageField(upload_to="place_logos/", blank=True, null=True)
 
     opening_time = models.TimeField(default="09:00")
@@ -54,6 +65,16 @@ class Place(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["latitude", "longitude"], name="place_lat_lon_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geocell = geocell(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"geocell"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -67,13 +88,29 @@ class Queue(models.Model):
     closed_at = models.DateTimeField(null=True, blank=True)
 
     # statistics
+    # running sums maintained incrementally by core.signals on every ticket
+    # transition; update_statistics() rebuilds them from scratch.
     processed_count = models.PositiveIntegerField(default=0)
     total_tickets = models.PositiveIntegerField(default=0)
     last_ticket_number = models.PositiveIntegerField(default=0)
-    average_wait_time = models.DurationField(null=True, blank=True)
+    wait_seconds_total = models.FloatField(default=0)
+    wait_samples = models.PositiveIntegerField(default=0)
+    # EWMA of seconds between consecutive services, for ticket ETAs (core.eta)
+    service_interval_ewma = models.FloatField(null=True, blank=True)
+    last_service_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            # JoinQueueView: filter(place, is_open=True).latest("created_at")
+            models.Index(fields=["place", "created_at"], condition=Q(is_open=True), name="queue_open_latest_idx"),
+        ]
+
+    @property
+    def average_wait_time(self):
+        if not self.wait_samples:
+            return timedelta(seconds=0)
+        return timedelta(seconds=self.wait_seconds_total / self.wait_samples)
 
     def close(self):
         self.is_open = False
@@ -85,29 +122,104 @@ class Queue(models.Model):
         self.closed_at = None
         self.save()
 
-    def update_statistics(self):
-        tickets = self.tickets.filter(status=TicketStatus.USED)
-        self.processed_count = tickets.count()
-
-        wait_seconds = []
-        for t in tickets:
-            if t.called_at and t.created_at:
-                diff = (t.called_at - t.created_at).total_seconds()
-                print(t.called_at, t.created_at)
-                print(diff)
-                if diff > 0:  # فقط اختلاف مثبت
-                    wait_seconds.append(diff)
-
+    @classmethod
+    def allocate_ticket_number(cls, queue_id):
+        """
+        شماره‌ی نوبت بعدی با افزایش اتمیک last_ticket_number.
+        ردیف صف تا پایان تراکنش قفل می‌ماند، پس دو درخواست هم‌زمان شماره‌ی یکسان نمی‌گیرند.
+        """
+        with transaction.atomic(savepoint=False):
+            updated = cls.objects.filter(pk=queue_id).update(last_ticket_number=F("last_ticket_number") + 1)
+            if not updated:
+                raise cls.DoesNotExist
+            return cls.objects.filter(pk=queue_id).values_list("last_ticket_number", flat=True).get()
+
+    def issue_ticket(self, user, **fields):
+        with transaction.atomic(savepoint=False):
+            number = Queue.allocate_ticket_number(self.pk)
+            ticket = Ticket.objects.create(queue=self, user=user, number=number, **fields)
+        self.last_ticket_number = number
+        return ticket
+
+    @traced("queue.call_next")
+    def call_next(self, counter=None):
+        """
+        فراخوانی کوچک‌ترین نوبت منتظر صف؛ None اگر کسی منتظر نباشد.
+        با SKIP LOCKED باجه‌های هم‌زمان هر کدام تیکت دیگری برمی‌دارند؛ SQLite قفل ردیفی ندارد
+        و تراکنش IMMEDIATE (settings) فراخوانی‌ها را پشت سر هم اجرا می‌کند.
+        """
+        with transaction.atomic(savepoint=False):
+            ticket = (
+                Ticket.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(queue=self, status=TicketStatus.ACTIVE, called_at__isnull=True)
+                .select_related("user").order_by("number").first()
+            )
+            if ticket is not None:
+                ticket.queue = self
+                ticket.call(counter=counter)
+        return ticket
+
+    @classmethod
+    def apply_stats_delta(cls, queue_id, processed=0, wait_seconds=0, wait_samples=0, tickets=0, number=None):
+        """
+        اعمال تغییرات آمار صف به صورت اتمیک با F() بدون اسکن تیکت‌ها.
+        """
+        updates = {}
+        if processed:
+            updates["processed_count"] = F("processed_count") + processed
         if wait_seconds:
-            from datetime import timedelta
-            avg_seconds = sum(wait_seconds) / len(wait_seconds)
-            self.average_wait_time = timedelta(seconds=avg_seconds)
-        else:
-            self.average_wait_time = timezone.timedelta(seconds=0)
-
-        self.save()
-
-
+            updates["wait_seconds_total"] = F("wait_seconds_total") + wait_seconds
+        if wait_samples:
+            updates["wait_samples"] = F("wait_samples") + wait_samples
+        if tickets:
+            updates["total_tickets"] = F("total_tickets") + tickets
+        if number is not None:
+            updates["last_ticket_number"] = Greatest(F("last_ticket_number"), Value(number))
+        if updates:
+            cls.objects.filter(pk=queue_id).update(**updates)
+        return bool(updates)
+
+    def compute_statistics(self):
+        """
+        محاسبه کامل آمار از روی جدول تیکت‌ها (فقط با aggregate در دیتابیس).
+        """
+        tickets = self.tickets.all()
+        totals = tickets.aggregate(
+            total_tickets=Count("id"),
+            last_ticket_number=Max("number"),
+            processed_count=Count("id", filter=Q(status=TicketStatus.USED)),
+        )
+        waits = tickets.filter(
+            status=TicketStatus.USED, called_at__isnull=False, called_at__gt=F("created_at"),
+        ).annotate(
+            wait=ExpressionWrapper(F("called_at") - F("created_at"), output_field=DurationField())
+        ).aggregate(wait_total=Sum("wait"), wait_samples=Count("id"))
+
+        return {
+            "processed_count": totals["processed_count"],
+            "total_tickets": totals["total_tickets"],
+            "last_ticket_number": totals["last_ticket_number"] or 0,
+            "wait_seconds_total": waits["wait_total"].total_seconds() if waits["wait_total"] else 0.0,
+            "wait_samples": waits["wait_samples"],
+        }
+
+    @traced("queue.update_statistics")
+    def update_statistics(self):
+        """
+        بازسازی آمار زیر قفل ردیف صف تا deltaهای هم‌زمان (apply_stats_delta) گم نشوند.
+        last_ticket_number فقط با Greatest بالا می‌رود، نه مقدار مطلق از روی نمونه‌ی کهنه،
+        تا allocate_ticket_number هرگز شماره‌ی تکراری صادر نکند.
+        """
+        with transaction.atomic(savepoint=False):
+            locked = Queue.objects.select_for_update().only("last_ticket_number").get(pk=self.pk)
+            stats = self.compute_statistics()
+            number = stats.pop("last_ticket_number")
+            Queue.objects.filter(pk=self.pk).update(
+                last_ticket_number=Greatest(F("last_ticket_number"), Value(number)), **stats,
+            )
+        stats["last_ticket_number"] = max(number, locked.last_ticket_number)
+        for field, value in stats.items():
+            setattr(self, field, value)
 
 
 class TicketStatus:
@@ -122,6 +234,10 @@ class TicketStatus:
     )
 
 
+# بعد از Ticket.bulk_transition فرستاده می‌شود (update() سیگنال post_save ندارد)؛ kwargs: queue, instances
+tickets_transitioned = Signal()
+
+
 class Ticket(models.Model):
     queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="tickets")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tickets")
@@ -132,13 +248,26 @@ class Ticket(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     called_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # باجه‌ای که تیکت را فراخوانده (1 تا place.max_concurrent_queues)
+    counter = models.PositiveSmallIntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = ("queue", "number")
         ordering = ("number",)
-
-    def call(self):
+        indexes = [
+            # تیکت‌های صف با یک وضعیت (فعال‌ها، ?status=)، مرتب بر اساس شماره
+            models.Index(fields=["queue", "status", "number"], name="ticket_queue_status_idx"),
+            # JoinQueueView: نوبت فعال کاربر؛ partial فقط روی تیکت‌های فعال (SQLite/PostgreSQL، نه MySQL)
+            models.Index(fields=["queue", "user"], condition=Q(status=TicketStatus.ACTIVE),
+                         name="ticket_active_user_idx"),
+            # بازه‌ی زمانی تیکت‌های یک صف (بازسازی rollup‌ها)
+            models.Index(fields=["queue", "created_at"], name="ticket_queue_created_idx"),
+        ]
+
+    @traced("ticket.call")
+    def call(self, counter=None):
         self.called_at = timezone.now()
+        self.counter = counter
         self.save()
 
     def complete(self):
@@ -150,6 +279,7 @@ class Ticket(models.Model):
         self.status = TicketStatus.ACTIVE
         self.called_at = None
         self.completed_at = None
+        self.counter = None
         self.save()
 
     def cancel(self, reason=None):
@@ -158,6 +288,52 @@ class Ticket(models.Model):
         self.completed_at = timezone.now()
         self.save()
 
+    ACTIONS = ("call", "requeue", "cancel", "complete")
+
+    def allows(self, action):
+        """
+        آیا اکشن دسته‌ای روی این تیکت معنی دارد (تیکت‌های دیگر رد می‌شوند).
+        """
+        waiting = self.status == TicketStatus.ACTIVE and self.called_at is None
+        if action == "call":
+            return waiting
+        if action == "requeue":
+            return not waiting
+        return self.status == TicketStatus.ACTIVE
+
+    @staticmethod
+    def transition_fields(action, reason=None):
+        """
+        فیلدهایی که call/requeue/cancel/complete تغییر می‌دهند.
+        """
+        now = timezone.now()
+        if action == "call":
+            return {"called_at": now, "counter": None}
+        if action == "requeue":
+            return {"status": TicketStatus.ACTIVE, "called_at": None, "completed_at": None, "counter": None}
+        if action == "cancel":
+            return {"status": TicketStatus.CANCELED, "cancel_reason": reason, "completed_at": now}
+        if action == "complete":
+            return {"status": TicketStatus.USED, "completed_at": now}
+        raise ValueError(f"unknown action {action!r}")
+
+    @classmethod
+    @traced("ticket.bulk_transition")
+    def bulk_transition(cls, queue, tickets, **fields):
+        """
+        یک تغییر یکسان روی چند تیکت صف با یک UPDATE؛ آمار و rollupها با tickets_transitioned
+        یک بار برای کل دسته به‌روز می‌شوند.
+        """
+        tickets = list(tickets)
+        if not tickets:
+            return tickets
+        for ticket in tickets:
+            for field, value in fields.items():
+                setattr(ticket, field, value)
+        cls.objects.filter(queue=queue, pk__in=[t.pk for t in tickets]).update(**fields)
+        tickets_transitioned.send(sender=cls, queue=queue, instances=tickets)
+        return tickets
+
     def __str__(self):
         return f"Ticket #{self.number} ({self.queue})"
     
@@ -167,6 +343,298 @@ class Ticket(models.Model):
             return (self.called_at - self.created_at).total_seconds()
         return None
 
+    def rollup_state(self):
+        """
+        وضعیت تیکت برای جدول‌های rollup: (created_at, status, wait_seconds یا None)
+        """
+        return (self.created_at, self.status, self.wait_time_seconds)
+
+    def stats_contribution(self):
+        """
+        سهم این تیکت در آمار صف: (processed, wait_seconds, wait_samples)
+        """
+        if self.status != TicketStatus.USED:
+            return (0, 0.0, 0)
+        wait = self.wait_time_seconds
+        if wait is not None and wait > 0:  # فقط اختلاف مثبت
+            return (1, wait, 1)
+        return (1, 0.0, 0)
+
+
+class RollupGranularity:
+    HOUR = "hour"
+    DAY = "day"
+
+    CHOICES = (
+        (HOUR, "Hour"),
+        (DAY, "Day"),
+    )
+    ALL = (HOUR, DAY)
+
+
+def bump_buckets(model, place_id, created_at, updates, **lookup):
+    """
+    اعمال updates روی ردیف ساعتی و روزانه‌ی created_at با یک UPDATE؛ ردیف‌های نبود با مقدار صفر ساخته می‌شوند.
+    ردیف ساعتی هیچ‌وقت بدون ردیف روزانه‌اش وجود ندارد، پس اگر فقط یک ردیف به‌روز شد همان روزانه است.
+    """
+    buckets = TicketRollup.bucket_starts(created_at)
+
+    def bucket_q(granularities):
+        q = Q()
+        for granularity, bucket_start in buckets:
+            if granularity in granularities:
+                q |= Q(granularity=granularity, bucket_start=bucket_start)
+        return Q(**lookup) & q
+
+    updated = model.objects.filter(bucket_q(RollupGranularity.ALL)).update(**updates)
+    if updated == len(buckets):
+        return
+    missing = RollupGranularity.ALL if updated == 0 else (RollupGranularity.HOUR,)
+    # ignore_conflicts: ردیفی که هم‌زمان توسط درخواست دیگری ساخته شده فقط به‌روز می‌شود
+    model.objects.bulk_create([
+        model(place_id=place_id, granularity=granularity, bucket_start=bucket_start, **lookup)
+        for granularity, bucket_start in buckets if granularity in missing
+    ], ignore_conflicts=True)
+    model.objects.filter(bucket_q(missing)).update(**updates)
+
+
+def bump_buckets_many(model, place_id, deltas, key_fields=(), chunk_size=200, **lookup):
+    """
+    مثل bump_buckets برای تغییرات دسته‌ای با تعداد ثابتی کوئری: deltas {(created_at, *key): {field: افزایش}}.
+    افزایش‌های هر ردیف ساعتی/روزانه جمع و همه با یک UPDATE ... CASE اعمال می‌شوند.
+    """
+    names = ("granularity", "bucket_start", *key_fields)
+    rows = {}
+    for (created_at, *key), values in deltas.items():
+        for granularity, bucket_start in TicketRollup.bucket_starts(created_at):
+            row = rows.setdefault((granularity, bucket_start, *key), {})
+            for field, value in values.items():
+                row[field] = row.get(field, 0) + value
+    rows = {k: {f: v for f, v in values.items() if v} for k, values in rows.items()}
+    rows = {k: values for k, values in rows.items() if values}
+
+    def update(keys):
+        conditions = {k: Q(**dict(zip(names, k))) for k in keys}
+        fields = {f for k in keys for f in rows[k]}
+        updates = {
+            f: F(f) + Case(*[When(conditions[k], then=Value(rows[k][f])) for k in keys if f in rows[k]],
+                           default=Value(0), output_field=model._meta.get_field(f))
+            for f in fields
+        }
+        return model.objects.filter(Q(**lookup), reduce(operator.or_, conditions.values())).update(**updates)
+
+    keys = list(rows)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        if update(chunk) == len(chunk):
+            continue
+        existing = set(model.objects.filter(
+            Q(**lookup), reduce(operator.or_, (Q(**dict(zip(names, k))) for k in chunk)),
+        ).values_list(*names))
+        missing = [k for k in chunk if k not in existing]
+        model.objects.bulk_create([
+            model(place_id=place_id, **dict(zip(names, k)), **lookup) for k in missing
+        ], ignore_conflicts=True)
+        update(missing)
+
+
+class TicketRollup(models.Model):
+    """
+    آمار تجمیعی تیکت‌ها برای هر صف در هر بازه‌ی ساعتی/روزانه (بر اساس created_at تیکت).
+    با هر تغییر وضعیت تیکت به صورت افزایشی به‌روز می‌شود (core.signals)
+    و با دستور backfill_rollups از روی جدول تیکت‌ها بازسازی می‌شود.
+    """
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name="rollups")
+    queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="rollups")
+    granularity = models.CharField(max_length=10, choices=RollupGranularity.CHOICES)
+    bucket_start = models.DateTimeField()
+
+    total_count = models.IntegerField(default=0)
+    active_count = models.IntegerField(default=0)
+    used_count = models.IntegerField(default=0)
+    canceled_count = models.IntegerField(default=0)
+    # تیکت‌های فراخوانی‌شده (called_at دارند) و مجموع زمان انتظارشان
+    wait_count = models.IntegerField(default=0)
+    wait_seconds_total = models.FloatField(default=0)
+
+    COUNTERS = ("total_count", "active_count", "used_count", "canceled_count", "wait_count", "wait_seconds_total")
+
+    class Meta:
+        ordering = ("bucket_start",)
+        unique_together = ("queue", "granularity", "bucket_start")
+        indexes = [
+            models.Index(fields=["place", "granularity", "bucket_start"], name="rollup_place_bucket_idx"),
+            models.Index(fields=["granularity", "bucket_start"], name="rollup_bucket_idx"),
+        ]
+
+    @staticmethod
+    def bucket_starts(created_at):
+        local = timezone.localtime(created_at)
+        return (
+            (RollupGranularity.HOUR, local.replace(minute=0, second=0, microsecond=0)),
+            (RollupGranularity.DAY, local.replace(hour=0, minute=0, second=0, microsecond=0)),
+        )
+
+    @staticmethod
+    def contribution(status, wait_seconds):
+        values = {"total_count": 1, f"{status}_count": 1}
+        if wait_seconds is not None:
+            values["wait_count"] = 1
+            values["wait_seconds_total"] = wait_seconds
+        return values
+
+    @classmethod
+    def delta(cls, old_state=None, new_state=None):
+        """
+        تفاوت سهم تیکت قبل و بعد از تغییر؛ state همان Ticket.rollup_state() است.
+        """
+        delta = dict.fromkeys(cls.COUNTERS, 0)
+        if old_state is not None:
+            for field, value in cls.contribution(*old_state[1:]).items():
+                delta[field] -= value
+        if new_state is not None:
+            for field, value in cls.contribution(*new_state[1:]).items():
+                delta[field] += value
+        return {field: value for field, value in delta.items() if value}
+
+    @classmethod
+    def apply_delta(cls, place_id, queue_id, created_at, delta):
+        if delta:
+            bump_buckets(cls, place_id, created_at, {field: F(field) + value for field, value in delta.items()},
+                         queue_id=queue_id)
+
+    @classmethod
+    def apply_deltas(cls, place_id, queue_id, deltas):
+        """
+        تغییرات دسته‌ای: deltas {created_at: delta}.
+        """
+        bump_buckets_many(cls, place_id, {(created_at,): delta for created_at, delta in deltas.items()},
+                          queue_id=queue_id)
+
+    @classmethod
+    def rebuild(cls, queue_ids=None, start=None, end=None):
+        """
+        بازسازی rollup‌ها از جدول تیکت‌ها. start/end به مرز روز گرد می‌شوند تا بازه‌ها کامل باشند.
+        """
+        if start is not None:
+            start = cls.bucket_starts(start)[1][1]
+        if end is not None:
+            end = cls.bucket_starts(end)[1][1] + timedelta(days=1)
+
+        tickets = Ticket.objects.all()
+        buckets = Q()
+        if queue_ids is not None:
+            tickets = tickets.filter(queue_id__in=queue_ids)
+            buckets &= Q(queue_id__in=queue_ids)
+        if start is not None:
+            tickets = tickets.filter(created_at__gte=start)
+            buckets &= Q(bucket_start__gte=start)
+        if end is not None:
+            tickets = tickets.filter(created_at__lt=end)
+            buckets &= Q(bucket_start__lt=end)
+
+        called = Q(called_at__isnull=False)
+        wait = ExpressionWrapper(F("called_at") - F("created_at"), output_field=DurationField())
+        created = []
+        for granularity, trunc in ((RollupGranularity.HOUR, TruncHour), (RollupGranularity.DAY, TruncDay)):
+            grouped = (
+                tickets.annotate(bucket=trunc("created_at"))
+                .values("queue_id", "queue__place_id", "bucket")
+                .annotate(
+                    total_count=Count("id"),
+                    active_count=Count("id", filter=Q(status=TicketStatus.ACTIVE)),
+                    used_count=Count("id", filter=Q(status=TicketStatus.USED)),
+                    canceled_count=Count("id", filter=Q(status=TicketStatus.CANCELED)),
+                    wait_count=Count("id", filter=called),
+                    wait_total=Sum(wait, filter=called),
+                )
+                .order_by()
+            )
+            created += [
+                cls(
+                    place_id=row["queue__place_id"], queue_id=row["queue_id"],
+                    granularity=granularity, bucket_start=row["bucket"],
+                    total_count=row["total_count"], active_count=row["active_count"],
+                    used_count=row["used_count"], canceled_count=row["canceled_count"],
+                    wait_count=row["wait_count"],
+                    wait_seconds_total=row["wait_total"].total_seconds() if row["wait_total"] else 0.0,
+                )
+                for row in grouped
+            ]
+        wait_bins = TicketWaitBin.from_tickets(tickets)
+        with transaction.atomic():
+            cls.objects.filter(buckets).delete()
+            TicketWaitBin.objects.filter(buckets).delete()
+            cls.objects.bulk_create(created, batch_size=1000)
+            TicketWaitBin.objects.bulk_create(wait_bins, batch_size=1000)
+        return len(created)
+
+
+class TicketWaitBin(models.Model):
+    """
+    binهای اسکچ چندک زمان انتظار (core.sketch) برای هر صف در هر بازه‌ی ساعتی/روزانه‌ی TicketRollup.
+    ادغام اسکچ‌ها روی چند صف یا بازه: SUM(count) GROUP BY bin.
+    """
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name="wait_bins")
+    queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="wait_bins")
+    granularity = models.CharField(max_length=10, choices=RollupGranularity.CHOICES)
+    bucket_start = models.DateTimeField()
+    bin = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("queue", "granularity", "bucket_start", "bin")
+        indexes = [
+            models.Index(fields=["place", "granularity", "bucket_start"], name="waitbin_place_bucket_idx"),
+            models.Index(fields=["granularity", "bucket_start"], name="waitbin_bucket_idx"),
+        ]
+
+    @classmethod
+    def apply(cls, place_id, queue_id, created_at, old_wait=None, new_wait=None):
+        """
+        جابه‌جایی تیکت بین binها وقتی زمان انتظارش تغییر می‌کند (فراخوانی، requeue، حذف).
+        """
+        old_bin = None if old_wait is None else bin_index(old_wait)
+        new_bin = None if new_wait is None else bin_index(new_wait)
+        if old_bin == new_bin:
+            return
+        if old_bin is not None:
+            bump_buckets(cls, place_id, created_at, {"count": F("count") - 1}, queue_id=queue_id, bin=old_bin)
+        if new_bin is not None:
+            bump_buckets(cls, place_id, created_at, {"count": F("count") + 1}, queue_id=queue_id, bin=new_bin)
+
+    @classmethod
+    def apply_counts(cls, place_id, queue_id, counts):
+        """
+        تغییرات دسته‌ای: counts {(created_at, bin): تغییر شمارش}.
+        """
+        bump_buckets_many(cls, place_id, {key: {"count": count} for key, count in counts.items()},
+                          key_fields=("bin",), queue_id=queue_id)
+
+    @classmethod
+    def from_tickets(cls, tickets):
+        counts = Counter()
+        rows = tickets.filter(called_at__isnull=False).values_list(
+            "queue_id", "queue__place_id", "created_at", "called_at"
+        )
+        for queue_id, place_id, created_at, called_at in rows.iterator():
+            index = bin_index((called_at - created_at).total_seconds())
+            for granularity, bucket_start in TicketRollup.bucket_starts(created_at):
+                counts[(place_id, queue_id, granularity, bucket_start, index)] += 1
+        return [
+            cls(place_id=place_id, queue_id=queue_id, granularity=granularity,
+                bucket_start=bucket_start, bin=index, count=count)
+            for (place_id, queue_id, granularity, bucket_start, index), count in counts.items()
+        ]
+
+    @classmethod
+    def sketch(cls, queryset):
+        """
+        اسکچ ادغام‌شده‌ی binهای queryset.
+        """
+        rows = queryset.values("bin").annotate(total=Sum("count")).order_by().values_list("bin", "total")
+        return WaitSketch(dict(rows))
+
 
 class Notification(models.Model):
     CHANNEL_CHOICES = (
@@ -184,6 +652,57 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            # NotificationPagination: filter(user) order_by(-created_at, -id)
+            models.Index(fields=["user", "-created_at", "-id"], name="notification_user_created_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], condition=Q(is_read=False),
+                         name="notification_unread_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
+
+
+class OutboxStatus:
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    CHOICES = (
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    )
+
+
+class OutboxEvent(models.Model):
+    """
+    اعلان‌هایی که در همان تراکنش تغییر تیکت ذخیره می‌شوند
+    و بعداً توسط dispatch_outbox ارسال می‌شوند.
+    """
+    KIND_USER = "user"    # اعلان برای یک کاربر (+ آپدیت صفحه‌ی مکان)
+    KIND_QUEUE = "queue"  # اعلان برای همه‌ی تیکت‌های فعال یک صف
+    KIND_BATCH = "batch"  # اعلان جدا برای هر تیکت یک تغییر دسته‌ای (+ یک آپدیت مکان)
+
+    KIND_CHOICES = (
+        (KIND_USER, "User"),
+        (KIND_QUEUE, "Queue"),
+        (KIND_BATCH, "Batch"),
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = JSONField()
+    status = models.CharField(max_length=20, choices=OutboxStatus.CHOICES, default=OutboxStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("id",)
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="outbox_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
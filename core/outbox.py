@@ -0,0 +1,204 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification, OutboxEvent, OutboxStatus, Ticket, TicketStatus
+from .tracing import span
+from .utils import (
+    send_ws_notification, send_ws_notifications, send_ws_messages, send_queue_update,
+)
+
+User = get_user_model()
+
+MAX_BACKOFF_SECONDS = 300
+# مدت اجاره‌ی رویدادهای برداشته‌شده؛ اگر worker وسط کار از بین برود بعد از آن دوباره برداشته می‌شوند
+LEASE_SECONDS = 300
+# پیشرفت ایمیل‌های گروهی بعد از هر چند ایمیل ذخیره می‌شود
+EMAIL_PROGRESS_EVERY = 20
+
+
+def _from_email():
+    return getattr(settings, "DEFAULT_FROM_EMAIL", "noreply@example.com")
+
+
+def _save_progress(event):
+    OutboxEvent.objects.filter(pk=event.pk).update(payload=event.payload)
+
+
+def _step(event, name, fn, persist=False):
+    """
+    هر مرحله فقط یک بار با موفقیت اجرا می‌شود؛ در تلاش مجدد مراحل انجام‌شده رد می‌شوند.
+    مراحل persist همان لحظه ثبت می‌شوند (مرحله‌های دیتابیسی در همان تراکنش)، تا بعد از crash
+    اعلان یا ایمیل دوباره فرستاده نشود؛ بقیه (وب‌سوکت) با نتیجه‌ی نهایی رویداد ذخیره می‌شوند.
+    پیام‌های وب‌سوکت همگام (wait=True) فرستاده می‌شوند؛ مرحله فقط بعد از پذیرفته شدن همه‌ی
+    پیام‌ها توسط لایه‌ی کانال انجام‌شده حساب می‌شود و خطا به تلاش مجدد رویداد می‌رسد.
+    """
+    done = event.payload.setdefault("done", [])
+    if name in done:
+        return
+    if persist == "atomic":
+        with transaction.atomic():
+            fn()
+            done.append(name)
+            _save_progress(event)
+        return
+    fn()
+    done.append(name)
+    if persist:
+        _save_progress(event)
+
+
+def _send_emails(event, mail, messages):
+    """
+    ارسال ایمیل‌ها یکی‌یکی روی همان اتصال؛ کلید گیرنده‌های موفق در payload["emailed"] ثبت می‌شود
+    تا تلاش مجدد بعد از خطای SMTP وسط کار فقط باقی‌مانده‌ها را بفرستد.
+    messages: [(key, EmailMessage)]
+    """
+    emailed = event.payload.setdefault("emailed", [])
+    skip = set(emailed)
+    for key, email in messages:
+        if key in skip:
+            continue
+        mail.send_messages([email])
+        emailed.append(key)
+        # هنگام خطا dispatch_pending خود payload را ذخیره می‌کند؛ این برای crash وسط کار است
+        if len(emailed) % EMAIL_PROGRESS_EVERY == 0:
+            _save_progress(event)
+    # مرحله‌ی email با persist همراه حذف این فهرست ثبت می‌شود
+    del event.payload["emailed"]
+
+
+def _deliver_user(event, users, mail):
+    data = event.payload
+    user = users.get(data["user_id"])
+    if user is None:
+        return  # کاربر حذف شده
+
+    def notification():
+        Notification.objects.create(user=user, title=data["title"], message=data["message"])
+
+    def email():
+        if data.get("email") and user.email:
+            EmailMessage(data["title"], data["message"], _from_email(), [user.email], connection=mail).send()
+
+    _step(event, "notification", notification, persist="atomic")
+    if data.get("ws"):
+        _step(event, "ws", lambda: send_ws_notification(user.id, data["ws"], wait=True))
+    _step(event, "email", email, persist=bool(data.get("email") and user.email))
+    if data.get("place_data"):
+        _step(event, "place", lambda: send_queue_update(data["place_id"], data["place_data"], wait=True))
+
+
+def _deliver_queue(event, mail):
+    data = event.payload
+    title, message = data["title"], data["message"]
+    # یک کوئری برای همه‌ی کاربران تیکت‌های فعال
+    users = [
+        t.user for t in Ticket.objects.filter(queue_id=data["queue_id"], status=TicketStatus.ACTIVE)
+        .select_related("user").only("user__id", "user__email")
+    ]
+
+    def notifications():
+        Notification.objects.bulk_create(
+            [Notification(user=u, title=title, message=message) for u in users], batch_size=500,
+        )
+
+    _step(event, "notification", notifications, persist="atomic")
+    _step(event, "ws", lambda: send_ws_notifications([u.id for u in users], {"title": title, "message": message}, wait=True))
+    _step(event, "email", lambda: _send_emails(event, mail, [
+        (u.id, EmailMessage(title, message, _from_email(), [u.email], connection=mail)) for u in users if u.email
+    ]), persist=True)
+    if data.get("place_data"):
+        _step(event, "place", lambda: send_queue_update(data["place_id"], data["place_data"], wait=True))
+
+
+def _deliver_batch(event, mail):
+    data = event.payload
+    messages = data["messages"]
+    users = User.objects.only("id", "email").in_bulk({m["user_id"] for m in messages})
+    messages = [m for m in messages if m["user_id"] in users]  # کاربران حذف‌شده
+
+    def notifications():
+        Notification.objects.bulk_create([
+            Notification(user_id=m["user_id"], title=m["title"], message=m["message"]) for m in messages
+        ], batch_size=500)
+
+    def emails():
+        if data.get("email"):
+            # کلید: جای پیام در payload (یک کاربر ممکن است چند پیام داشته باشد)
+            _send_emails(event, mail, [
+                (index, EmailMessage(m["title"], m["message"], _from_email(), [users[m["user_id"]].email],
+                                     connection=mail))
+                for index, m in enumerate(data["messages"])
+                if m["user_id"] in users and users[m["user_id"]].email
+            ])
+
+    _step(event, "notification", notifications, persist="atomic")
+    _step(event, "ws", lambda: send_ws_messages([(m["user_id"], m["ws"]) for m in messages if m.get("ws")], wait=True))
+    _step(event, "email", emails, persist=bool(data.get("email")))
+    if data.get("place_data"):
+        _step(event, "place", lambda: send_queue_update(data["place_id"], data["place_data"], wait=True))
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, MAX_BACKOFF_SECONDS))
+
+
+def claim(batch_size, lease=LEASE_SECONDS):
+    """
+    برداشتن یک دسته از رویدادهای آماده در یک تراکنش کوتاه: available_at آن‌ها به بعد از
+    مدت اجاره منتقل می‌شود تا worker دیگری برشان ندارد.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxStatus.PENDING, available_at__lte=now)
+            .order_by("id")[:batch_size]
+        )
+        if events:
+            OutboxEvent.objects.filter(id__in=[e.id for e in events]).update(available_at=now + timedelta(seconds=lease))
+    return events
+
+
+def dispatch_pending(batch_size=100, max_attempts=5):
+    """
+    ارسال یک دسته از رویدادهای outbox. تعداد رویدادهای پردازش‌شده را برمی‌گرداند.
+    ارسال‌ها بیرون از تراکنش انجام می‌شوند (قفل نوشتن دیتابیس پشت SMTP نمی‌ماند) و نتیجه‌ی
+    هر رویداد جدا ذخیره می‌شود؛ چند worker می‌توانند هم‌زمان اجرا شوند (claim).
+    """
+    events = claim(batch_size)
+    if not events:
+        return 0
+
+    user_ids = {e.payload["user_id"] for e in events if e.kind == OutboxEvent.KIND_USER}
+    users = User.objects.in_bulk(user_ids)
+    mail = get_connection(fail_silently=False)
+    try:
+        for event in events:
+            try:
+                # ادامه‌ی trace درخواستی که رویداد را ثبت کرده (core.tracing)
+                with span("outbox.deliver", parent=event.payload.get("trace"), kind=event.kind, event_id=event.id):
+                    if event.kind == OutboxEvent.KIND_QUEUE:
+                        _deliver_queue(event, mail)
+                    elif event.kind == OutboxEvent.KIND_BATCH:
+                        _deliver_batch(event, mail)
+                    else:
+                        _deliver_user(event, users, mail)
+            except Exception as exc:
+                event.attempts += 1
+                event.last_error = repr(exc)
+                event.available_at = timezone.now() + _backoff(event.attempts)
+                if event.attempts >= max_attempts:
+                    event.status = OutboxStatus.FAILED
+            else:
+                event.status = OutboxStatus.SENT
+                event.sent_at = timezone.now()
+            event.save(update_fields=["payload", "status", "attempts", "last_error", "available_at", "sent_at"])
+    finally:
+        mail.close()
+    return len(events)
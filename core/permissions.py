@@ -23,8 +23,9 @@ class IsQueueOwnerAdmin(BasePermission):
         if not (user and user.is_authenticated and getattr(user, "role", "") == "place_admin"):
             return False
         # Ticket or Queue object
+        # مقایسه با owner_id تا کاربر مالک دوباره از دیتابیس خوانده نشود
         if hasattr(obj, "queue") and hasattr(obj.queue, "place"):
-            return obj.queue.place.owner == user
+            return obj.queue.place.owner_id == user.id
         if hasattr(obj, "place"):
-            return obj.place.owner == user
+            return obj.place.owner_id == user.id
         return False
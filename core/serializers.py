@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Place, Queue, Ticket, Notification
+from .models import Place, Queue, Ticket, Notification, TicketStatus
+from .eta import eta_engine
 
 User = get_user_model()
 
@@ -56,6 +57,7 @@ class PlaceSerializer(serializers.ModelSerializer):
 
 class QueueSerializer(serializers.ModelSerializer):
     place = serializers.PrimaryKeyRelatedField(read_only=True)
+    average_wait_time = serializers.DurationField(read_only=True)
 
     class Meta:
         model = Queue
@@ -81,11 +83,22 @@ class QueueCreateSerializer(serializers.ModelSerializer):
 class TicketSerializer(serializers.ModelSerializer):
     queue = serializers.PrimaryKeyRelatedField(read_only=True)
     user = serializers.ReadOnlyField(source="user.username")
+    # فقط برای تیکت‌های منتظر؛ از ایندکس حافظه‌ی core.eta، بدون COUNT روی تیکت‌ها
+    position = serializers.SerializerMethodField()
+    estimated_call_at = serializers.SerializerMethodField()
 
     class Meta:
         model = Ticket
         fields = ("id", "queue", "user", "number", "status",
-                  "cancel_reason", "created_at", "called_at", "completed_at")
+                  "cancel_reason", "created_at", "called_at", "completed_at", "counter",
+                  "position", "estimated_call_at")
+
+    def get_position(self, obj):
+        return eta_engine.position(obj)
+
+    def get_estimated_call_at(self, obj):
+        eta = eta_engine.estimated_call_at(obj)
+        return serializers.DateTimeField().to_representation(eta) if eta else None
 
 
 class TicketCreateSerializer(serializers.ModelSerializer):
@@ -102,16 +115,8 @@ class TicketCreateSerializer(serializers.ModelSerializer):
 
         queue = validated_data["queue"]
 
-        # آخرین شماره نوبت در این صف
-        last_ticket = queue.tickets.order_by("-number").first()
-        next_number = last_ticket.number + 1 if last_ticket else 1
-
-        ticket = Ticket.objects.create(
-            queue=queue,
-            user=user,
-            number=next_number,
-            status=TicketStatus.ACTIVE,
-        )
+        # شماره نوبت به صورت اتمیک از last_ticket_number صف گرفته می‌شود
+        ticket = queue.issue_ticket(user, status=TicketStatus.ACTIVE)
         return ticket
 
 
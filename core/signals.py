@@ -1,13 +1,41 @@
-from django.db.models.signals import post_save, post_delete
+import threading
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
-from .models import Ticket
+from .models import Queue, Ticket, TicketRollup, TicketWaitBin, User, tickets_transitioned
+from .sketch import bin_index
+from .eta import eta_engine
+from .middleware import user_cache
+from .tracing import traced
 from .utils import send_queue_update
 
-@receiver([post_save, post_delete], sender=Ticket)
-def update_queue_stats(sender, instance, **kwargs):
-    queue = instance.queue
-    queue.update_statistics()
-    send_queue_update(queue.place.id, {
+STATS_FIELDS = {"status", "created_at", "called_at"}
+
+# صف‌هایی که در تراکنش جاری تیکتشان تغییر کرده و هنوز broadcast نشده‌اند (اتصال دیتابیس per-thread است)
+_pending = threading.local()
+
+
+@receiver(post_init, sender=Ticket)
+def remember_ticket_stats(sender, instance, **kwargs):
+    # سهم فعلی تیکت در آمار، برای محاسبه‌ی تغییرات (delta) بعد از ذخیره
+    if STATS_FIELDS & instance.get_deferred_fields():
+        instance._stats_snapshot = None
+        instance._rollup_snapshot = None
+        return
+    instance._stats_snapshot = instance.stats_contribution()
+    instance._rollup_snapshot = instance.rollup_state()
+
+
+def rebuild_queue_stats(queue_id):
+    queue = Queue.objects.filter(pk=queue_id).first()
+    if queue is not None:
+        queue.update_statistics()
+
+
+def broadcast_queue_stats(queue):
+    send_queue_update(queue.place_id, {
         "type": "queue_update",
         "queue_id": queue.id,
         "stats": {
@@ -17,3 +45,160 @@ def update_queue_stats(sender, instance, **kwargs):
             "average_wait_time": queue.average_wait_time.total_seconds() if queue.average_wait_time else None
         }
     })
+
+
+def pending_queues():
+    if not hasattr(_pending, "queues"):
+        _pending.queues = {}
+    return _pending.queues
+
+
+def schedule_queue_flush(queue_id, invalidate=False):
+    """
+    broadcast آمار و push ETA یک بار برای هر صف در هر تراکنش، بعد از commit.
+    هر تغییر callback خودش را ثبت می‌کند (callback‌های savepoint برگشت‌خورده حذف می‌شوند)؛
+    اولین callback‌ی که اجرا شود کار صف را انجام می‌دهد و بقیه چیزی پیدا نمی‌کنند.
+    """
+    queues = pending_queues()
+    queues[queue_id] = queues.get(queue_id, False) or invalidate
+    transaction.on_commit(lambda: flush_queue(queue_id))
+
+
+@traced("queue.flush")
+def flush_queue(queue_id):
+    queues = pending_queues()
+    if queue_id not in queues:
+        return
+    if queues.pop(queue_id):
+        eta_engine.invalidate(queue_id)
+    queue = Queue.objects.filter(pk=queue_id).first()
+    if queue is None:
+        return
+    eta_engine.push_updates(queue_id)
+    broadcast_queue_stats(queue)
+
+
+def queue_place_id(ticket):
+    if Ticket.queue.is_cached(ticket):
+        return ticket.queue.place_id
+    return Queue.objects.filter(pk=ticket.queue_id).values_list("place_id", flat=True).first()
+
+
+def record_service(queue_id, serviced):
+    if serviced is not None:
+        queue = Queue.objects.filter(pk=queue_id).first()
+        if queue is not None:
+            eta_engine.record_service(queue, serviced)
+
+
+@receiver(post_save, sender=Ticket)
+@traced("signal.update_queue_stats")
+def update_queue_stats(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not STATS_FIELDS & set(update_fields):
+        return
+    if not created and instance._stats_snapshot is None:
+        # وضعیت قبلی تیکت معلوم نیست (فیلدهای deferred)، بازسازی کامل
+        rebuild_queue_stats(instance.queue_id)
+        TicketRollup.rebuild(queue_ids=[instance.queue_id], start=instance.created_at, end=instance.created_at)
+        instance._stats_snapshot = instance.stats_contribution()
+        instance._rollup_snapshot = instance.rollup_state()
+        schedule_queue_flush(instance.queue_id, invalidate=True)
+        return
+
+    old_state = None if created else instance._rollup_snapshot
+    new_state = instance.rollup_state()
+    if old_state == new_state:
+        # هیچ فیلد مؤثر در آمار تغییر نکرده (ذخیره‌ی دوباره، فقط cancel_reason و ...)
+        return
+    old = (0, 0.0, 0) if created else instance._stats_snapshot
+    new = instance.stats_contribution()
+    Queue.apply_stats_delta(
+        instance.queue_id,
+        processed=new[0] - old[0],
+        wait_seconds=new[1] - old[1],
+        wait_samples=new[2] - old[2],
+        tickets=1 if created else 0,
+        number=instance.number if created else None,
+    )
+    place_id = queue_place_id(instance)
+    TicketRollup.apply_delta(place_id, instance.queue_id, instance.created_at, TicketRollup.delta(old_state, new_state))
+    TicketWaitBin.apply(place_id, instance.queue_id, instance.created_at, old_state and old_state[2], new_state[2])
+    record_service(instance.queue_id, eta_engine.tickets_changed(instance.queue_id, [(instance, old_state, new_state)]))
+    instance._stats_snapshot = new
+    instance._rollup_snapshot = new_state
+    schedule_queue_flush(instance.queue_id)
+
+
+@receiver(tickets_transitioned, sender=Ticket)
+@traced("signal.update_queue_stats_bulk")
+def update_queue_stats_bulk(sender, queue, instances, **kwargs):
+    """
+    مثل update_queue_stats برای Ticket.bulk_transition، ولی با یک به‌روزرسانی آمار، rollup و bin
+    برای کل دسته.
+    """
+    if any(t._stats_snapshot is None for t in instances):
+        rebuild_queue_stats(queue.id)
+        created = [t.created_at for t in instances]
+        TicketRollup.rebuild(queue_ids=[queue.id], start=min(created), end=max(created))
+        invalidate = True
+    else:
+        stats = [0, 0.0, 0]
+        rollups = {}
+        bins = Counter()
+        changes = []
+        for ticket in instances:
+            old, new = ticket._stats_snapshot, ticket.stats_contribution()
+            for i in range(3):
+                stats[i] += new[i] - old[i]
+            old_state, new_state = ticket._rollup_snapshot, ticket.rollup_state()
+            hour = TicketRollup.bucket_starts(ticket.created_at)[0][1]
+            delta = rollups.setdefault(hour, {})
+            for field, value in TicketRollup.delta(old_state, new_state).items():
+                delta[field] = delta.get(field, 0) + value
+            if old_state[2] is not None:
+                bins[(hour, bin_index(old_state[2]))] -= 1
+            if new_state[2] is not None:
+                bins[(hour, bin_index(new_state[2]))] += 1
+            changes.append((ticket, old_state, new_state))
+
+        Queue.apply_stats_delta(queue.id, processed=stats[0], wait_seconds=stats[1], wait_samples=stats[2])
+        TicketRollup.apply_deltas(queue.place_id, queue.id, rollups)
+        TicketWaitBin.apply_counts(queue.place_id, queue.id, bins)
+        record_service(queue.id, eta_engine.tickets_changed(queue.id, changes))
+        invalidate = False
+
+    for ticket in instances:
+        ticket._stats_snapshot = ticket.stats_contribution()
+        ticket._rollup_snapshot = ticket.rollup_state()
+    schedule_queue_flush(queue.id, invalidate=invalidate)
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_queue_stats(sender, instance, **kwargs):
+    old = instance._stats_snapshot
+    if old is None:
+        rebuild_queue_stats(instance.queue_id)
+        TicketRollup.rebuild(queue_ids=[instance.queue_id])
+        schedule_queue_flush(instance.queue_id, invalidate=True)
+        return
+
+    Queue.apply_stats_delta(
+        instance.queue_id,
+        processed=-old[0],
+        wait_seconds=-old[1],
+        wait_samples=-old[2],
+        tickets=-1,
+    )
+    place_id = queue_place_id(instance)
+    if place_id is None:
+        return  # صف هم (cascade) حذف شده
+    state = instance._rollup_snapshot
+    TicketRollup.apply_delta(place_id, instance.queue_id, state[0], TicketRollup.delta(state, None))
+    TicketWaitBin.apply(place_id, instance.queue_id, state[0], old_wait=state[2])
+    eta_engine.tickets_changed(instance.queue_id, [(instance, state, None)])
+    schedule_queue_flush(instance.queue_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
@@ -0,0 +1,72 @@
+"""
+اسکچ چندک (DDSketch) برای زمان انتظار.
+
+هر مقدار در یک bin لگاریتمی می‌افتد؛ چندک‌ها با خطای نسبی حداکثر RELATIVE_ACCURACY برگردانده می‌شوند.
+اسکچ فقط شمارش هر bin است، پس ادغام اسکچ‌ها (صف‌ها یا بازه‌های مختلف) جمع شمارش‌هاست
+و در دیتابیس با یک SUM ... GROUP BY bin انجام می‌شود (core.models.TicketWaitBin).
+"""
+from collections import Counter
+from math import ceil, log
+
+# تغییر این مقادیر binهای ذخیره‌شده را بی‌اعتبار می‌کند (backfill_rollups لازم است)
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = log(GAMMA)
+# مقادیر کوچک‌تر از MIN_VALUE ثانیه (و منفی) در bin صفر شمرده می‌شوند
+MIN_VALUE = 1e-3
+ZERO_BIN = -(10 ** 6)
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bin_index(value):
+    if value < MIN_VALUE:
+        return ZERO_BIN
+    return ceil(log(value) / LOG_GAMMA)
+
+
+def bin_value(index):
+    if index == ZERO_BIN:
+        return 0.0
+    # نقطه‌ای از bin که خطای نسبی آن برای هر مقدار داخل bin حداکثر RELATIVE_ACCURACY است
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class WaitSketch:
+
+    def __init__(self, bins=None):
+        self.bins = Counter(bins or {})
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(Counter(bin_index(value) for value in values))
+
+    def add(self, value, count=1):
+        self.bins[bin_index(value)] += count
+
+    def merge(self, other):
+        self.bins.update(other.bins)
+        return self
+
+    @property
+    def count(self):
+        return sum(c for c in self.bins.values() if c > 0)
+
+    def quantile(self, q):
+        """
+        چندک q (بین 0 و 1)؛ None اگر اسکچ خالی باشد.
+        """
+        items = sorted((index, c) for index, c in self.bins.items() if c > 0)
+        total = sum(c for _, c in items)
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index, c in items:
+            seen += c
+            if seen > rank:
+                return bin_value(index)
+        return bin_value(items[-1][0])
+
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        return {f"p{round(q * 100):g}": self.quantile(q) for q in qs}
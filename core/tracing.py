@@ -0,0 +1,164 @@
+"""
+ردیابی سبک (span) از درخواست HTTP تا تحویل پیام وب‌سوکت.
+
+trace در TracingMiddleware شروع می‌شود (یا با هدر X-Trace-Id ادامه پیدا می‌کند) و با contextvars
+در همان thread دنبال می‌شود. context آن در payload رویدادهای outbox و در متای پیام‌های
+encode_envelope (کلید "traces") حمل می‌شود و مصرف‌کننده‌ها با span‌ ws.deliver آن را می‌بندند؛
+origin (زمان شروع درخواست) در context است تا فاصله‌ی اقدام تا صفحه مستقیم حساب شود.
+
+هر span یک خط JSON در TRACE_FILE است (manage.py trace_report). بدون trace فعال span‌ها هیچ کاری نمی‌کنند.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def enabled():
+    return getattr(settings, "TRACE_ENABLED", False)
+
+
+def new_id(size=8):
+    return os.urandom(size).hex()
+
+
+class SpanExporter:
+    """نوشتن span‌ها، هر کدام یک خط JSON، در فایل TRACE_FILE (با تغییر تنظیم فایل دوباره باز می‌شود)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._file = None
+
+    def export(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        path = os.path.abspath(getattr(settings, "TRACE_FILE", "traces.jsonl"))
+        with self._lock:
+            if path != self._path:
+                if self._file is not None:
+                    self._file.close()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._file = open(path, "a", encoding="utf-8", buffering=1)
+                self._path = path
+            self._file.write(line)
+
+
+exporter = SpanExporter()
+
+
+def record(name, parent, start, duration, **attrs):
+    """ثبت span تمام‌شده‌ای که زمانش جای دیگری اندازه گرفته شده (dispatcher، مصرف‌کننده‌ها)."""
+    exporter.export({
+        "trace_id": parent["trace_id"],
+        "span_id": new_id(),
+        "parent_id": parent["span_id"],
+        "name": name,
+        "start": start,
+        "duration_ms": round(duration * 1000, 3),
+        "origin": parent.get("origin"),
+        "attrs": attrs,
+    })
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "origin", "start", "_t0", "attrs")
+
+    def __init__(self, name, trace_id, parent_id=None, origin=None, attrs=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.origin = origin or self.start
+        self.attrs = attrs or {}
+
+    def context(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "origin": self.origin}
+
+    def finish(self):
+        exporter.export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+            "origin": self.origin,
+            "attrs": self.attrs,
+        })
+
+
+def current_context():
+    span = _current.get()
+    return None if span is None else span.context()
+
+
+@contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as exc:
+        span.attrs["error"] = repr(exc)
+        raise
+    finally:
+        _current.reset(token)
+        span.finish()
+
+
+@contextmanager
+def start_trace(name, trace_id=None, **attrs):
+    """
+    span ریشه؛ با احتمال TRACE_SAMPLE_RATE (یا همیشه اگر trace_id از بیرون آمده باشد).
+    """
+    if not enabled() or (trace_id is None and random.random() >= getattr(settings, "TRACE_SAMPLE_RATE", 1.0)):
+        yield None
+        return
+    with _activate(Span(name, trace_id or new_id(16), attrs=attrs)) as span:
+        yield span
+
+
+@contextmanager
+def span(name, parent=None, **attrs):
+    """
+    span فرزند span جاری یا parent (context ذخیره‌شده، مثلاً در payload outbox).
+    """
+    parent = parent or current_context()
+    if parent is None or not enabled():
+        yield None
+        return
+    with _activate(Span(name, parent["trace_id"], parent["span_id"], parent.get("origin"), attrs)) as s:
+        yield s
+
+
+def traced(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def close_traces(message, consumer):
+    """در مصرف‌کننده بعد از ارسال فریم به کلاینت: یک span‌ ws.deliver برای هر trace پیام."""
+    traces = message.get("traces")
+    if not traces:
+        return
+    now = time.time()
+    for parent in traces:
+        origin = parent.get("origin")
+        record("ws.deliver", parent, now, 0.0, consumer=consumer,
+               e2e_ms=round((now - origin) * 1000, 3) if origin else None)
@@ -6,6 +6,7 @@ from .views import (
     NotificationListView, MarkNotificationReadView, RegisterView,
     AnalyticsView, UserProfileView, LogoutView
 )
+from .metrics import metrics_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,   # برای login
     TokenRefreshView,      # برای refresh
@@ -20,9 +21,12 @@ urlpatterns = [
     path("queues/<int:place_id>/join/", JoinQueueView.as_view(), name="join-queue"),
     path("tickets/<int:ticket_id>/leave/", LeaveQueueView.as_view(), name="leave-queue"),
     path("admin/queues/<int:queue_id>/tickets/", AdminTicketsView.as_view({"get": "list", "patch": "partial_update"}), name="admin-tickets"),
+    path("admin/queues/<int:queue_id>/tickets/batch/", AdminTicketsView.as_view({"post": "batch"}), name="admin-tickets-batch"),
+    path("admin/queues/<int:queue_id>/call-next/", AdminTicketsView.as_view({"post": "call_next"}), name="admin-call-next"),
     path("notifications/", NotificationListView.as_view(), name="notifications"),
     path("notifications/<int:pk>/read/", MarkNotificationReadView.as_view(), name="notification-read"),
     path("analytics/", AnalyticsView.as_view(), name="analytics"),
+    path("metrics", metrics_view, name="metrics"),
     path("auth/register/", RegisterView.as_view(), name="register"), # register
     path("auth/user/", UserProfileView.as_view(), name="user_profile"), # user profile
     path("auth/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"), # login 
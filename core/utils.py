@@ -1,19 +1,431 @@
+import asyncio
+import atexit
 import json
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+import threading
+import time
+from collections import deque
+from asgiref.sync import async_to_sync, SyncToAsync
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+import msgpack
 from django.core.mail import send_mail
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
-from .models import Notification
-
-def send_queue_update(place_id: int, data: dict):
-    layer = get_channel_layer()
-    async_to_sync(layer.group_send)(
-        f"place_{place_id}",
-        {
-            "type": "queue_update",
-            "data": data
+from .models import Notification, OutboxEvent
+from .feed import place_feed
+from .tracing import current_context, record as record_span
+from .metrics import (
+    broadcast_batch_size, broadcast_flush_seconds, dispatch_batch_size, dispatch_dropped, dispatch_latency_seconds,
+    group_send_failures, group_send_seconds,
+)
+
+ENVELOPE_VERSION = 1
+
+_json_encoder = DjangoJSONEncoder()
+
+
+def encode_envelope(handler: str, data: dict, traces=None, **meta):
+    """
+    پیام group_send که فریم آن فقط یک بار (همین‌جا) سریال می‌شود: text (JSON) و با
+    WS_ENVELOPE_MSGPACK همچنین bytes (msgpack)؛ هر مصرف‌کننده یکی را بدون تغییر به کلاینت می‌فرستد.
+    traces: context‌های trace که پیام حمل می‌کند (پیش‌فرض trace جاری، core.tracing).
+    """
+    frame = {"v": ENVELOPE_VERSION, **data}
+    message = {"type": handler, **meta}
+    message["text"] = json.dumps(frame, ensure_ascii=False, cls=DjangoJSONEncoder)
+    if getattr(settings, "WS_ENVELOPE_MSGPACK", False):
+        message["bytes"] = msgpack.packb(frame, default=_json_encoder.default)
+    if traces is None:
+        context = current_context()
+        traces = [context] if context else None
+    if traces:
+        message["traces"] = traces
+    return message
+
+
+def _server_loop():
+    # event loop سرور ASGI وقتی از داخل view همگام (sync_to_async) صدا زده شده‌ایم؛
+    # InMemoryChannelLayer فقط روی همان loop مصرف‌کننده‌ها را بیدار می‌کند.
+    loop = getattr(SyncToAsync.threadlocal, "main_event_loop", None)
+    return loop if loop is not None and loop.is_running() else None
+
+
+class ChannelDispatcher:
+    """
+    صف محدود group_send‌ها که یک thread با event loop خودش آن را خالی می‌کند؛
+    درخواست‌ها منتظر لایه‌ی کانال (رفت و برگشت Redis) نمی‌مانند.
+
+    هر بار تا WS_DISPATCH_BATCH_SIZE پیام با یک gather فرستاده می‌شود. وقتی صف پر است
+    WS_DISPATCH_OVERFLOW تعیین می‌کند: drop_oldest (پیش‌فرض، قدیمی‌ترین پیام دور ریخته می‌شود)،
+    drop_new (پیام جدید) یا block (تا WS_DISPATCH_BLOCK_TIMEOUT ثانیه صبر، بعد drop_new).
+    WS_DISPATCH_QUEUE_SIZE = 0 یعنی ارسال همگام مثل قبل.
+    """
+
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_new", "block")
+
+    def __init__(self, maxsize=None, batch_size=None, overflow=None):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self._cond = threading.Condition()
+        self._queue = deque()  # (group, message, enqueued_at, server_loop)
+        self._in_flight = 0
+        self._loop = None
+        self._thread = None
+        self.metrics = {
+            "enqueued": 0,
+            "sent": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "last_dispatch_latency_ms": 0.0,
+            "max_dispatch_latency_ms": 0.0,
+            "total_dispatch_latency_ms": 0.0,
         }
-    )
+
+    def get_maxsize(self):
+        if self.maxsize is not None:
+            return self.maxsize
+        return getattr(settings, "WS_DISPATCH_QUEUE_SIZE", 10000)
+
+    def get_batch_size(self):
+        return self.batch_size or getattr(settings, "WS_DISPATCH_BATCH_SIZE", 500)
+
+    def get_overflow(self):
+        policy = self.overflow or getattr(settings, "WS_DISPATCH_OVERFLOW", "drop_oldest")
+        if policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"unknown WS_DISPATCH_OVERFLOW: {policy!r}")
+        return policy
+
+    def send(self, group, message, loop=None):
+        self.send_many([(group, message)], loop=loop)
+
+    def send_now(self, messages):
+        """
+        ارسال همگام بدون صف؛ اگر لایه‌ی کانال پیامی را نپذیرد exception می‌دهد
+        (dispatch_outbox تا پذیرفته شدن پیام مرحله را انجام‌شده ثبت نمی‌کند).
+        """
+        messages = list(messages)
+        if messages:
+            self._send_inline(messages)
+
+    def send_many(self, messages, loop=None):
+        """
+        messages: لیست (group, message). loop: event loop سرور برای InMemoryChannelLayer
+        (پیش‌فرض loop درخواست جاری، اگر از داخل sync_to_async صدا زده شده باشیم).
+        """
+        messages = list(messages)
+        if not messages:
+            return
+        maxsize = self.get_maxsize()
+        if maxsize <= 0:
+            self._send_inline(messages)
+            return
+        loop = loop or _server_loop()
+        policy = self.get_overflow()
+        now = time.monotonic()
+        with self._cond:
+            for group, message in messages:
+                if len(self._queue) >= maxsize and policy == "block":
+                    deadline = now + getattr(settings, "WS_DISPATCH_BLOCK_TIMEOUT", 0.05)
+                    while len(self._queue) >= maxsize and time.monotonic() < deadline:
+                        self._cond.wait(max(deadline - time.monotonic(), 0.001))
+                if len(self._queue) >= maxsize:
+                    self.metrics["dropped"] += 1
+                    dispatch_dropped.inc()
+                    if policy != "drop_oldest":
+                        continue
+                    self._queue.popleft()
+                self._queue.append((group, message, now, loop))
+                self.metrics["enqueued"] += 1
+            m = self.metrics
+            m["queue_depth"] = len(self._queue)
+            m["max_queue_depth"] = max(m["max_queue_depth"], len(self._queue))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="channel-dispatcher", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    @staticmethod
+    async def _group_send_ordered(layer, messages):
+        """
+        پیام‌های یک گروه پشت سر هم (ترتیب seq مکان روی Redis هم حفظ شود)، گروه‌های مختلف هم‌زمان.
+        نتیجه (None یا exception) به ترتیب messages.
+        """
+        results = [None] * len(messages)
+        by_group = {}
+        for index, (group, message) in enumerate(messages):
+            by_group.setdefault(group, []).append((index, message))
+
+        async def send_group(group, items):
+            for index, message in items:
+                try:
+                    await layer.group_send(group, message)
+                except Exception as exc:
+                    results[index] = exc
+
+        await asyncio.gather(*(send_group(group, items) for group, items in by_group.items()))
+        return results
+
+    def _send_inline(self, messages):
+        layer = get_channel_layer()
+        wall, start = time.time(), time.perf_counter()
+        results = async_to_sync(self._group_send_ordered)(layer, messages)
+        duration = time.perf_counter() - start
+        group_send_seconds.observe(duration)
+        for (group, message), result in zip(messages, results):
+            if result is None:
+                for parent in message.get("traces") or ():
+                    record_span("channel.group_send", parent, wall, duration, group=group)
+        failed = [result for result in results if isinstance(result, Exception)]
+        with self._cond:
+            self.metrics["enqueued"] += len(messages)
+            self.metrics["sent"] += len(messages) - len(failed)
+            self.metrics["failed"] += len(failed)
+        if failed:
+            group_send_failures.inc(len(failed))
+            raise failed[0]
+        with self._cond:
+            self.metrics["enqueued"] += len(messages)
+            self.metrics["sent"] += len(messages)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch = [self._queue.popleft() for _ in range(min(self.get_batch_size(), len(self._queue)))]
+                self._in_flight = len(batch)
+                self.metrics["queue_depth"] = len(self._queue)
+                self._cond.notify_all()  # جا برای فرستنده‌های block شده
+            dispatch_batch_size.observe(len(batch))
+            try:
+                self._dispatch(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _dispatch(self, batch):
+        layer = get_channel_layer()
+        # InMemoryChannelLayer روی loop سرور؛ لایه‌های شبکه‌ای (Redis) روی loop همین thread
+        by_loop = {}
+        for group, message, since, loop in batch:
+            target = loop if isinstance(layer, InMemoryChannelLayer) and loop is not None and loop.is_running() else None
+            by_loop.setdefault(target, []).append((group, message, since))
+
+        for loop, items in by_loop.items():
+            send_all = self._group_send_ordered(layer, [(group, message) for group, message, _ in items])
+            start = time.perf_counter()
+            try:
+                if loop is None:
+                    results = self._loop.run_until_complete(send_all)
+                else:
+                    results = asyncio.run_coroutine_threadsafe(send_all, loop).result(timeout=30)
+            except Exception as exc:
+                results = [exc] * len(items)
+            group_send_seconds.observe(time.perf_counter() - start)
+            done = time.monotonic()
+            traced = []
+            with self._cond:
+                m = self.metrics
+                m["batches"] += 1
+                for (group, message, since), result in zip(items, results):
+                    if isinstance(result, Exception):
+                        # لایه‌ی کانال در دسترس نیست؛ پیام از دست می‌رود ولی thread زنده می‌ماند
+                        m["failed"] += 1
+                        group_send_failures.inc()
+                        continue
+                    dispatch_latency_seconds.observe(done - since)
+                    latency_ms = (done - since) * 1000
+                    if message.get("traces"):
+                        traced.append((group, message["traces"], since))
+                    m["sent"] += 1
+                    m["last_dispatch_latency_ms"] = latency_ms
+                    m["max_dispatch_latency_ms"] = max(m["max_dispatch_latency_ms"], latency_ms)
+                    m["total_dispatch_latency_ms"] += latency_ms
+            wall = time.time()
+            for group, traces, since in traced:
+                for parent in traces:
+                    record_span("channel.group_send", parent, wall - (done - since), done - since, group=group)
+
+    def flush(self, timeout=10):
+        """صبر تا خالی شدن صف و ارسال پیام‌های در حال ارسال (برای تست‌ها و هنگام خروج)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                if self._thread is None or not self._thread.is_alive():
+                    return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            m = dict(self.metrics)
+            m["queue_depth"] = len(self._queue)
+        m["avg_dispatch_latency_ms"] = m["total_dispatch_latency_ms"] / m["sent"] if m["sent"] else 0.0
+        return m
+
+
+channel_dispatcher = ChannelDispatcher()
+atexit.register(channel_dispatcher.flush)
+
+
+class PlaceBroadcaster:
+    """
+    تجمیع پیام‌های place_{id} در یک پنجره‌ی زمانی کوتاه (QUEUE_BROADCAST_WINDOW_MS).
+
+    هر رویداد هنگام انتشار از place_feed شماره‌ی seq می‌گیرد.
+    آمار جدیدتر یک صف (type=queue_update با همان queue_id) جایگزین آمار قبلی می‌شود
+    و در پایان هر پنجره یک فریم برای هر مکان فرستاده می‌شود: خود رویداد اگر تنها باشد،
+    وگرنه {"type": "batch", "events": [...]}.
+    """
+
+    def __init__(self, window_ms=None):
+        self.window_ms = window_ms
+        self._cond = threading.Condition()
+        self._pending = {}  # place_id -> (first_event_time, [events], [trace contexts])
+        self._in_flight = 0
+        self._loop = None
+        self._thread = None
+        self.metrics = {
+            "events": 0,
+            "merged": 0,
+            "frames": 0,
+            "failed": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+            "total_flush_latency_ms": 0.0,
+        }
+
+    def get_window(self):
+        if self.window_ms is not None:
+            return self.window_ms / 1000
+        return getattr(settings, "QUEUE_BROADCAST_WINDOW_MS", 100) / 1000
+
+    @staticmethod
+    def supersedes(new, old):
+        return (
+            new.get("type") == "queue_update" and old.get("type") == "queue_update"
+            and new.get("queue_id") == old.get("queue_id")
+        )
+
+    def publish(self, place_id, data: dict, wait=False):
+        """wait: بدون پنجره و صف، تا پذیرفته شدن پیام توسط لایه‌ی کانال (خطا exception می‌دهد)."""
+        now = time.monotonic()
+        if wait or self.get_window() <= 0:
+            with self._cond:
+                data = place_feed.stamp(place_id, data)
+                self.metrics["events"] += 1
+            self._send(place_id, now, [data], wait=wait)
+            return
+
+        with self._cond:
+            data = place_feed.stamp(place_id, data)
+            self._loop = _server_loop() or self._loop
+            self.metrics["events"] += 1
+            since, events, traces = self._pending.setdefault(place_id, (now, [], []))
+            kept = [e for e in events if not self.supersedes(data, e)]
+            self.metrics["merged"] += len(events) - len(kept)
+            kept.append(data)
+            # trace رویداد جایگزین‌شده هم با فریم بعدی بسته می‌شود (اثرش به صفحه رسیده)
+            context = current_context()
+            if context and all(t["trace_id"] != context["trace_id"] for t in traces):
+                traces = traces + [context]
+            self._pending[place_id] = (since, kept, traces)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="place-broadcaster", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _take_due(self, force=False):
+        now = time.monotonic()
+        window = self.get_window()
+        due = [pid for pid, (since, *_) in self._pending.items() if force or now - since >= window]
+        return [(pid, *self._pending.pop(pid)) for pid in due]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                due = self._take_due()
+                if not due:
+                    oldest = min(since for since, *_ in self._pending.values())
+                    self._cond.wait(max(oldest + self.get_window() - time.monotonic(), 0.001))
+                    continue
+                self._in_flight = len(due)
+            for place_id, since, events, traces in due:
+                try:
+                    self._send(place_id, since, events, traces)
+                except Exception:
+                    # لایه‌ی کانال در دسترس نیست؛ این فریم از دست می‌رود ولی thread زنده می‌ماند
+                    with self._cond:
+                        self.metrics["failed"] += 1
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def flush(self, timeout=10):
+        """ارسال فوری همه‌ی پیام‌های در انتظار (برای تست‌ها و هنگام خروج)."""
+        with self._cond:
+            due = self._take_due(force=True)
+        for place_id, since, events, traces in due:
+            self._send(place_id, since, events, traces)
+        # فریم‌هایی که thread پس‌زمینه همین حالا برداشته باید پیش از خالی کردن dispatcher صف شوند
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight and self._thread is not None and self._thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        channel_dispatcher.flush()
+
+    def _send(self, place_id, since, events, traces=None, wait=False):
+        data = events[0] if len(events) == 1 else {"type": "batch", "events": events}
+        seqs = [e["seq"] for e in events if "seq" in e]
+        message = encode_envelope("queue_update", data, traces=traces, seq=max(seqs) if seqs else None)
+        if wait:
+            channel_dispatcher.send_now([(f"place_{place_id}", message)])
+        else:
+            loop = self._loop if threading.current_thread() is self._thread else None
+            channel_dispatcher.send(f"place_{place_id}", message, loop=loop)
+        latency = time.monotonic() - since
+        broadcast_flush_seconds.observe(latency)
+        broadcast_batch_size.observe(len(events))
+        latency_ms = latency * 1000
+        with self._cond:
+            m = self.metrics
+            m["frames"] += 1
+            m["last_batch_size"] = len(events)
+            m["max_batch_size"] = max(m["max_batch_size"], len(events))
+            m["last_flush_latency_ms"] = latency_ms
+            m["max_flush_latency_ms"] = max(m["max_flush_latency_ms"], latency_ms)
+            m["total_flush_latency_ms"] += latency_ms
+
+    def stats(self):
+        with self._cond:
+            m = dict(self.metrics)
+        m["avg_batch_size"] = (m["events"] - m["merged"]) / m["frames"] if m["frames"] else 0.0
+        m["avg_flush_latency_ms"] = m["total_flush_latency_ms"] / m["frames"] if m["frames"] else 0.0
+        return m
+
+
+place_broadcaster = PlaceBroadcaster()
+atexit.register(place_broadcaster.flush)
+
+
+def send_queue_update(place_id: int, data: dict, wait=False):
+    place_broadcaster.publish(place_id, data, wait=wait)
 
 def create_notification(user, title: str, message: str, channel: str = "websocket"):
     try:
@@ -22,39 +434,77 @@ def create_notification(user, title: str, message: str, channel: str = "websocke
         # don't fail the request if notification cannot be saved
         pass
 
-def send_ws_notification(user_id: int, data: dict):
-    layer = get_channel_layer()
-    async_to_sync(layer.group_send)(
-        f"user_{user_id}",
-        {
-            "type": "send_notification",
-            "message": json.dumps(data, ensure_ascii=False)
-        }
-    )
+def enqueue_user_notification(user, title: str, message: str, ws_data: dict = None,
+                              place_id: int = None, place_data: dict = None, email: bool = True):
+    """
+    ثبت اعلان کاربر در outbox؛ باید داخل تراکنش تغییر تیکت صدا زده شود.
+    ارسال واقعی (Notification، وب‌سوکت، ایمیل، آپدیت مکان) با dispatch_outbox انجام می‌شود.
+    """
+    return OutboxEvent.objects.create(kind=OutboxEvent.KIND_USER, payload={
+        "user_id": user.id,
+        "title": title,
+        "message": message,
+        "ws": ws_data,
+        "email": email,
+        "place_id": place_id,
+        "place_data": place_data,
+        "done": [],
+        "trace": current_context(),
+    })
+
+def enqueue_queue_broadcast(queue, title: str, message: str, place_data: dict = None):
+    """
+    ثبت اعلان برای همه‌ی تیکت‌های فعال صف در outbox.
+    """
+    return OutboxEvent.objects.create(kind=OutboxEvent.KIND_QUEUE, payload={
+        "queue_id": queue.id,
+        "title": title,
+        "message": message,
+        "place_id": queue.place_id,
+        "place_data": place_data,
+        "done": [],
+        "trace": current_context(),
+    })
+
+def enqueue_batch_notification(messages, place_id: int = None, place_data: dict = None, email: bool = True):
+    """
+    یک رویداد outbox برای تغییر دسته‌ای تیکت‌ها؛ messages لیست dict با user_id، title، message و ws.
+    اعلان‌ها با bulk_create، ایمیل‌ها روی یک اتصال و آپدیت مکان یک بار فرستاده می‌شوند.
+    """
+    return OutboxEvent.objects.create(kind=OutboxEvent.KIND_BATCH, payload={
+        "messages": list(messages),
+        "email": email,
+        "place_id": place_id,
+        "place_data": place_data,
+        "done": [],
+        "trace": current_context(),
+    })
+
+def _dispatch(messages, wait):
+    # wait: همگام و با exception برای dispatch_outbox، وگرنه از صف channel_dispatcher
+    if wait:
+        channel_dispatcher.send_now(messages)
+    else:
+        channel_dispatcher.send_many(messages)
+
+def send_ws_notification(user_id: int, data: dict, wait=False):
+    _dispatch([(f"user_{user_id}", encode_envelope("send_notification", data))], wait)
+
+def send_ws_notifications(user_ids, data: dict, wait=False):
+    """
+    ارسال یک پیام به گروه چند کاربر؛ channel_dispatcher آن‌ها را دسته‌ای با gather می‌فرستد.
+    """
+    message = encode_envelope("send_notification", data)
+    _dispatch([(f"user_{uid}", dict(message)) for uid in user_ids], wait)
+
+def send_ws_messages(messages, wait=False):
+    """
+    ارسال پیام جدا برای هر کاربر: messages لیست (user_id, data)، دسته‌ای مثل send_ws_notifications.
+    """
+    _dispatch([(f"user_{uid}", encode_envelope("send_notification", data)) for uid, data in messages], wait)
 
 def send_email_notification(subject: str, message: str, recipient_list: list):
     try:
         send_mail(subject, message, getattr(settings, "DEFAULT_FROM_EMAIL", "noreply@example.com"), recipient_list, fail_silently=True)
     except Exception:
         pass
-
-
-def send_queue_event(place_id, event_type, data):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"place_{place_id}",
-        {
-            "type": "queue_update",
-            "data": {"type": event_type, "payload": data},
-        }
-    )
-
-def send_user_notification(user_id, message):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"user_{user_id}",
-        {
-            "type": "send_notification",
-            "message": message,
-        }
-    )
@@ -1,56 +1,62 @@
+import math
+
 from rest_framework.response import Response
 from rest_framework import status, generics, viewsets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from django.db.models import Max, Count, Avg, ExpressionWrapper, F, DurationField
+from django.db.models import Q, Sum
 from django.utils.dateparse import parse_datetime
-from .models import Place, Queue, Ticket, Notification, TicketStatus    
+from .models import Place, Queue, Ticket, Notification, TicketStatus, TicketRollup, TicketWaitBin, RollupGranularity
 from .serializers import (
     PlaceSerializer, QueueSerializer, QueueCreateSerializer,
-    TicketSerializer, RegisterSerializer, NotificationSerializer, TicketCreateSerializer,
+    TicketSerializer, RegisterSerializer, NotificationSerializer,
     UserSerializer,
 )
-from .permissions import IsPlaceAdmin, IsSystemAdmin, IsQueueOwnerAdmin
-from .utils import create_notification, send_ws_notification, send_email_notification, send_queue_update,send_queue_event, send_user_notification
-from math import radians, cos, sin, asin, sqrt
-from django.utils import timezone
-from rest_framework.decorators import action
-from django.db import models
+from .permissions import IsPlaceAdmin, IsSystemAdmin
+from .pagination import TicketPagination, NotificationPagination
+from .utils import (
+    enqueue_user_notification, enqueue_queue_broadcast, enqueue_batch_notification,
+)
+from .geo import nearby_places
+from .db import ReplicaReadMixin
+from django.db import models, transaction
 from rest_framework import generics, permissions
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import RefreshToken
 
 User = get_user_model()
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return R * c
-
-
 class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = [AllowAny]
 
 
-class NearbyPlacesView(APIView):
+class NearbyPlacesView(ReplicaReadMixin, APIView):
     permission_classes = [AllowAny]
     def get(self, request):
         try:
             lat = float(request.GET.get("lat"))
             lon = float(request.GET.get("lon"))
             radius = float(request.GET.get("radius", 5))
+            limit = request.GET.get("limit")
+            limit = int(limit) if limit else None
         except (TypeError, ValueError):
             return Response({"detail": "invalid coordinates"}, status=400)
-        q = Place.objects.all()
-        nearby = [p for p in q if haversine(lat, lon, p.latitude, p.longitude) <= radius]
-        serializer = PlaceSerializer(nearby, many=True, context={"request": request})
-        return Response(serializer.data)
+        # float() قبول می‌کند nan و inf را؛ محاسبه‌ی bbox با آن‌ها خطای 500 می‌داد
+        if not all(map(math.isfinite, (lat, lon, radius))) or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({"detail": "invalid coordinates"}, status=400)
+        if radius <= 0:
+            return Response({"detail": "invalid radius"}, status=400)
+        if limit is not None and limit <= 0:
+            return Response({"detail": "invalid limit"}, status=400)
+
+        nearby = nearby_places(Place.objects.select_related("owner"), lat, lon, radius, limit=limit)
+        serializer = PlaceSerializer([p for p, _ in nearby], many=True, context={"request": request})
+        data = serializer.data
+        for item, (_, distance) in zip(data, nearby):
+            item["distance_km"] = round(distance, 3)
+        return Response(data)
 
 
 class PlaceViewSet(viewsets.ModelViewSet):
@@ -59,9 +65,10 @@ class PlaceViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        places = Place.objects.select_related("owner")
         if user.role == "super_admin":
-            return Place.objects.all()
-        return Place.objects.filter(owner=user)
+            return places
+        return places.filter(owner=user)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -83,17 +90,13 @@ class QueueAdminViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def toggle_open(queue):
-        queue.is_open = not queue.is_open
-        queue.save()
-        # notify active tickets
-        title = "تغییر وضعیت صف"
-        message = f"صف {queue.name} اکنون {'باز' if queue.is_open else 'بسته'} است."
-        for t in queue.tickets.filter(status="active"):
-            create_notification(t.user, title, message)
-            send_ws_notification(t.user.id, {"title": title, "message": message})
-            if t.user.email:
-                send_email_notification(title, message, [t.user.email])
-        send_queue_update(queue.place.id, {"type": "queue_status", "is_open": queue.is_open})
+        with transaction.atomic():
+            queue.is_open = not queue.is_open
+            queue.save()
+            # notify active tickets (delivered by dispatch_outbox)
+            title = "تغییر وضعیت صف"
+            message = f"صف {queue.name} اکنون {'باز' if queue.is_open else 'بسته'} است."
+            enqueue_queue_broadcast(queue, title, message, {"type": "queue_status", "is_open": queue.is_open})
         return queue
 
     def partial_update(self, request, *args, **kwargs):
@@ -114,89 +117,199 @@ class JoinQueueView(APIView):
         if Ticket.objects.filter(queue=queue, user=user, status="active").exists():
             return Response({"detail": "already active ticket"}, status=400)
 
-        last_num = Ticket.objects.filter(queue=queue).aggregate(Max("number"))["number__max"] or 0
-        ticket = Ticket.objects.create(queue=queue, user=user, number=last_num + 1)
-
-        title = "نوبت ثبت شد"
-        message = f"نوبت شما #{ticket.number}"
-        create_notification(user, title, message)
-        send_ws_notification(user.id, {"type": "ticket_created", "ticket": TicketSerializer(ticket).data})
-        if user.email:
-            send_email_notification(title, message, [user.email])
-        send_queue_update(queue.place.id, {"type": "ticket_created", "ticket": TicketSerializer(ticket).data})
-        return Response(TicketSerializer(ticket).data, status=201)
+        with transaction.atomic():
+            ticket = queue.issue_ticket(user)
+            data = TicketSerializer(ticket).data
+            enqueue_user_notification(
+                user, "نوبت ثبت شد", f"نوبت شما #{ticket.number}",
+                ws_data={"type": "ticket_created", "ticket": data},
+                place_id=queue.place_id, place_data={"type": "ticket_created", "ticket": data},
+            )
+        return Response(data, status=201)
 
 
 class LeaveQueueView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, ticket_id):
-        ticket = get_object_or_404(Ticket, id=ticket_id, user=request.user)
-        ticket.cancel(reason="user_left" if not ticket.cancel_reason else ticket.cancel_reason) if ticket.status != "canceled" else None
-        ticket.status = "canceled"
-        ticket.save()
-
-        title = "نوبت لغو شد"
-        message = f"نوبت #{ticket.number} لغو شد"
-        create_notification(request.user, title, message)
-        send_ws_notification(request.user.id, {"type": "ticket_left", "ticket_id": ticket.id})
-        if request.user.email:
-            send_email_notification(title, message, [request.user.email])
-        send_queue_update(ticket.queue.place.id, {"type": "ticket_left", "ticket_id": ticket.id})
+        ticket = get_object_or_404(Ticket.objects.select_related("queue"), id=ticket_id, user=request.user)
+        with transaction.atomic():
+            if ticket.status != TicketStatus.CANCELED:
+                ticket.cancel(reason=ticket.cancel_reason or "user_left")
+
+            enqueue_user_notification(
+                request.user, "نوبت لغو شد", f"نوبت #{ticket.number} لغو شد",
+                ws_data={"type": "ticket_left", "ticket_id": ticket.id},
+                place_id=ticket.queue.place_id, place_data={"type": "ticket_left", "ticket_id": ticket.id},
+            )
         return Response({"status": "left"})
 
 
-class AdminTicketsView(viewsets.ViewSet):
+def ticket_action_message(action, ticket):
+    """
+    (رویداد، عنوان، متن، ارسال ایمیل) برای اکشن مدیر روی تیکت؛ None برای اکشن نامعتبر.
+    """
+    if action == "call":
+        return "ticket_called", "فراخوانی نوبت", f"نوبت #{ticket.number} فراخوانی شد", True
+    if action == "requeue":
+        return "ticket_requeued", "بازگشت نوبت", f"نوبت #{ticket.number} بازگشت به صف", False
+    if action == "cancel":
+        return "ticket_canceled", "لغو نوبت", f"نوبت #{ticket.number} کنسل شد", True
+    if action == "complete":
+        return "ticket_completed", "پایان نوبت", f"نوبت #{ticket.number} انجام شد", False
+    return None
+
+
+def enqueue_ticket_event(ticket, data, event, title, msg, send_email):
+    enqueue_user_notification(
+        ticket.user, title, msg, ws_data={"type": event, "ticket": data}, email=send_email,
+        place_id=ticket.queue.place_id, place_data={"type": event, "ticket": data},
+    )
+
+
+class AdminTicketsView(ReplicaReadMixin, viewsets.ViewSet):
     permission_classes = [IsPlaceAdmin]
+    replica_actions = {"list"}
+    max_batch_size = 1000
 
     def list(self, request, queue_id=None):
+        """
+        ?status=active,used  ?page_size=  ?cursor=
+        """
         queue = get_object_or_404(Queue, id=queue_id, place__owner=request.user)
-        tickets = Ticket.objects.filter(queue=queue).order_by("number")
-        return Response(TicketSerializer(tickets, many=True).data)
+        tickets = Ticket.objects.filter(queue=queue).select_related("user").only(
+            "id", "queue_id", "user__username", "number", "status",
+            "cancel_reason", "created_at", "called_at", "completed_at", "counter",
+        )
+        statuses = [s for s in request.query_params.get("status", "").split(",") if s]
+        if statuses:
+            tickets = tickets.filter(status__in=statuses)
+
+        paginator = TicketPagination()
+        page = paginator.paginate_queryset(tickets, request, self)
+        return paginator.get_paginated_response(TicketSerializer(page, many=True).data)
 
     def partial_update(self, request, queue_id=None):
         # expects ticket_id and action
         ticket_id = request.data.get("ticket_id")
-        action = request.data.get("action")  # call/requeue/cancel
-        ticket = get_object_or_404(Ticket, id=ticket_id, queue__id=queue_id, queue__place__owner=request.user)
-
-        if action == "call":
-            ticket.call()
-            msg = f"نوبت #{ticket.number} فراخوانی شد"
-            create_notification(ticket.user, "فراخوانی نوبت", msg)
-            send_ws_notification(ticket.user.id, {"type": "ticket_called", "ticket": TicketSerializer(ticket).data})
-            if ticket.user.email:
-                send_email_notification("فراخوانی نوبت", msg, [ticket.user.email])
-            send_queue_update(ticket.queue.place.id, {"type": "ticket_called", "ticket": TicketSerializer(ticket).data})
-        elif action == "requeue":
-            ticket.requeue()
-            msg = f"نوبت #{ticket.number} بازگشت به صف"
-            create_notification(ticket.user, "بازگشت نوبت", msg)
-            send_ws_notification(ticket.user.id, {"type": "ticket_requeued", "ticket": TicketSerializer(ticket).data})
-            send_queue_update(ticket.queue.place.id, {"type": "ticket_requeued", "ticket": TicketSerializer(ticket).data})
-        elif action == "cancel":
-            reason = request.data.get("reason")
-            ticket.cancel(reason=reason)
-            msg = f"نوبت #{ticket.number} کنسل شد"
-            create_notification(ticket.user, "لغو نوبت", msg)
-            send_ws_notification(ticket.user.id, {"type": "ticket_canceled", "ticket": TicketSerializer(ticket).data})
-            if ticket.user.email:
-                send_email_notification("لغو نوبت", msg, [ticket.user.email])
-            send_queue_update(ticket.queue.place.id, {"type": "ticket_canceled", "ticket": TicketSerializer(ticket).data})
-        else:
+        action = request.data.get("action")  # call/requeue/cancel/complete
+        ticket = get_object_or_404(
+            Ticket.objects.select_related("user", "queue"),
+            id=ticket_id, queue__id=queue_id, queue__place__owner=request.user,
+        )
+
+        message = ticket_action_message(action, ticket)
+        if message is None:
             return Response({"detail": "invalid action"}, status=400)
 
-        # update queue statistics
-        ticket.queue.update_statistics()
-        return Response(TicketSerializer(ticket).data)
-
-
-class NotificationListView(APIView):
+        with transaction.atomic():
+            if action == "call":
+                ticket.call()
+            elif action == "requeue":
+                ticket.requeue()
+            elif action == "complete":
+                ticket.complete()
+            elif action == "cancel":
+                ticket.cancel(reason=request.data.get("reason"))
+            else:
+                return Response({"detail": "invalid action"}, status=400)
+            data = TicketSerializer(ticket).data
+            enqueue_ticket_event(ticket, data, *message)
+
+        # queue statistics are kept up to date by core.signals
+        return Response(data)
+
+    def call_next(self, request, queue_id=None):
+        """
+        فراخوانی نوبت بعدی صف در یک درخواست؛ body: {"counter": 1..place.max_concurrent_queues}
+        204 اگر کسی منتظر نباشد.
+        """
+        queue = get_object_or_404(Queue.objects.select_related("place"), id=queue_id, place__owner=request.user)
+        counter = request.data.get("counter")
+        if counter is not None:
+            limit = queue.place.max_concurrent_queues
+            try:
+                counter = int(counter)
+            except (TypeError, ValueError):
+                counter = 0
+            if not 1 <= counter <= limit:
+                return Response({"detail": f"counter must be between 1 and {limit}"}, status=400)
+
+        with transaction.atomic():
+            ticket = queue.call_next(counter=counter)
+            if ticket is None:
+                return Response(status=204)
+            data = TicketSerializer(ticket).data
+            enqueue_ticket_event(ticket, data, *ticket_action_message("call", ticket))
+        return Response(data)
+
+    def batch(self, request, queue_id=None):
+        """
+        یک اکشن روی چند تیکت در یک تراکنش؛ body: {"ticket_ids": [...], "action": ..., "reason": ...}
+        نتیجه‌ی هر تیکت: ok، skipped (اکشن برای وضعیت فعلی‌اش معنی ندارد) یا not_found.
+        """
+        queue = get_object_or_404(Queue, id=queue_id, place__owner=request.user)
+        action = request.data.get("action")
+        ticket_ids = request.data.get("ticket_ids")
+        if action not in Ticket.ACTIONS:
+            return Response({"detail": "invalid action"}, status=400)
+        try:
+            if not isinstance(ticket_ids, list):
+                raise TypeError
+            ticket_ids = list(dict.fromkeys(int(i) for i in ticket_ids))
+        except (TypeError, ValueError):
+            return Response({"detail": "ticket_ids must be a list of ids"}, status=400)
+        if not ticket_ids or len(ticket_ids) > self.max_batch_size:
+            return Response({"detail": f"ticket_ids must have 1 to {self.max_batch_size} ids"}, status=400)
+
+        with transaction.atomic():
+            tickets = {
+                t.id: t for t in Ticket.objects.select_for_update(of=("self",)).select_related("user")
+                .filter(queue=queue, id__in=ticket_ids).order_by("number")
+            }
+            applied = [t for t in tickets.values() if t.allows(action)]
+            Ticket.bulk_transition(queue, applied, **Ticket.transition_fields(action, request.data.get("reason")))
+
+            data = dict(zip(tickets, TicketSerializer(tickets.values(), many=True).data))
+            if applied:
+                event, _, _, send_email = ticket_action_message(action, applied[0])
+                messages = []
+                for ticket in applied:
+                    _, title, msg, _ = ticket_action_message(action, ticket)
+                    messages.append({
+                        "user_id": ticket.user_id, "title": title, "message": msg,
+                        "ws": {"type": event, "ticket": data[ticket.id]},
+                    })
+                enqueue_batch_notification(
+                    messages, email=send_email, place_id=queue.place_id,
+                    place_data={"type": "tickets_batch", "event": event,
+                                "tickets": [data[t.id] for t in applied]},
+                )
+
+        applied_ids = {t.id for t in applied}
+        results = [
+            {"id": i, "result": "ok" if i in applied_ids else "skipped" if i in tickets else "not_found",
+             "ticket": data.get(i)}
+            for i in ticket_ids
+        ]
+        return Response({"action": action, "updated": len(applied), "results": results})
+
+
+class NotificationListView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        qs = Notification.objects.filter(user=request.user).order_by("-created_at")
-        return Response(NotificationSerializer(qs, many=True).data)
+        """
+        ?is_read=true|false  ?page_size=  ?cursor=
+        """
+        qs = Notification.objects.filter(user=request.user)
+        is_read = request.query_params.get("is_read")
+        if is_read in ("true", "false"):
+            qs = qs.filter(is_read=is_read == "true")
+
+        paginator = NotificationPagination()
+        page = paginator.paginate_queryset(qs, request, self)
+        return paginator.get_paginated_response(NotificationSerializer(page, many=True).data)
 
 
 class MarkNotificationReadView(APIView):
@@ -209,7 +322,7 @@ class MarkNotificationReadView(APIView):
         return Response({"status": "read"})
 
 
-class AnalyticsView(APIView):
+class AnalyticsView(ReplicaReadMixin, APIView):
     permission_classes = [IsPlaceAdmin | IsSystemAdmin]
 
     def get(self, request, *args, **kwargs):
@@ -225,53 +338,55 @@ class AnalyticsView(APIView):
         end_date = request.query_params.get("end_date")
         interval = request.query_params.get("interval", "daily")
 
-        qs = Ticket.objects.all()
+        # از جدول rollup خوانده می‌شود؛ بدون بازه‌ی زمانی ردیف‌های روزانه و با بازه ردیف‌های ساعتی (دقت یک ساعت)
+        granularity = RollupGranularity.HOUR if start_date or end_date else RollupGranularity.DAY
+        buckets = Q(granularity=granularity)
 
         if place_id:
-            qs = qs.filter(queue__place_id=place_id)
+            buckets &= Q(place_id=place_id)
 
         if start_date:
-            qs = qs.filter(created_at__gte=start_date)
+            buckets &= Q(bucket_start__gte=start_date)
         if end_date:
-            qs = qs.filter(created_at__lte=end_date)
+            buckets &= Q(bucket_start__lte=end_date)
+
+        qs = TicketRollup.objects.filter(buckets)
 
         # آمار کلی
-        total_customers = qs.count()
-        used_tickets = qs.filter(status="used").count()
-        canceled_tickets = qs.filter(status="canceled").count()
-        active_tickets = qs.filter(status="active").count()
+        totals = qs.aggregate(
+            total=Sum("total_count"),
+            used=Sum("used_count"),
+            canceled=Sum("canceled_count"),
+            active=Sum("active_count"),
+            wait_count=Sum("wait_count"),
+            wait_total=Sum("wait_seconds_total"),
+        )
+        total_customers = totals["total"] or 0
+        used_tickets = totals["used"] or 0
+        canceled_tickets = totals["canceled"] or 0
+        active_tickets = totals["active"] or 0
 
         # محاسبه میانگین زمان انتظار
-        avg_wait_time = qs.filter(
-            called_at__isnull=False, created_at__isnull=False
-        ).annotate(
-            wait_time=ExpressionWrapper(F("called_at") - F("created_at"), output_field=DurationField())
-        ).aggregate(
-            avg_wait=Avg("wait_time")
-        )["avg_wait"]
+        avg_wait_seconds = totals["wait_total"] / totals["wait_count"] if totals["wait_count"] else 0
 
-        avg_wait_seconds = avg_wait_time.total_seconds() if avg_wait_time else 0
+        # چندک‌های زمان انتظار از ادغام اسکچ‌های صف‌ها و بازه‌ها
+        wait_percentiles = TicketWaitBin.sketch(TicketWaitBin.objects.filter(buckets)).quantiles()
 
         # گزارش روزانه/هفتگی
-        if interval == "daily":
-            group_format = "%Y-%m-%d"
-        else:
-            group_format = "%Y-%W"  # هفته سال
-
         from django.db.models.functions import TruncDate, TruncWeek
 
         if interval == "daily":
             grouped = (
-                qs.annotate(date=TruncDate("created_at"))
+                qs.annotate(date=TruncDate("bucket_start"))
                 .values("date")
-                .annotate(count=Count("id"))
+                .annotate(count=Sum("total_count"))
                 .order_by("date")
             )
         else:
             grouped = (
-                qs.annotate(week=TruncWeek("created_at"))
+                qs.annotate(week=TruncWeek("bucket_start"))
                 .values("week")
-                .annotate(count=Count("id"))
+                .annotate(count=Sum("total_count"))
                 .order_by("week")
             )
 
@@ -282,6 +397,7 @@ class AnalyticsView(APIView):
                 "canceled_tickets": canceled_tickets,
                 "active_tickets": active_tickets,
                 "avg_wait_time_seconds": avg_wait_seconds,
+                "wait_time_percentiles_seconds": wait_percentiles,
             },
             "timeline": list(grouped),
         }
@@ -289,61 +405,6 @@ class AnalyticsView(APIView):
         return Response(result)
 
 
-
-
-
-class TicketAdminViewSet(viewsets.ModelViewSet):
-    queryset = Ticket.objects.all()
-    serializer_class = TicketSerializer
-    permission_classes = [IsAuthenticated, IsPlaceAdmin | IsQueueOwnerAdmin]
-
-    def get_serializer_class(self):
-        if self.action == "create":
-            return TicketCreateSerializer
-        return TicketSerializer
-
-    def perform_create(self, serializer):
-        return serializer.save()
-
-    @action(detail=True, methods=["post"])
-    def call(self, request, pk=None):
-        ticket = self.get_object()
-        ticket.call()
-        send_queue_event(ticket.queue.place.id, "ticket_called", TicketSerializer(ticket).data)
-        send_user_notification(ticket.user.id, f"Your ticket {ticket.number} is called!")
-        return Response(TicketSerializer(ticket).data)
-
-    @action(detail=True, methods=["post"])
-    def requeue(self, request, pk=None):
-        ticket = self.get_object()
-        ticket.requeue()
-        send_queue_event(ticket.queue.place.id, "ticket_requeued", TicketSerializer(ticket).data)
-        send_user_notification(ticket.user.id, f"Your ticket {ticket.number} has been requeued.")
-        return Response(TicketSerializer(ticket).data)
-
-    @action(detail=True, methods=["post"])
-    def cancel(self, request, pk=None):
-        ticket = self.get_object()
-        reason = request.data.get("reason", "")
-        ticket.cancel(reason=reason)
-        send_queue_event(ticket.queue.place.id, "ticket_canceled", TicketSerializer(ticket).data)
-        send_user_notification(ticket.user.id, f"Your ticket {ticket.number} was canceled. Reason: {reason}")
-        return Response(TicketSerializer(ticket).data)
-
-    @action(detail=True, methods=["post"])
-    def complete(self, request, pk=None):
-        ticket = self.get_object()
-        ticket.status = TicketStatus.USED
-        ticket.completed_at = timezone.now()
-        ticket.save()
-        send_queue_event(ticket.queue.place.id, "ticket_completed", TicketSerializer(ticket).data)
-        send_user_notification(ticket.user.id, f"Your ticket {ticket.number} has been completed. Thank you!")
-        return Response(TicketSerializer(ticket).data)
-
-
-
-
-
 class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
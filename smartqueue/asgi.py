@@ -2,7 +2,6 @@ import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-from channels.auth import AuthMiddlewareStack
 
 # تنظیم متغیر محیطی قبل از هر چیز دیگر
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartqueue.settings')
@@ -11,12 +10,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartqueue.settings')
 django.setup()
 
 from core.routing import websocket_urlpatterns
+from core.middleware import JWTAuthMiddleware
 
 django_asgi_app = get_asgi_application()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": URLRouter(websocket_urlpatterns),
+    "websocket": JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
 
 
 
@@ -36,6 +36,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SQLProfilingMiddleware',
+    'core.middleware.TracingMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,9 +86,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # write lock is taken at BEGIN so concurrent joins queue up instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # file based test database so threaded tests share real locking
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# نسخه‌های فقط‌خواندنی برای view‌های سنگین خواندنی (core.db.ReplicaRouter)؛ aliasهای DATABASES.
+# برای آزمایش محلی با دو فایل SQLite: SMARTQUEUE_REPLICA_DB=/path/to/replica.sqlite3
+# (کپی db.sqlite3؛ در تست‌ها replica همان دیتابیس تست default است)
+if os.environ.get("SMARTQUEUE_REPLICA_DB"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ["SMARTQUEUE_REPLICA_DB"],
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["core.db.ReplicaRouter"]
+# بعد از نوشتن، خواندن‌های همان کاربر این مدت از default (باید از بیشترین تأخیر replication بیشتر باشد)
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -134,19 +161,75 @@ SIMPLE_JWT = {
 
 # Redis backend for Channels
 ASGI_APPLICATION = "smartqueue.asgi.application"
-"""CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+# لایه‌ی کانال و cache باید بین پروسه‌ها (وب، ASGI، dispatch_outbox) مشترک باشند: group_send،
+# seq فید مکان‌ها، نسخه‌ی کاربرهای وب‌سوکت و pin خواندن از replica. بدون REDIS_URL فقط اجرای
+# تک‌پروسه (توسعه و تست) ممکن است و dispatch_outbox اجرا نمی‌شود (core.checks)
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
         },
-    },
-}"""
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"  # Temporary for testing
     }
-}
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# پیام‌های place_{id} در این پنجره تجمیع و یک‌جا فرستاده می‌شوند (0 = ارسال فوری)
+QUEUE_BROADCAST_WINDOW_MS = 100
+# تعداد آخرین رویدادهای هر مکان که برای اتصال مجدد با ?since=<seq> نگه داشته می‌شوند
+QUEUE_REPLAY_BUFFER_SIZE = 500
+# فریم‌ها یک بار با msgpack هم (کنار JSON) سریال می‌شوند؛ کلاینت‌های ?format=msgpack آن را می‌گیرند
+WS_ENVELOPE_MSGPACK = False
+# صف ارسال group_send در پس‌زمینه (core.utils.ChannelDispatcher)؛ 0 = ارسال همگام
+WS_DISPATCH_QUEUE_SIZE = 10000
+WS_DISPATCH_BATCH_SIZE = 500
+WS_DISPATCH_OVERFLOW = "drop_oldest"  # یا drop_new، block
+WS_DISPATCH_BLOCK_TIMEOUT = 0.05  # ثانیه، فقط برای block
+# متریک‌های Prometheus در /api/metrics (core.metrics)؛ با METRICS_TOKEN فقط با هدر Authorization: Bearer <token>،
+# بدون آن فقط از METRICS_ALLOWED_IPS (IP یا شبکه)
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
+METRICS_ACTIVE_TICKETS_TTL = 30  # ثانیه؛ گیج smartqueue_place_active_tickets بین دو بار شمارش
+# پروفایل SQL هر درخواست (core.middleware.SQLProfilingMiddleware)
+SQL_PROFILE_ENABLED = True
+SQL_PROFILE_HEADERS = DEBUG  # X-Query-Count و X-DB-Time
+SQL_PROFILE_SAMPLE_RATE = 0.01  # سهم درخواست‌هایی که stack کوئری‌هایشان گرفته می‌شود
+SQL_PROFILE_SLOW_MS = 500  # درخواست نمونه‌برداری‌شده‌ی کندتر از این در لاگ نوشته می‌شود
+SQL_PROFILE_TOP_N = 5
+SQL_PROFILE_LOG_FILE = BASE_DIR / "logs" / "slow_requests.log"
+SQL_PROFILE_LOG_MAX_BYTES = 10 * 1024 * 1024
+SQL_PROFILE_LOG_BACKUPS = 5
+# ردیابی span‌ها از درخواست تا تحویل وب‌سوکت (core.tracing)؛ manage.py trace_report
+TRACE_ENABLED = False
+TRACE_SAMPLE_RATE = 1.0
+TRACE_FILE = BASE_DIR / "logs" / "traces.jsonl"
+# کش کاربرهای احراز هویت‌شده‌ی وب‌سوکت (core.middleware.JWTAuthMiddleware)
+WS_USER_CACHE_SIZE = 10000
+WS_USER_CACHE_TTL = 300  # ثانیه؛ باطل‌سازی بین پروسه‌ها با نسخه‌ی کاربر در cache مشترک
+# موقعیت و زمان تخمینی فراخوانی تیکت‌ها (core.eta)
+ETA_EWMA_ALPHA = 0.3
+ETA_MAX_SERVICE_INTERVAL = 3600  # فاصله‌ی بیشتر بین دو سرویس = صف بیکار، در EWMA شمرده نمی‌شود
+ETA_INDEX_TTL = 30  # ثانیه
+ETA_PUSH_THRESHOLD_SECONDS = 60
 
 
 MEDIA_URL = '/media/'
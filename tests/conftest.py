@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def log_files_in_tmp_path(settings, tmp_path):
+    # لاگ درخواست‌های کند و span‌ها نباید در پوشه‌ی logs مخزن نوشته شوند
+    settings.SQL_PROFILE_LOG_FILE = tmp_path / "slow_requests.log"
+    settings.TRACE_FILE = tmp_path / "traces.jsonl"
+
+
+@pytest.fixture(autouse=True)
+def reset_eta_engine():
+    # ایندکس ETA در حافظه‌ی پروسه است و نباید بین تست‌ها (با idهای تکراری) باقی بماند
+    from core.eta import eta_engine
+    eta_engine.reset()
+    yield
+    eta_engine.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_pending_queue_flushes():
+    # تراکنش تست‌ها commit نمی‌شود، پس صف‌های در انتظار flush نباید به تست بعدی برسند
+    from core.signals import pending_queues
+    pending_queues().clear()
+    yield
+    pending_queues().clear()
+
+
+@pytest.fixture(autouse=True)
+def flush_channel_dispatcher(log_files_in_tmp_path):
+    # پیام‌های وب‌سوکت در پس‌زمینه فرستاده می‌شوند؛ نباید به گروه‌های تست بعدی برسند
+    # (place_broadcaster.flush پنجره‌ی تجمیع را خالی می‌کند و بعد channel_dispatcher را).
+    # پیش از برگرداندن TRACE_FILE اجرا می‌شود تا span‌های این ارسال‌ها هم در tmp_path بمانند
+    from core.utils import place_broadcaster
+    yield
+    place_broadcaster.flush()
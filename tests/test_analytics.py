@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 import pytest
 from django.utils import timezone
 from rest_framework.test import APIClient
@@ -35,3 +37,138 @@ def test_analytics_view():
     assert "summary" in data
     assert data["summary"]["total_customers"] == 2
     assert "timeline" in data
+
+
+def rollup_snapshot():
+    from core.models import TicketRollup, TicketWaitBin
+    rollups = sorted(
+        (r.queue_id, r.granularity, r.bucket_start, *(round(getattr(r, f), 6) for f in TicketRollup.COUNTERS))
+        for r in TicketRollup.objects.all()
+        if r.total_count
+    )
+    bins = sorted(
+        TicketWaitBin.objects.filter(count__gt=0).values_list("queue_id", "granularity", "bucket_start", "bin", "count")
+    )
+    return rollups, bins
+
+
+@pytest.mark.django_db
+def test_incremental_rollups_match_rebuild():
+    from core.models import TicketRollup
+
+    admin = User.objects.create_user(username="admin", password="pass123", role="super_admin")
+    place = Place.objects.create(owner=admin, name="Test", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place, name="Main")
+
+    tickets = [queue.issue_ticket(admin) for _ in range(4)]
+    tickets[0].status = TicketStatus.USED
+    tickets[0].called_at = timezone.now()
+    tickets[0].save()
+    tickets[1].status = TicketStatus.CANCELED
+    tickets[1].save()
+    tickets[2].delete()
+    # فیلدهای deferred: مسیر بازسازی
+    deferred = Ticket.objects.only("id", "queue_id").get(pk=tickets[3].pk)
+    deferred.status = TicketStatus.USED
+    deferred.save()
+
+    incremental = rollup_snapshot()
+    TicketRollup.rebuild()
+    assert incremental == rollup_snapshot()
+
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    summary = client.get(f"/api/analytics/?place_id={place.id}").json()["summary"]
+    assert summary["total_customers"] == 3
+    assert summary["used_tickets"] == 2
+    assert summary["canceled_tickets"] == 1
+    assert summary["active_tickets"] == 0
+
+
+@pytest.mark.django_db
+def test_backfill_rollups_command():
+    from io import StringIO
+    from django.core.management import call_command
+
+    admin = User.objects.create_user(username="admin", password="pass123", role="super_admin")
+    place = Place.objects.create(owner=admin, name="Test", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place, name="Main")
+    # bulk_create سیگنال‌ها را اجرا نمی‌کند
+    Ticket.objects.bulk_create([
+        Ticket(queue=queue, user=admin, number=i + 1, status=TicketStatus.USED if i % 2 else TicketStatus.ACTIVE)
+        for i in range(6)
+    ])
+
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    assert client.get(f"/api/analytics/?place_id={place.id}").json()["summary"]["total_customers"] == 0
+
+    call_command("backfill_rollups", "--queue", str(queue.id), stdout=StringIO())
+    data = client.get(f"/api/analytics/?place_id={place.id}").json()
+    assert data["summary"]["total_customers"] == 6
+    assert data["summary"]["used_tickets"] == 3
+    assert sum(row["count"] for row in data["timeline"]) == 6
+
+
+def test_wait_sketch_accuracy():
+    import numpy as np
+    from core.sketch import RELATIVE_ACCURACY, WaitSketch
+
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(mean=5, sigma=1.2, size=20000)
+    # دو اسکچ جدا که ادغام می‌شوند
+    sketch = WaitSketch.from_values(values[:7000]).merge(WaitSketch.from_values(values[7000:]))
+    assert sketch.count == len(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = np.quantile(values, q, method="lower")
+        assert abs(sketch.quantile(q) - exact) <= RELATIVE_ACCURACY * exact * 1.001
+    assert WaitSketch.from_values([0, 0, 30]).quantile(0.5) == 0.0
+    assert WaitSketch().quantile(0.5) is None
+
+
+@pytest.mark.django_db
+def test_analytics_wait_percentiles():
+    admin = User.objects.create_user(username="admin", password="pass123", role="super_admin")
+    place = Place.objects.create(owner=admin, name="Test", latitude=0, longitude=0)
+    queues = [Queue.objects.create(place=place, name=f"q{i}") for i in range(2)]
+
+    waits = list(range(10, 1010, 10))
+    for i, wait in enumerate(waits):
+        ticket = queues[i % 2].issue_ticket(admin)
+        ticket.called_at = ticket.created_at + timezone.timedelta(seconds=wait)
+        ticket.save()
+
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    percentiles = client.get(f"/api/analytics/?place_id={place.id}").json()["summary"]["wait_time_percentiles_seconds"]
+    assert percentiles["p50"] == pytest.approx(500, rel=0.01)
+    assert percentiles["p90"] == pytest.approx(900, rel=0.01)
+    assert percentiles["p99"] == pytest.approx(990, rel=0.01)
+
+
+@pytest.mark.django_db
+def test_bulk_transitions_match_rebuild():
+    from core.models import TicketRollup
+
+    admin = User.objects.create_user(username="admin", password="pass123", role="super_admin")
+    place = Place.objects.create(owner=admin, name="Test", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place, name="Main")
+    tickets = [queue.issue_ticket(admin) for _ in range(12)]
+    # تیکت‌ها در چند ساعت و دو روز مختلف
+    for i, ticket in enumerate(tickets):
+        Ticket.objects.filter(pk=ticket.pk).update(created_at=timezone.now() - timedelta(hours=7 * i, minutes=i))
+    TicketRollup.rebuild()
+    queue.update_statistics()
+
+    def load(n):
+        return list(Ticket.objects.filter(queue=queue).order_by("number")[:n])
+
+    for action, n in (("call", 9), ("complete", 6), ("requeue", 2), ("cancel", 12)):
+        Ticket.bulk_transition(queue, [t for t in load(n) if t.allows(action)], **Ticket.transition_fields(action))
+        incremental = rollup_snapshot()
+        queue.refresh_from_db()
+        stats = (queue.processed_count, queue.wait_samples, round(queue.wait_seconds_total, 6))
+        TicketRollup.rebuild()
+        queue.update_statistics()
+        assert incremental == rollup_snapshot(), action
+        assert stats == (queue.processed_count, queue.wait_samples, round(queue.wait_seconds_total, 6)), action
@@ -39,3 +39,364 @@ def test_join_leave_flow(client, customer, queue):
     leave_url = reverse("leave-queue", kwargs={"ticket_id": ticket_id})
     r2 = client.post(leave_url)
     assert r2.status_code == 200
+
+def test_nearby_places_sorted_and_limited(client, place_admin, place):
+    far = Place.objects.create(owner=place_admin, name="Far", latitude=36.5, longitude=51.4)
+    near = Place.objects.create(owner=place_admin, name="Near", latitude=35.71, longitude=51.41)
+    url = reverse("places-nearby")
+
+    r = client.get(url, {"lat": 35.705, "lon": 51.405, "radius": 5})
+    assert r.status_code == 200
+    names = [p["name"] for p in r.json()]
+    assert names == ["Near", "Shop"]
+    assert far.name not in names
+    assert r.json()[0]["distance_km"] <= r.json()[1]["distance_km"]
+
+    r = client.get(url, {"lat": 35.705, "lon": 51.405, "radius": 200, "limit": 1})
+    assert [p["name"] for p in r.json()] == [near.name]
+
+@pytest.mark.parametrize("params", [
+    {"lat": "nan", "lon": 51.4}, {"lat": 35.7, "lon": "inf"}, {"lat": "-inf", "lon": 51.4},
+    {"lat": 91, "lon": 51.4}, {"lat": 35.7, "lon": -181}, {"lat": 35.7, "lon": 51.4, "radius": "nan"},
+    {"lat": 35.7, "lon": 51.4, "radius": 0}, {"lat": 35.7, "lon": 51.4, "radius": -3},
+])
+def test_nearby_places_rejects_invalid_input(client, params):
+    assert client.get(reverse("places-nearby"), params).status_code == 400
+
+def test_join_writes_outbox_and_dispatcher_delivers(client, queue, mailoutbox):
+    from core.models import Notification, OutboxEvent, OutboxStatus
+    from core.outbox import dispatch_pending
+
+    customer = User.objects.create_user(username="mail", password="p", email="mail@example.com")
+    client.force_authenticate(customer)
+    r = client.post(reverse("join-queue", kwargs={"place_id": queue.place.id}))
+    assert r.status_code == 201
+    assert not Notification.objects.exists()
+    assert len(mailoutbox) == 0
+    event = OutboxEvent.objects.get()
+    assert event.status == OutboxStatus.PENDING
+
+    assert dispatch_pending() == 1
+    event.refresh_from_db()
+    assert event.status == OutboxStatus.SENT
+    assert event.payload["done"] == ["notification", "ws", "email", "place"]
+    assert Notification.objects.filter(user=customer).count() == 1
+    assert mailoutbox[0].to == ["mail@example.com"]
+
+
+def test_outbox_retries_failed_delivery(queue, customer, monkeypatch):
+    from core import outbox
+    from core.models import Notification, OutboxEvent, OutboxStatus
+    from core.utils import enqueue_user_notification
+
+    enqueue_user_notification(customer, "t", "m", ws_data={"type": "x"})
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("channel layer down")
+    monkeypatch.setattr(outbox, "send_ws_notification", broken)
+
+    assert outbox.dispatch_pending() == 1
+    event = OutboxEvent.objects.get()
+    assert event.status == OutboxStatus.PENDING
+    assert event.attempts == 1
+    assert event.payload["done"] == ["notification"]
+    assert outbox.dispatch_pending() == 0  # backoff
+
+    monkeypatch.undo()
+    OutboxEvent.objects.update(available_at=event.created_at)
+    assert outbox.dispatch_pending() == 1
+    event.refresh_from_db()
+    assert event.status == OutboxStatus.SENT
+    assert Notification.objects.count() == 1
+
+def test_outbox_delivers_outside_claim_transaction(queue, customer, monkeypatch):
+    from django.db import connection
+    from core import outbox
+    from core.models import OutboxEvent, OutboxStatus
+    from core.utils import enqueue_user_notification
+
+    enqueue_user_notification(customer, "t", "m", ws_data={"type": "x"})
+    enqueue_user_notification(customer, "t2", "m2", ws_data={"type": "y"})
+    depth = len(connection.atomic_blocks)  # تراکنش خود تست
+    seen = []
+
+    def send(user_id, data, wait=False):
+        # ارسال بیرونی داخل هیچ تراکنشی نیست؛ رویداد اول دوباره برداشته نمی‌شود
+        seen.append((data["type"], len(connection.atomic_blocks) - depth, outbox.claim(10)))
+        if data["type"] == "x":
+            raise ConnectionError("down")
+    monkeypatch.setattr(outbox, "send_ws_notification", send)
+
+    assert outbox.dispatch_pending() == 2
+    assert seen == [("x", 0, []), ("y", 0, [])]
+    first, second = OutboxEvent.objects.order_by("id")
+    assert (first.status, first.attempts) == (OutboxStatus.PENDING, 1)
+    assert second.status == OutboxStatus.SENT
+
+
+def test_outbox_retries_when_channel_layer_rejects(queue, customer, monkeypatch):
+    from core import outbox
+    from core.models import OutboxEvent, OutboxStatus
+    from core.utils import enqueue_user_notification
+
+    class BrokenLayer:
+        async def group_send(self, group, message):
+            raise ConnectionError("redis down")
+
+    enqueue_user_notification(customer, "t", "m", ws_data={"type": "x"},
+                              place_id=queue.place_id, place_data={"type": "y"})
+    monkeypatch.setattr("core.utils.get_channel_layer", lambda: BrokenLayer())
+    assert outbox.dispatch_pending() == 1
+    event = OutboxEvent.objects.get()
+    # dispatcher پس‌زمینه خطا را نمی‌خورد: رویداد برای تلاش مجدد می‌ماند
+    assert (event.status, event.attempts) == (OutboxStatus.PENDING, 1)
+    assert "ws" not in event.payload["done"] and "redis down" in event.last_error
+
+def test_outbox_email_retry_skips_sent_recipients(queue, mailoutbox, monkeypatch):
+    from django.core.mail.backends.locmem import EmailBackend
+    from core import outbox
+    from core.models import OutboxEvent, OutboxStatus
+    from core.utils import enqueue_queue_broadcast
+
+    users = [User.objects.create(username=f"e{i}", email=f"e{i}@example.com") for i in range(3)]
+    for user in users:
+        queue.issue_ticket(user)
+    enqueue_queue_broadcast(queue, "t", "m")
+
+    send_messages = EmailBackend.send_messages
+    def flaky(self, messages):
+        if len(mailoutbox) == 1:
+            raise ConnectionError("smtp reset")
+        return send_messages(self, messages)
+    monkeypatch.setattr(EmailBackend, "send_messages", flaky)
+    assert outbox.dispatch_pending() == 1
+    event = OutboxEvent.objects.get()
+    assert (event.status, event.payload["emailed"]) == (OutboxStatus.PENDING, [users[0].id])
+
+    monkeypatch.undo()
+    OutboxEvent.objects.update(available_at=event.created_at)
+    assert outbox.dispatch_pending() == 1
+    event.refresh_from_db()
+    assert event.status == OutboxStatus.SENT and "emailed" not in event.payload
+    # هر گیرنده دقیقاً یک ایمیل
+    assert sorted(m.to[0] for m in mailoutbox) == [u.email for u in users]
+
+def test_toggle_open_bulk_fan_out(queue, mailoutbox, django_assert_max_num_queries):
+    from core.models import Notification
+    from core.outbox import dispatch_pending
+    from core.views import QueueAdminViewSet
+
+    for i in range(30):
+        user = User.objects.create(username=f"c{i}", email=f"c{i}@example.com" if i % 2 else "")
+        queue.issue_ticket(user)
+
+    QueueAdminViewSet.toggle_open(queue)
+    # claim و مرحله‌ی اعلان هر کدام یک تراکنش جدا (در تست SAVEPOINT/RELEASE هم شمرده می‌شوند)
+    with django_assert_max_num_queries(11):
+        assert dispatch_pending() == 1
+    assert Notification.objects.count() == 30
+    assert len(mailoutbox) == 15
+
+def test_admin_tickets_keyset_pagination(client, place_admin, queue):
+    users = [User.objects.create(username=f"c{i}") for i in range(5)]
+    tickets = [queue.issue_ticket(u) for u in users]
+    tickets[1].cancel("no show")
+    client.force_authenticate(place_admin)
+
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+    numbers, next_url = [], f"{url}?page_size=2&status=active"
+    while next_url:
+        r = client.get(next_url)
+        assert r.status_code == 200
+        assert len(r.json()["results"]) <= 2
+        numbers += [t["number"] for t in r.json()["results"]]
+        next_url = r.json()["next"]
+    assert numbers == [1, 3, 4, 5]
+
+    assert client.get(url, {"cursor": "not-a-cursor"}).status_code == 404
+
+
+def test_admin_ticket_complete_and_invalid_action(client, place_admin, customer, queue):
+    ticket = queue.issue_ticket(customer)
+    client.force_authenticate(place_admin)
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+
+    r = client.patch(url, {"ticket_id": ticket.id, "action": "complete"}, format="json")
+    assert r.status_code == 200
+    assert r.json()["status"] == "used" and r.json()["completed_at"]
+
+    r = client.patch(url, {"ticket_id": ticket.id, "action": "explode"}, format="json")
+    assert r.status_code == 400
+    ticket.refresh_from_db()
+    assert ticket.status == "used"
+
+
+def test_notifications_keyset_pagination_with_equal_timestamps(client, customer):
+    from django.utils import timezone
+    from core.models import Notification
+
+    now = timezone.now()
+    Notification.objects.bulk_create(
+        [Notification(user=customer, title=f"n{i}", message="m", created_at=now, is_read=i == 0) for i in range(5)]
+    )
+    client.force_authenticate(customer)
+
+    titles, next_url = [], reverse("notifications") + "?page_size=2"
+    while next_url:
+        r = client.get(next_url)
+        titles += [n["title"] for n in r.json()["results"]]
+        next_url = r.json()["next"]
+    assert titles == ["n4", "n3", "n2", "n1", "n0"]
+
+    r = client.get(reverse("notifications"), {"is_read": "false"})
+    assert [n["title"] for n in r.json()["results"]] == ["n4", "n3", "n2", "n1"]
+
+def test_call_next_claims_lowest_waiting_ticket(client, place_admin, queue):
+    users = User.objects.bulk_create([User(username=f"w{i}") for i in range(3)])
+    Ticket.objects.bulk_create([Ticket(queue=queue, user=u, number=i + 1) for i, u in enumerate(users)])
+    Ticket.objects.filter(queue=queue, number=1).update(called_at="2025-01-01T10:00:00Z")
+    Place.objects.filter(pk=queue.place_id).update(max_concurrent_queues=2)
+    client.force_authenticate(place_admin)
+    url = reverse("admin-call-next", kwargs={"queue_id": queue.id})
+
+    assert client.post(url, {"counter": 3}).status_code == 400
+    r = client.post(url, {"counter": 2})
+    assert r.status_code == 200
+    assert (r.json()["number"], r.json()["counter"]) == (2, 2)
+    assert client.post(url).json()["number"] == 3
+    assert client.post(url).status_code == 204
+
+    other = User.objects.create_user(username="other", password="p", role="place_admin")
+    client.force_authenticate(other)
+    assert client.post(url).status_code == 404
+
+def test_batch_cancel_updates_stats_and_notifies_once(client, place_admin, queue, mailoutbox):
+    from core.models import Notification, OutboxEvent, TicketStatus
+    from core.outbox import dispatch_pending
+
+    users = User.objects.bulk_create([User(username=f"b{i}", email=f"b{i}@example.com") for i in range(5)])
+    tickets = [queue.issue_ticket(u) for u in users]
+    tickets[0].call()
+    tickets[0].complete()
+    OutboxEvent.objects.all().delete()
+    client.force_authenticate(place_admin)
+    url = reverse("admin-tickets-batch", kwargs={"queue_id": queue.id})
+
+    assert client.post(url, {"ticket_ids": [tickets[1].id], "action": "explode"}, format="json").status_code == 400
+    r = client.post(url, {"ticket_ids": [t.id for t in tickets] + [999999], "action": "cancel", "reason": "eod"},
+                    format="json")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["updated"] == 4
+    assert [row["result"] for row in body["results"]] == ["skipped", "ok", "ok", "ok", "ok", "not_found"]
+    assert body["results"][1]["ticket"]["status"] == TicketStatus.CANCELED
+    assert Ticket.objects.filter(queue=queue, status=TicketStatus.CANCELED, cancel_reason="eod").count() == 4
+
+    queue.refresh_from_db()
+    assert (queue.processed_count, queue.total_tickets) == (1, 5)
+
+    assert OutboxEvent.objects.count() == 1
+    dispatch_pending()
+    assert Notification.objects.filter(title="لغو نوبت").count() == 4
+    assert len(mailoutbox) == 4
+
+def test_metrics_endpoint(client, customer, queue, settings, monkeypatch):
+    from core.metrics import db_queries_per_request, http_request_seconds
+
+    monkeypatch.setattr("core.metrics._active_tickets_expires", 0.0)
+    before = (http_request_seconds.get(view="places-nearby", method="GET", status=200) or {"count": 0})["count"]
+    client.get(reverse("places-nearby"), {"lat": 35.7, "lon": 51.4, "radius": 5})
+    client.force_authenticate(customer)
+    client.post(reverse("join-queue", kwargs={"place_id": queue.place.id}))
+
+    assert http_request_seconds.get(view="places-nearby", method="GET", status=200)["count"] == before + 1
+    assert db_queries_per_request.get(view="join-queue")["sum"] > 0
+
+    r = client.get("/api/metrics")
+    assert r.status_code == 200
+    assert r["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = r.content.decode()
+    assert 'smartqueue_http_request_duration_seconds_count{view="places-nearby",method="GET",status="200"}' in text
+    assert f'smartqueue_place_active_tickets{{place_id="{queue.place_id}"}} 1\n' in text
+    assert "smartqueue_channel_dispatch_queue_depth " in text
+    for name in ("smartqueue_channel_dispatch_dropped_total", "smartqueue_channel_dispatch_batch_size",
+                 "smartqueue_broadcast_flush_seconds", "smartqueue_broadcast_batch_size"):
+        assert f"# TYPE {name} " in text
+    assert "smartqueue_metrics_collector_errors 0\n" in text
+
+    # بدون توکن فقط از آدرس‌های داخلی
+    assert client.get("/api/metrics", REMOTE_ADDR="203.0.113.7").status_code == 403
+    settings.METRICS_ALLOWED_IPS = ("10.0.0.0/8",)
+    assert client.get("/api/metrics", REMOTE_ADDR="10.1.2.3").status_code == 200
+    assert client.get("/api/metrics").status_code == 403
+
+    settings.METRICS_TOKEN = "s3cret"
+    assert client.get("/api/metrics", REMOTE_ADDR="10.1.2.3").status_code == 403
+    assert client.get("/api/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code == 200
+
+def test_metrics_active_tickets_are_cached(client, customer, queue, monkeypatch, django_assert_num_queries):
+    from core.metrics import collect_active_tickets, place_active_tickets
+
+    monkeypatch.setattr("core.metrics._active_tickets_expires", 0.0)
+    queue.issue_ticket(customer)
+    with django_assert_num_queries(2):
+        collect_active_tickets()
+    queue.issue_ticket(User.objects.create(username="other"))
+    # تا پایان METRICS_ACTIVE_TICKETS_TTL بدون کوئری، با همان مقدار قبلی
+    with django_assert_num_queries(0):
+        text = client.get("/api/metrics").content.decode()
+    assert place_active_tickets.get(place_id=queue.place_id) == 1
+    assert f'smartqueue_place_active_tickets{{place_id="{queue.place_id}"}} 1\n' in text
+
+def test_sql_profiling_headers_and_slow_log(client, customer, queue, settings, tmp_path):
+    import json
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    settings.SQL_PROFILE_HEADERS = True
+    settings.SQL_PROFILE_SAMPLE_RATE = 1
+    settings.SQL_PROFILE_SLOW_MS = 0
+    settings.SQL_PROFILE_LOG_FILE = tmp_path / "slow.log"
+    client.force_authenticate(customer)
+
+    with CaptureQueriesContext(connection) as ctx:
+        r = client.post(reverse("join-queue", kwargs={"place_id": queue.place.id}))
+    assert r.status_code == 201
+    assert int(r["X-Query-Count"]) == len(ctx)
+    assert float(r["X-DB-Time"]) > 0
+
+    record = json.loads((tmp_path / "slow.log").read_text().splitlines()[-1])
+    assert record["view"] == "join-queue" and record["status"] == 201
+    assert record["queries"] == len(ctx)
+    assert 0 < len(record["slowest"]) <= settings.SQL_PROFILE_TOP_N
+    assert any(frame.startswith("core/views.py:") for q in record["slowest"] for frame in q["stack"])
+
+    settings.SQL_PROFILE_SAMPLE_RATE = 0
+    client.get(reverse("places-nearby"), {"lat": 35.7, "lon": 51.4})
+    assert len((tmp_path / "slow.log").read_text().splitlines()) == 1
+
+def test_dispatch_outbox_refuses_process_local_channel_layer(queue, customer, settings):
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+    from core.checks import check_shared_backends
+    from core.models import OutboxEvent, OutboxStatus
+    from core.utils import enqueue_user_notification
+
+    enqueue_user_notification(customer, "t", "m", ws_data={"type": "x"})
+    with pytest.raises(CommandError, match="InMemoryChannelLayer"):
+        call_command("dispatch_outbox", "--once")
+    assert OutboxEvent.objects.get().status == OutboxStatus.PENDING
+    settings.DEBUG = False
+    assert [e.id for e in check_shared_backends(None)] == ["core.E001"]
+    settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer"}}
+    assert "CHANNEL_LAYERS" not in check_shared_backends(None)[0].msg
+
+def test_shared_backends_check_requires_shared_cache(settings):
+    from core.checks import check_shared_backends, process_local_backends
+
+    settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels_redis.core.RedisChannelLayer"}}
+    # seq فید و باطل‌سازی کاربرهای وب‌سوکت با LocMemCache بین پروسه‌ها مشترک نیستند
+    assert process_local_backends() == ["CACHES (LocMemCache)"]
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                                   "LOCATION": "redis://127.0.0.1:6379"}}
+    assert check_shared_backends(None) == []
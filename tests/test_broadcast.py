@@ -0,0 +1,256 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from core.utils import ChannelDispatcher, PlaceBroadcaster, channel_dispatcher
+
+
+def _subscribe(group):
+    layer = get_channel_layer()
+    channel = async_to_sync(layer.new_channel)()
+    async_to_sync(layer.group_add)(group, channel)
+    return layer, channel
+
+
+def _frame(message):
+    frame = json.loads(message["text"])
+    assert frame.pop("v") == 1
+    return frame
+
+
+def _without_seq(event):
+    return {k: v for k, v in event.items() if k != "seq"}
+
+
+def test_broadcaster_coalesces_stats_into_one_frame():
+    from core.metrics import broadcast_batch_size, broadcast_flush_seconds
+
+    layer, channel = _subscribe("place_901")
+    broadcaster = PlaceBroadcaster(window_ms=10_000)
+    frames_before = (broadcast_flush_seconds.get() or {"count": 0})["count"]
+    sizes_before = (broadcast_batch_size.get() or {"sum": 0})["sum"]
+
+    broadcaster.publish(901, {"type": "queue_update", "queue_id": 1, "stats": {"total_tickets": 1}})
+    broadcaster.publish(901, {"type": "ticket_called", "ticket": {"id": 5}})
+    broadcaster.publish(901, {"type": "queue_update", "queue_id": 1, "stats": {"total_tickets": 2}})
+    broadcaster.publish(901, {"type": "queue_update", "queue_id": 2, "stats": {"total_tickets": 7}})
+    broadcaster.flush()
+
+    message = async_to_sync(layer.receive)(channel)
+    frame = _frame(message)
+    events = frame["events"]
+    seqs = [e["seq"] for e in events]
+    assert seqs == sorted(seqs) and seqs[0] >= 2  # seq اولین آمار جایگزین‌شده رد می‌شود
+    assert frame["type"] == "batch"
+    assert message["seq"] == seqs[-1]
+    assert [_without_seq(e) for e in events] == [
+        {"type": "ticket_called", "ticket": {"id": 5}},
+        {"type": "queue_update", "queue_id": 1, "stats": {"total_tickets": 2}},
+        {"type": "queue_update", "queue_id": 2, "stats": {"total_tickets": 7}},
+    ]
+    stats = broadcaster.stats()
+    assert stats["frames"] == 1
+    assert stats["merged"] == 1
+    assert stats["last_batch_size"] == 3
+    assert broadcast_flush_seconds.get()["count"] == frames_before + 1
+    assert broadcast_batch_size.get()["sum"] == sizes_before + 3
+
+
+def test_broadcaster_flushes_after_window():
+    layer, channel = _subscribe("place_902")
+    broadcaster = PlaceBroadcaster(window_ms=20)
+
+    broadcaster.publish(902, {"type": "queue_status", "is_open": False})
+    deadline = time.monotonic() + 5
+    while broadcaster.stats()["frames"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    channel_dispatcher.flush()
+    message = async_to_sync(layer.receive)(channel)
+    assert _without_seq(_frame(message)) == {"type": "queue_status", "is_open": False}
+    assert broadcaster.stats()["last_flush_latency_ms"] >= 20
+
+
+def test_feed_seq_is_shared_across_processes():
+    from django.core.cache import cache
+    from core.feed import PlaceFeed
+
+    web, outbox = PlaceFeed(), PlaceFeed()  # دو پروسه با cache مشترک
+    first = web.stamp(903, {"type": "a"})["seq"]
+    second = outbox.stamp(903, {"type": "b"})["seq"]
+    third = web.stamp(903, {"type": "c"})["seq"]
+    assert first < second < third == web.current(903)
+
+    # رویداد پروسه‌ی دیگر در بافر این پروسه نیست: snapshot به‌جای replay ناقص
+    assert web.since(903, first) is None
+    assert [e["type"] for e in web.since(903, second)] == ["c"]
+
+    # شمارنده‌ی evict‌شده به عقب برنمی‌گردد
+    cache.delete(PlaceFeed.key(903))
+    assert web.stamp(903, {"type": "d"})["seq"] > third
+
+
+def test_envelope_is_encoded_once_with_optional_msgpack(settings):
+    from unittest import mock
+    import msgpack
+    from core.utils import encode_envelope
+
+    data = {"type": "ticket_called", "title": "سلام"}
+    message = encode_envelope("send_notification", data)
+    assert message["type"] == "send_notification" and "bytes" not in message
+    assert json.loads(message["text"]) == {"v": 1, **data}
+
+    settings.WS_ENVELOPE_MSGPACK = True
+    with mock.patch("core.utils.json.dumps", wraps=json.dumps) as dumps, \
+            mock.patch("core.utils.msgpack.packb", wraps=msgpack.packb) as packb:
+        message = encode_envelope("send_notification", data)
+    # هر قالب یک بار؛ مصرف‌کننده‌ها دیگر سریال نمی‌کنند
+    assert (dumps.call_count, packb.call_count) == (1, 1)
+    assert json.loads(message["text"]) == msgpack.unpackb(message["bytes"]) == {"v": 1, **data}
+
+
+@pytest.mark.django_db
+def test_one_stats_update_and_broadcast_per_action(monkeypatch, django_capture_on_commit_callbacks):
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+    from core.eta import eta_engine
+    from core.models import Place, Queue, Ticket, User
+
+    admin = User.objects.create(username="admin", role="place_admin")
+    customer = User.objects.create(username="customer")
+    place = Place.objects.create(owner=admin, name="Shop", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place, name="Main")
+    tickets = [queue.issue_ticket(u) for u in [customer, *User.objects.bulk_create(
+        [User(username=f"w{i}") for i in range(3)])]]
+
+    recomputes, broadcasts, pushes = [], [], []
+    apply_stats_delta = Queue.apply_stats_delta
+
+    def counting_stats_delta(queue_id, **kwargs):
+        recomputes.append(queue_id)
+        return apply_stats_delta(queue_id, **kwargs)
+
+    monkeypatch.setattr(Queue, "apply_stats_delta", counting_stats_delta)
+    monkeypatch.setattr("core.signals.broadcast_queue_stats", lambda q: broadcasts.append(q.id))
+    monkeypatch.setattr(eta_engine, "push_updates", pushes.append)
+
+    def action(fn):
+        for calls in (recomputes, broadcasts, pushes):
+            calls.clear()
+        with django_capture_on_commit_callbacks(execute=True):
+            response = fn()
+        assert response.status_code == 200, response.content
+        return len(recomputes), len(broadcasts), len(pushes)
+
+    client = APIClient()
+    client.force_authenticate(customer)
+    assert action(lambda: client.post(reverse("leave-queue", kwargs={"ticket_id": tickets[0].id}))) == (1, 1, 1)
+
+    client.force_authenticate(admin)
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+    assert action(lambda: client.patch(url, {"ticket_id": tickets[1].id, "action": "call"})) == (1, 1, 1)
+    batch_url = reverse("admin-tickets-batch", kwargs={"queue_id": queue.id})
+    assert action(lambda: client.post(
+        batch_url, {"ticket_ids": [t.id for t in tickets], "action": "complete"}, format="json")) == (1, 1, 1)
+
+    # ذخیره‌هایی که فیلدهای آماری را تغییر نمی‌دهند کاری انجام نمی‌دهند
+    ticket = Ticket.objects.get(pk=tickets[2].pk)
+    recomputes.clear()
+    broadcasts.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        ticket.save()
+        ticket.cancel_reason = "note"
+        ticket.save(update_fields=["cancel_reason"])
+    assert (recomputes, broadcasts) == ([], [])
+
+
+class _SlowLayer:
+    """لایه‌ی کانالی که هر group_send را تا آزاد شدن gate (یا delay) نگه می‌دارد."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.gate = threading.Event()
+        self.gate.set()
+        self.sent = []
+
+    async def group_send(self, group, message):
+        await asyncio.sleep(self.delay)
+        while not self.gate.is_set():
+            await asyncio.sleep(0.005)
+        self.sent.append(message["n"])
+
+
+def test_dispatcher_does_not_wait_for_channel_layer(monkeypatch):
+    layer = _SlowLayer(delay=0.2)
+    monkeypatch.setattr("core.utils.get_channel_layer", lambda: layer)
+    dispatcher = ChannelDispatcher(maxsize=100, batch_size=50)
+
+    start = time.monotonic()
+    dispatcher.send_many((f"user_{n}", {"n": n}) for n in range(20))
+    assert time.monotonic() - start < 0.1
+    assert dispatcher.flush()
+
+    assert sorted(layer.sent) == list(range(20))
+    stats = dispatcher.stats()
+    assert stats["sent"] == 20 and stats["batches"] == 1  # یک gather برای کل دسته
+    assert stats["queue_depth"] == 0 and stats["max_queue_depth"] == 20
+    assert stats["max_dispatch_latency_ms"] >= 200
+
+
+
+def test_dispatcher_keeps_order_within_group(monkeypatch):
+    class Layer(_SlowLayer):
+        async def group_send(self, group, message):
+            # پیام‌های اول کندتر؛ با gather ساده ترتیب برعکس می‌رسید
+            await asyncio.sleep(0.05 - message["n"] * 0.01)
+            self.sent.append((group, message["n"]))
+
+    layer = Layer()
+    monkeypatch.setattr("core.utils.get_channel_layer", lambda: layer)
+    dispatcher = ChannelDispatcher(maxsize=100, batch_size=50)
+    dispatcher.send_many((f"place_{n % 2}", {"n": n}) for n in range(5))
+    assert dispatcher.flush()
+
+    assert [n for g, n in layer.sent if g == "place_0"] == [0, 2, 4]
+    assert [n for g, n in layer.sent if g == "place_1"] == [1, 3]
+    assert dispatcher.stats()["batches"] == 1
+
+
+@pytest.mark.parametrize("policy, delivered", [
+    ("drop_oldest", [0, 2, 3]),
+    ("drop_new", [0, 1, 2]),
+    ("block", [0, 1, 2]),
+])
+def test_dispatcher_overflow_policy(monkeypatch, settings, policy, delivered):
+    from core.metrics import dispatch_dropped
+
+    settings.WS_DISPATCH_BLOCK_TIMEOUT = 0.02
+    dropped_before = dispatch_dropped.get() or 0
+    layer = _SlowLayer()
+    layer.gate.clear()
+    monkeypatch.setattr("core.utils.get_channel_layer", lambda: layer)
+    dispatcher = ChannelDispatcher(maxsize=2, overflow=policy)
+
+    dispatcher.send("g", {"n": 0})
+    deadline = time.monotonic() + 5
+    while dispatcher.stats()["queue_depth"] and time.monotonic() < deadline:
+        time.sleep(0.005)  # پیام اول در حال ارسال است و صف خالی
+    for n in (1, 2, 3):
+        dispatcher.send("g", {"n": n})
+    layer.gate.set()
+    assert dispatcher.flush()
+
+    assert layer.sent == delivered
+    assert dispatcher.stats()["dropped"] == 1
+    assert dispatch_dropped.get() == dropped_before + 1
+
+
+def test_dispatcher_inline_when_queue_disabled(monkeypatch):
+    layer = _SlowLayer()
+    monkeypatch.setattr("core.utils.get_channel_layer", lambda: layer)
+    ChannelDispatcher(maxsize=0).send("g", {"n": 7})
+    assert layer.sent == [7]
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import connection, IntegrityError
+from core.models import User, Place, Queue, Ticket
+
+
+def _run_in_thread(fn):
+    def wrapper(*args):
+        try:
+            return fn(*args)
+        finally:
+            connection.close()
+    return wrapper
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_joins_get_unique_numbers():
+    admin = User.objects.create(username="placeadmin", role="place_admin")
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    users = [User.objects.create(username=f"c{i}") for i in range(40)]
+
+    @_run_in_thread
+    def join(user):
+        try:
+            return Queue.objects.get(pk=queue.pk).issue_ticket(user).number
+        except IntegrityError as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(join, users))
+
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert sorted(results) == list(range(1, len(users) + 1))
+    assert Ticket.objects.filter(queue=queue).count() == len(users)
+    queue.refresh_from_db()
+    assert queue.last_ticket_number == len(users)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_counters_never_call_the_same_ticket():
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    counters = 20
+    admin = User.objects.create(username="placeadmin", role="place_admin")
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0,
+                                 max_concurrent_queues=counters)
+    queue = Queue.objects.create(place=place)
+    users = User.objects.bulk_create([User(username=f"c{i}") for i in range(60)])
+    Ticket.objects.bulk_create([Ticket(queue=queue, user=u, number=i + 1) for i, u in enumerate(users)])
+    url = reverse("admin-call-next", kwargs={"queue_id": queue.id})
+
+    @_run_in_thread
+    def counter(n):
+        client = APIClient()
+        client.force_authenticate(admin)
+        called = []
+        while True:
+            response = client.post(url, {"counter": n})
+            if response.status_code == 204:
+                return called
+            assert response.status_code == 200, response.content
+            called.append((response.json()["id"], response.json()["counter"]))
+
+    with ThreadPoolExecutor(max_workers=counters) as pool:
+        results = list(pool.map(counter, range(1, counters + 1)))
+
+    called = [ticket_id for calls in results for ticket_id, _ in calls]
+    assert len(called) == len(set(called)) == len(users)
+    assert Ticket.objects.filter(queue=queue, called_at__isnull=True).count() == 0
+    for n, calls in enumerate(results, start=1):
+        assert all(c == n for _, c in calls)
+    assert dict(Ticket.objects.filter(queue=queue).values_list("id", "counter")) == {
+        ticket_id: c for calls in results for ticket_id, c in calls
+    }
@@ -0,0 +1,97 @@
+import random
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+from core.models import User, Place, Queue
+from core.eta import PositionIndex, eta_engine
+from core.serializers import TicketSerializer
+
+
+def test_position_index_matches_bruteforce():
+    rng = random.Random(7)
+    waiting = set(range(1, 200, 3))
+    index = PositionIndex(waiting)
+    for _ in range(2000):
+        number = rng.randint(1, 600)
+        if rng.random() < 0.5:
+            index.add(number)
+            waiting.add(number)
+        else:
+            index.discard(number)
+            waiting.discard(number)
+        probe = rng.randint(0, 700)
+        assert index.ahead(probe) == sum(1 for n in waiting if n < probe)
+    assert len(index) == len(waiting)
+
+
+@pytest.fixture
+def queue():
+    owner = User.objects.create(username="owner", role="place_admin")
+    place = Place.objects.create(owner=owner, name="Shop", latitude=0, longitude=0)
+    return Queue.objects.create(place=place, name="Main")
+
+
+def customers(n, prefix="c"):
+    return [User.objects.create(username=f"{prefix}{i}") for i in range(n)]
+
+
+@pytest.mark.django_db
+def test_position_and_eta_follow_service_rate(queue):
+    tickets = [queue.issue_ticket(user) for user in customers(5)]
+    data = TicketSerializer(tickets[3]).data
+    assert data["position"] == 4
+    assert data["estimated_call_at"] is None  # هنوز نرخ سرویسی ثبت نشده
+
+    start = timezone.now() - timedelta(minutes=10)
+    for i, ticket in enumerate(tickets[:3]):
+        ticket.called_at = start + timedelta(minutes=2 * i)
+        ticket.save()
+
+    queue.refresh_from_db()
+    assert queue.service_interval_ewma == pytest.approx(120)
+    data = TicketSerializer(tickets[3]).data
+    assert data["position"] == 1
+    # آخرین سرویس 6 دقیقه پیش بوده: نفر بعدی همین حالا
+    eta = timezone.datetime.fromisoformat(data["estimated_call_at"])
+    assert abs((eta - timezone.now()).total_seconds()) < 5
+    assert TicketSerializer(tickets[4]).data["position"] == 2
+    assert TicketSerializer(tickets[0]).data["position"] is None
+
+    # تیکت جدید و لغو یک تیکت منتظر ایندکس را به‌روز نگه می‌دارند
+    late = queue.issue_ticket(customers(1, prefix="late")[0])
+    assert TicketSerializer(late).data["position"] == 3
+    tickets[3].cancel()
+    assert TicketSerializer(late).data["position"] == 2
+    queue.refresh_from_db()
+    assert queue.service_interval_ewma == pytest.approx(120)
+
+
+@pytest.mark.django_db
+def test_eta_pushed_only_past_threshold(queue, monkeypatch, django_capture_on_commit_callbacks):
+    pushed = []
+    monkeypatch.setattr("core.eta.send_ws_messages", lambda messages: pushed.extend(messages))
+    monkeypatch.setattr(eta_engine, "threshold", 60)
+
+    tickets = [queue.issue_ticket(user) for user in customers(4)]
+    now = timezone.now()
+    Queue.objects.filter(pk=queue.pk).update(service_interval_ewma=300, last_service_at=now)
+    eta_engine.invalidate(queue.pk)
+    # ETA پایه‌ای که مشتری‌ها دیده‌اند
+    for ticket in tickets:
+        eta_engine.estimated_call_at(ticket)
+
+    # سرویس طبق برنامه (5 دقیقه بعد): ETA بقیه تغییری نمی‌کند
+    with django_capture_on_commit_callbacks(execute=True):
+        tickets[0].called_at = now + timedelta(seconds=300)
+        tickets[0].save()
+    assert pushed == []
+
+    # سرویس خیلی زودتر از برنامه: EWMA پایین می‌آید و ETA بقیه بیش از آستانه جابه‌جا می‌شود
+    with django_capture_on_commit_callbacks(execute=True):
+        tickets[1].called_at = now + timedelta(seconds=330)
+        tickets[1].save()
+    assert {user_id for user_id, _ in pushed} == {tickets[2].user_id, tickets[3].user_id}
+    message = dict(pushed)[tickets[2].user_id]
+    assert message["type"] == "eta_update"
+    assert message["position"] == 1
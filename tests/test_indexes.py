@@ -0,0 +1,56 @@
+"""
+کوئری‌های پرتکرار باید از ایندکس‌های تعریف‌شده در مدل‌ها استفاده کنند (EXPLAIN QUERY PLAN در SQLite).
+داده‌ی نمونه با توزیع واقعی (بیشتر تیکت‌ها تمام‌شده) ساخته و ANALYZE می‌شود تا planner آمار داشته باشد.
+"""
+import pytest
+from django.db import connection
+from django.utils import timezone
+from core.models import User, Place, Notification, Queue, Ticket, TicketStatus
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(connection.vendor != "sqlite", reason="plan assertions use SQLite EXPLAIN QUERY PLAN output"),
+]
+
+HOT_QUERIES = {
+    "ticket_queue_status_idx": lambda: Ticket.objects.filter(queue_id=1, status=TicketStatus.ACTIVE).order_by("number"),
+    "ticket_active_user_idx": lambda: Ticket.objects.filter(
+        queue_id=1, user_id=1, status=TicketStatus.ACTIVE).order_by()[:1],
+    "ticket_queue_created_idx": lambda: Ticket.objects.filter(
+        queue_id__in=[1], created_at__gte=timezone.now(), created_at__lt=timezone.now()).order_by(),
+    "queue_open_latest_idx": lambda: Queue.objects.filter(place_id=1, is_open=True).order_by("-created_at")[:1],
+    "notification_user_created_idx": lambda: Notification.objects.filter(user_id=1).order_by("-created_at", "-id")[:51],
+    "notification_unread_idx": lambda: Notification.objects.filter(
+        user_id=1, is_read=False).order_by("-created_at", "-id")[:51],
+}
+
+
+@pytest.fixture
+def history():
+    users = User.objects.bulk_create([User(username=f"u{i}") for i in range(200)])
+    places = Place.objects.bulk_create([
+        Place(owner=users[i], name=f"p{i}", latitude=0, longitude=0) for i in range(20)
+    ])
+    queues = Queue.objects.bulk_create([Queue(place=places[i % 20], is_open=i % 4 == 0) for i in range(80)])
+    Ticket.objects.bulk_create([
+        Ticket(queue=queues[i % 5], user=users[i % 200], number=i + 1,
+               status=TicketStatus.ACTIVE if i % 20 == 0 else TicketStatus.USED)
+        for i in range(4000)
+    ])
+    Notification.objects.bulk_create([
+        Notification(user=users[i % 200], title="t", message="m", is_read=i % 3 != 0) for i in range(4000)
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+@pytest.mark.parametrize("index", HOT_QUERIES)
+def test_hot_query_uses_index(history, index):
+    plan = HOT_QUERIES[index]().explain()
+    assert f"INDEX {index} " in plan, plan
+    assert "TEMP B-TREE" not in plan, plan
+
+
+def test_history_filter_uses_status_index(history):
+    plan = Ticket.objects.filter(queue_id=1, status=TicketStatus.USED).order_by("number").explain()
+    assert "INDEX ticket_queue_status_idx " in plan, plan
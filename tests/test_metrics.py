@@ -0,0 +1,27 @@
+from core.metrics import MetricsRegistry
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("app_requests_total", "Requests.", ("view",))
+    depth = registry.gauge("app_depth", "Depth.")
+    latency = registry.histogram("app_latency_seconds", "Latency.", ("view",), buckets=(0.1, 1))
+
+    requests.inc(view='say "hi"')
+    requests.inc(2, view='say "hi"')
+    depth.set(4)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, view="a")
+    registry.collector(lambda: depth.inc())
+
+    text = registry.render()
+    assert '# TYPE app_requests_total counter\napp_requests_total{view="say \\"hi\\""} 3\n' in text
+    assert "app_depth 5\n" in text
+    assert (
+        'app_latency_seconds_bucket{view="a",le="0.1"} 2\n'
+        'app_latency_seconds_bucket{view="a",le="1"} 3\n'
+        'app_latency_seconds_bucket{view="a",le="+Inf"} 4\n'
+        'app_latency_seconds_sum{view="a"} 3.65\n'
+        'app_latency_seconds_count{view="a"} 4\n'
+    ) in text
+    assert latency.get(view="a") == {"count": 4, "sum": 3.65}
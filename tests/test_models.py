@@ -84,3 +84,137 @@ def test_notification_creation():
     assert notif.is_read is False
 
 
+@pytest.mark.django_db
+def test_queue_statistics_incremental():
+    admin = User.objects.create(username="placeadmin", role=UserRoles.PLACE_ADMIN)
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    user = User.objects.create(username="customer1", role=UserRoles.CUSTOMER)
+
+    t1 = Ticket.objects.create(queue=queue, user=user, number=1)
+    t2 = Ticket.objects.create(queue=queue, user=user, number=2)
+    t3 = Ticket.objects.create(queue=queue, user=user, number=3)
+
+    t1.called_at = t1.created_at + timezone.timedelta(minutes=3)
+    t1.complete()
+    t2.call()
+    t2.complete()
+    t3.cancel("No show")
+    t2.requeue()
+
+    queue.refresh_from_db()
+    assert queue.total_tickets == 3
+    assert queue.last_ticket_number == 3
+    assert queue.processed_count == 1
+    assert queue.wait_samples == 1
+    assert queue.average_wait_time.total_seconds() == pytest.approx(180)
+
+    t1.delete()
+    queue.refresh_from_db()
+    assert queue.total_tickets == 2
+    assert queue.processed_count == 0
+    assert queue.average_wait_time.total_seconds() == 0
+
+    expected = queue.compute_statistics()
+    for field in ("processed_count", "total_tickets", "wait_samples"):
+        assert getattr(queue, field) == expected[field]
+
+
+@pytest.mark.django_db
+def test_rebuild_queue_stats_command():
+    from io import StringIO
+    from django.core.management import call_command
+
+    admin = User.objects.create(username="placeadmin", role=UserRoles.PLACE_ADMIN)
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    user = User.objects.create(username="customer1", role=UserRoles.CUSTOMER)
+    Ticket.objects.create(queue=queue, user=user, number=1, status=TicketStatus.USED)
+
+    # تغییر مستقیم در دیتابیس سیگنال‌ها را دور می‌زند
+    Queue.objects.filter(pk=queue.pk).update(processed_count=5)
+
+    out = StringIO()
+    call_command("rebuild_queue_stats", "--check", stdout=out)
+    assert "processed_count: 5 != 1" in out.getvalue()
+    queue.refresh_from_db()
+    assert queue.processed_count == 5
+
+    call_command("rebuild_queue_stats", stdout=StringIO())
+    queue.refresh_from_db()
+    assert queue.processed_count == 1
+
+
+@pytest.mark.django_db
+def test_seed_last_ticket_number_migration():
+    from importlib import import_module
+    from django.apps import apps
+
+    admin = User.objects.create(username="placeadmin", role=UserRoles.PLACE_ADMIN)
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0)
+    queue, empty = Queue.objects.create(place=place), Queue.objects.create(place=place)
+    user = User.objects.create(username="customer1", role=UserRoles.CUSTOMER)
+    Ticket.objects.create(queue=queue, user=user, number=7)
+    # صف‌های قبل از شمارنده‌ی اتمیک last_ticket_number را نگه نمی‌داشتند
+    Queue.objects.update(last_ticket_number=0)
+
+    import_module("core.migrations.0005_seed_last_ticket_number").seed_last_ticket_number(apps, None)
+    queue.refresh_from_db()
+    empty.refresh_from_db()
+    assert (queue.last_ticket_number, empty.last_ticket_number) == (7, 0)
+    assert queue.issue_ticket(user).number == 8
+
+
+@pytest.mark.django_db
+def test_update_statistics_never_lowers_last_ticket_number():
+    admin = User.objects.create(username="placeadmin", role=UserRoles.PLACE_ADMIN)
+    place = Place.objects.create(owner=admin, name="Test Place", latitude=0, longitude=0)
+    queue = Queue.objects.create(place=place)
+    user = User.objects.create(username="customer1", role=UserRoles.CUSTOMER)
+    queue.issue_ticket(user)
+    stale = Queue.objects.get(pk=queue.pk)
+    # شماره‌های 2 تا 5 در پروسه‌ی دیگری صادر شده‌اند و تیکت‌هایشان هنوز دیده نمی‌شوند
+    Queue.objects.filter(pk=queue.pk).update(last_ticket_number=5)
+
+    stale.update_statistics()
+    assert stale.last_ticket_number == 5
+    assert (stale.total_tickets, Queue.objects.get(pk=queue.pk).last_ticket_number) == (1, 5)
+    assert queue.issue_ticket(user).number == 6
+
+
+def test_geo_bbox_across_antimeridian():
+    from core.geo import bounding_box, cells_for_bbox, geocell, haversine, haversine_many
+
+    lat_min, lat_max, lon_ranges = bounding_box(0, 179.99, 10)
+    assert len(lon_ranges) == 2
+    cells = cells_for_bbox(lat_min, lat_max, lon_ranges)
+    assert geocell(0, -179.99) in cells
+    assert haversine_many(0, 179.99, [0], [-179.99])[0] == pytest.approx(haversine(0, 179.99, 0, -179.99))
+
+
+@pytest.mark.django_db
+def test_generate_synthetic_data_command():
+    from io import StringIO
+    from django.core.management import call_command
+    from core.geo import geocell
+    from core.models import TicketRollup
+
+    call_command(
+        "generate_synthetic_data", places=3, queues_per_place=2, tickets=600, users=20, days=10,
+        batch_size=100, stdout=StringIO(),
+    )
+    assert Place.objects.count() == 3
+    assert Queue.objects.count() == 6
+    assert Ticket.objects.count() == 600
+    # bulk_create از save() رد می‌شود؛ geocell باید با مختصات ذخیره‌شده بخواند
+    for lat, lon, cell in Place.objects.values_list("latitude", "longitude", "geocell"):
+        assert cell == geocell(lat, lon)
+
+    created = list(Ticket.objects.values_list("created_at", flat=True))
+    assert max(created) - min(created) > timezone.timedelta(days=5)
+    # شماره‌ها به ترتیب زمان و آمار صف‌ها و rollup‌ها بازسازی شده‌اند
+    for queue in Queue.objects.all():
+        numbers = list(queue.tickets.order_by("created_at").values_list("number", flat=True))
+        assert numbers == sorted(numbers)
+        assert queue.total_tickets == queue.last_ticket_number == len(numbers) == 100
+    assert sum(TicketRollup.objects.filter(granularity="day").values_list("total_count", flat=True)) == 600
@@ -0,0 +1,184 @@
+"""
+بودجه‌ی ثابت تعداد کوئری برای هر endpoint؛ با 10 و 1000 ردیف باید یکسان بماند.
+"""
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.models import User, Place, Queue, Ticket, TicketStatus, Notification
+
+pytestmark = pytest.mark.django_db
+
+SIZES = (10, 1000)
+
+# تعداد دقیق کوئری‌های مسیرهای نوشتنی بدون INSERT رویداد outbox (هر درخواست دقیقاً یکی اضافه می‌کند)؛
+# SAVEPOINT/RELEASE تراکنش‌های داخل تست هم شمرده می‌شوند
+BASELINES = {
+    "join": 11,
+    "leave": 5,
+    "call": 10,
+    "requeue": 7,
+    "cancel": 5,
+    "call_next": 11,
+    "batch_call": 12,
+    "batch_complete": 7,
+}
+
+
+@pytest.fixture
+def place_admin():
+    return User.objects.create(username="admin", role="place_admin")
+
+
+@pytest.fixture
+def customer():
+    return User.objects.create(username="customer", email="c@example.com")
+
+
+@pytest.fixture
+def queue(place_admin):
+    place = Place.objects.create(owner=place_admin, name="Shop", latitude=35.7, longitude=51.4)
+    return Queue.objects.create(place=place, name="Main")
+
+
+def fill_tickets(queue, n):
+    users = User.objects.bulk_create([User(username=f"u{queue.id}-{i}") for i in range(n)])
+    Ticket.objects.bulk_create([Ticket(queue=queue, user=u, number=i + 1) for i, u in enumerate(users)])
+    Queue.objects.filter(pk=queue.pk).update(last_ticket_number=n)
+    queue.refresh_from_db()
+
+
+def warm_buckets(queue):
+    """
+    ردیف‌های rollup و wait bin ساعت جاری را از قبل می‌سازد تا شمارش‌ها حالت پایدار باشند؛
+    اولین تغییر هر bucket دو کوئری بیشتر دارد (INSERT OR IGNORE و تکرار UPDATE).
+    """
+    ticket = queue.issue_ticket(User.objects.create(username=f"warm-{queue.id}"))
+    ticket.call()
+    ticket.complete()
+
+
+def count_queries(fn):
+    with CaptureQueriesContext(connection) as ctx:
+        response = fn()
+    assert response.status_code < 300, response.content
+    return len(ctx)
+
+
+def count_writes(fn):
+    """(تعداد کل کوئری‌ها، تعداد INSERT‌های core_outboxevent)"""
+    with CaptureQueriesContext(connection) as ctx:
+        response = fn()
+    assert response.status_code < 300, response.content
+    outbox = sum(q["sql"].startswith('INSERT INTO "core_outboxevent"') for q in ctx)
+    return len(ctx), outbox
+
+
+def assert_baseline_plus_outbox(name, fn):
+    assert count_writes(fn) == (BASELINES[name] + 1, 1), name
+
+
+def as_user(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_nearby_places_budget(place_admin, n):
+    Place.objects.bulk_create([
+        Place(owner=place_admin, name=f"p{i}", latitude=35.7 + i * 1e-5, longitude=51.4, geocell="1257:2314")
+        for i in range(n)
+    ])
+    client = APIClient()
+    url = reverse("places-nearby")
+    assert count_queries(lambda: client.get(url, {"lat": 35.7, "lon": 51.4, "radius": 5})) <= 2
+    assert count_queries(lambda: client.get(url, {"lat": 35.7, "lon": 51.4, "radius": 5, "limit": 10})) <= 2
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_place_list_budget(place_admin, n):
+    Place.objects.bulk_create([Place(owner=place_admin, name=f"p{i}", latitude=0, longitude=0) for i in range(n)])
+    client = as_user(place_admin)
+    assert count_queries(lambda: client.get("/api/places/")) <= 1
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_admin_queue_list_budget(place_admin, queue, n):
+    Queue.objects.bulk_create([Queue(place=queue.place, name=f"q{i}") for i in range(n)])
+    client = as_user(place_admin)
+    assert count_queries(lambda: client.get("/api/admin/queues/")) <= 1
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_admin_tickets_list_budget(place_admin, queue, n):
+    fill_tickets(queue, n)
+    client = as_user(place_admin)
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+    assert count_queries(lambda: client.get(url)) <= 3
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_admin_ticket_actions_budget(place_admin, queue, n):
+    fill_tickets(queue, n)
+    warm_buckets(queue)
+    ticket = Ticket.objects.get(queue=queue, number=1)
+    client = as_user(place_admin)
+    url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+    for action in ("call", "requeue", "cancel"):
+        assert_baseline_plus_outbox(action, lambda: client.patch(url, {"ticket_id": ticket.id, "action": action}))
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_call_next_budget(place_admin, queue, n):
+    fill_tickets(queue, n)
+    warm_buckets(queue)
+    client = as_user(place_admin)
+    url = reverse("admin-call-next", kwargs={"queue_id": queue.id})
+    for _ in range(2):
+        assert_baseline_plus_outbox("call_next", lambda: client.post(url, {"counter": 1}))
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_batch_actions_budget(place_admin, queue, n):
+    fill_tickets(queue, n)
+    warm_buckets(queue)
+    ids = list(Ticket.objects.filter(queue=queue, status=TicketStatus.ACTIVE).values_list("id", flat=True))
+    assert len(ids) == n
+    client = as_user(place_admin)
+    url = reverse("admin-tickets-batch", kwargs={"queue_id": queue.id})
+    # همان تعداد برای 10 و 1000 شناسه
+    for action in ("call", "complete"):
+        assert_baseline_plus_outbox(
+            f"batch_{action}", lambda: client.post(url, {"ticket_ids": ids, "action": action}, format="json"),
+        )
+    assert Ticket.objects.filter(queue=queue, status=TicketStatus.USED).count() == n + 1
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_join_and_leave_budget(customer, queue, n):
+    fill_tickets(queue, n)
+    warm_buckets(queue)
+    client = as_user(customer)
+    join_url = reverse("join-queue", kwargs={"place_id": queue.place_id})
+    assert_baseline_plus_outbox("join", lambda: client.post(join_url))
+    ticket = Ticket.objects.get(queue=queue, user=customer, status=TicketStatus.ACTIVE)
+    leave_url = reverse("leave-queue", kwargs={"ticket_id": ticket.id})
+    assert_baseline_plus_outbox("leave", lambda: client.post(leave_url))
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_notification_list_budget(customer, n):
+    Notification.objects.bulk_create([Notification(user=customer, title="t", message="m") for _ in range(n)])
+    client = as_user(customer)
+    assert count_queries(lambda: client.get(reverse("notifications"))) <= 1
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_analytics_budget(place_admin, queue, n):
+    fill_tickets(queue, n)
+    client = as_user(place_admin)
+    url = reverse("analytics")
+    assert count_queries(lambda: client.get(url, {"place_id": queue.place_id})) <= 3
+    assert count_queries(lambda: client.get(url, {"place_id": queue.place_id, "interval": "weekly"})) <= 3
@@ -0,0 +1,78 @@
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.db import ReplicaRouter, pin_key, read_replica, replica_reads
+from core.models import Place, Queue, Ticket, User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def replica(settings):
+    # در تست‌ها alias دیگری نداریم؛ default نقش replica را بازی می‌کند و فقط تصمیم router شمرده می‌شود
+    settings.DATABASE_REPLICAS = ["default"]
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def replica_count():
+    return replica_reads.get(alias="default") or 0
+
+
+@pytest.fixture
+def setup():
+    admin = User.objects.create_user(username="admin", password="p", role="place_admin")
+    customer = User.objects.create_user(username="u", password="p")
+    place = Place.objects.create(owner=admin, name="Shop", latitude=35.7, longitude=51.4)
+    queue = Queue.objects.create(place=place, name="Main")
+    ticket = Ticket.objects.create(queue=queue, user=customer, number=1)
+    return admin, customer, queue, ticket
+
+
+def test_designated_reads_use_replica_and_writes_pin_primary(replica, setup):
+    admin, customer, queue, ticket = setup
+    admin_client, customer_client = APIClient(), APIClient()
+    admin_client.force_authenticate(admin)
+    customer_client.force_authenticate(customer)
+    tickets_url = reverse("admin-tickets", kwargs={"queue_id": queue.id})
+
+    before = replica_count()
+    assert admin_client.get(reverse("analytics"), {"place_id": queue.place_id}).status_code == 200
+    assert admin_client.get(tickets_url).status_code == 200
+    assert replica_count() > before
+
+    # نوشتن: خواندن‌های بعدی همان کاربر از primary، بقیه‌ی کاربران هنوز replica
+    before = replica_count()
+    assert admin_client.patch(tickets_url, {"ticket_id": ticket.id, "action": "call"}, format="json").status_code == 200
+    assert replica_count() == before
+    r = admin_client.get(tickets_url)
+    assert r.json()["results"][0]["status"] == "active" and r.json()["results"][0]["called_at"]
+    assert replica_count() == before
+    assert customer_client.get(reverse("notifications")).status_code == 200
+    assert replica_count() > before
+
+    cache.delete(pin_key(admin.pk))
+    before = replica_count()
+    admin_client.get(tickets_url)
+    assert replica_count() > before
+
+
+def test_router_keeps_transactions_and_writes_on_primary(replica):
+    router = ReplicaRouter()
+    assert router.db_for_read(Ticket) is None
+    with read_replica() as alias:
+        assert alias == "default"
+        assert router.db_for_read(Ticket) == "default"
+        with transaction.atomic():
+            assert router.db_for_read(Ticket) is None
+        assert router.db_for_write(Ticket) == "default"
+    assert router.db_for_read(Ticket) is None
+
+
+def test_no_replicas_configured():
+    with read_replica() as alias:
+        assert alias is None
+        assert ReplicaRouter().db_for_read(Ticket) is None
@@ -1,7 +1,7 @@
 import pytest
 from channels.testing import WebsocketCommunicator
 from django.contrib.auth import get_user_model
-from core.asgi import application
+from smartqueue.asgi import application
 from core.models import Place, Queue
 from channels.layers import get_channel_layer
 from asgiref.sync import sync_to_async
@@ -43,6 +43,11 @@ async def test_websocket_ticket_created():
     connected, _ = await communicator.connect()
     assert connected
 
+    # وضعیت فعلی صف هنگام اتصال
+    snapshot = await communicator.receive_json_from()
+    assert snapshot["type"] == "snapshot"
+    assert [q["name"] for q in snapshot["queues"]] == ["Test Queue"]
+
     # ارسال پیام به گروه
     channel_layer = get_channel_layer()
     data = {"type": "ticket_created", "ticket": {"id": 1, "number": 1}}
@@ -57,3 +62,198 @@ async def test_websocket_ticket_created():
     assert response == data
 
     await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_websocket_resume_since_seq():
+    from core.feed import place_feed
+
+    place_id = 4242
+    for i in range(3):
+        place_feed.stamp(place_id, {"type": "ticket_called", "ticket": {"id": i}})
+    current = place_feed.current(place_id)
+
+    communicator = WebsocketCommunicator(application, f"/ws/queue/{place_id}/?since={current - 2}")
+    connected, _ = await communicator.connect()
+    assert connected
+    response = await communicator.receive_json_from()
+    assert response["type"] == "batch"
+    assert [e["seq"] for e in response["events"]] == [current - 1, current]
+
+    # رویداد قدیمی‌تر از آخرین seq دیده‌شده دوباره فرستاده نمی‌شود
+    channel_layer = get_channel_layer()
+    await channel_layer.group_send(f"place_{place_id}", {"type": "queue_update", "data": response["events"][0]})
+    assert await communicator.receive_nothing()
+    await communicator.disconnect()
+
+    # فاصله‌ی بیشتر از بافر: snapshot
+    communicator = WebsocketCommunicator(application, f"/ws/queue/{place_id}/?since={current + 10}")
+    connected, _ = await communicator.connect()
+    assert (await communicator.receive_json_from())["type"] == "snapshot"
+    await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_notification_is_not_double_encoded():
+    from rest_framework_simplejwt.tokens import AccessToken
+    from core.utils import send_ws_notification
+
+    user = await sync_to_async(User.objects.create_user)(username="customer", password="123456")
+    token = str(AccessToken.for_user(user))
+
+    communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={token}")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    await sync_to_async(send_ws_notification)(user.id, {"type": "ticket_called", "ticket": {"id": 1}})
+    response = await communicator.receive_json_from()
+    assert response == {"v": 1, "type": "ticket_called", "ticket": {"id": 1}}
+    await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_msgpack_envelope_for_binary_and_json_clients(settings):
+    import msgpack
+    from core.utils import encode_envelope
+
+    settings.WS_ENVELOPE_MSGPACK = True
+    binary = WebsocketCommunicator(application, "/ws/queue/4343/?format=msgpack&since=0")
+    plain = WebsocketCommunicator(application, "/ws/queue/4343/?since=0")
+    for communicator in (binary, plain):
+        assert (await communicator.connect())[0]
+
+    data = {"type": "ticket_called", "ticket": {"id": 1}}
+    await get_channel_layer().group_send("place_4343", encode_envelope("queue_update", data))
+    assert msgpack.unpackb(await binary.receive_from()) == {"v": 1, **data}
+    assert await plain.receive_json_from() == {"v": 1, **data}
+    for communicator in (binary, plain):
+        await communicator.disconnect()
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_auth_uses_user_cache():
+    from rest_framework_simplejwt.tokens import AccessToken
+    from core.metrics import ws_auth_cache, ws_connect_seconds
+    from core.middleware import user_cache, ws_auth_stats
+
+    def connects(auth):
+        return (ws_connect_seconds.get(auth=auth) or {"count": 0})["count"]
+
+    user_cache.clear()
+    lookups = {result: ws_auth_cache.get(result=result) or 0 for result in ("hit", "miss")}
+    before = {auth: connects(auth) for auth in ("ok", "invalid", "missing")}
+    user = await sync_to_async(User.objects.create_user)(username="cached", password="123456")
+    token = str(AccessToken.for_user(user))
+
+    for _ in range(3):
+        communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={token}")
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.disconnect()
+    assert (user_cache.hits, user_cache.misses) == (2, 1)
+
+    # ذخیره‌ی کاربر در پروسه‌ی دیگر: فقط نسخه‌ی cache مشترک بالا می‌رود، کش محلی دست نمی‌خورد
+    from django.core.cache import cache
+    await sync_to_async(User.objects.filter(pk=user.pk).update)(is_active=False)
+    await sync_to_async(cache.incr)(user_cache.version_key(user.pk))
+    communicator = WebsocketCommunicator(application, f"/ws/notifications/?token={token}")
+    connected, code = await communicator.connect()
+    assert not connected and code == 4003
+
+    communicator = WebsocketCommunicator(application, "/ws/notifications/?token=garbage")
+    connected, code = await communicator.connect()
+    assert not connected and code == 4003
+    communicator = WebsocketCommunicator(application, "/ws/notifications/")
+    connected, code = await communicator.connect()
+    assert not connected and code == 4001
+
+    stats = ws_auth_stats()
+    assert stats["cache_hit_ratio"] == pytest.approx(2 / 4)
+    assert stats["avg_latency_ms"] > 0
+    # همان نسبت و latency در /api/metrics
+    assert ws_auth_cache.get(result="hit") - lookups["hit"] == 2
+    assert ws_auth_cache.get(result="miss") - lookups["miss"] == 2
+    assert {auth: connects(auth) - before[auth] for auth in before} == {"ok": 3, "invalid": 2, "missing": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_websocket_connection_gauge():
+    from core.metrics import ws_connections
+
+    admin = await sync_to_async(User.objects.create_user)(username="admin", password="123456", role="place_admin")
+    place = await sync_to_async(Place.objects.create)(owner=admin, name="P", latitude=0, longitude=0)
+    before = ws_connections.get(consumer="QueueConsumer") or 0
+
+    communicator = WebsocketCommunicator(application, f"/ws/queue/{place.id}/")
+    connected, _ = await communicator.connect()
+    assert connected
+    assert ws_connections.get(consumer="QueueConsumer") == before + 1
+
+    rejected = WebsocketCommunicator(application, "/ws/notifications/")
+    connected, _ = await rejected.connect()
+    assert not connected
+    assert (ws_connections.get(consumer="NotificationConsumer") or 0) == 0
+
+    await communicator.disconnect()
+    assert ws_connections.get(consumer="QueueConsumer") == before
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_call_is_traced_from_request_to_screens(settings, tmp_path):
+    import asyncio
+    import json
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.tokens import AccessToken
+    from core.management.commands.trace_report import summarize
+    from core.models import Ticket
+    from core.outbox import dispatch_pending
+
+    settings.TRACE_ENABLED = True
+    settings.TRACE_FILE = tmp_path / "traces.jsonl"
+    admin = await sync_to_async(User.objects.create_user)(username="admin", password="123456", role="place_admin")
+    customer = await sync_to_async(User.objects.create_user)(username="customer", password="123456")
+    place = await sync_to_async(Place.objects.create)(owner=admin, name="P", latitude=0, longitude=0)
+    queue = await sync_to_async(Queue.objects.create)(place=place, name="Q", is_open=True)
+    ticket = await sync_to_async(Ticket.objects.create)(queue=queue, user=customer, number=1)
+
+    screen = WebsocketCommunicator(application, f"/ws/queue/{place.id}/")
+    assert (await screen.connect())[0]
+    assert (await screen.receive_json_from())["type"] == "snapshot"
+    phone = WebsocketCommunicator(application, f"/ws/notifications/?token={AccessToken.for_user(customer)}")
+    assert (await phone.connect())[0]
+
+    client = APIClient()
+    client.force_authenticate(admin)
+    response = await sync_to_async(client.patch)(
+        f"/api/admin/queues/{queue.id}/tickets/", {"ticket_id": ticket.id, "action": "call"}, format="json",
+    )
+    assert response.status_code == 200
+    trace_id = response["X-Trace-Id"]
+    await sync_to_async(dispatch_pending)()
+
+    frames = []
+    while not any(f.get("type") == "ticket_called" for f in frames):
+        frame = await screen.receive_json_from(timeout=2)
+        frames.extend(frame["events"] if frame["type"] == "batch" else [frame])
+    assert (await phone.receive_json_from(timeout=2))["type"] == "ticket_called"
+    await asyncio.sleep(0.05)
+    await screen.disconnect()
+    await phone.disconnect()
+
+    spans = [json.loads(line) for line in settings.TRACE_FILE.read_text().splitlines()]
+    assert {s["trace_id"] for s in spans} == {trace_id}
+    names = {s["name"] for s in spans}
+    assert {"http", "ticket.call", "signal.update_queue_stats", "queue.flush",
+            "outbox.deliver", "channel.group_send", "ws.deliver"} <= names
+    by_id = {s["span_id"]: s for s in spans}
+    assert all(s["parent_id"] in by_id for s in spans if s["name"] != "http")
+    delivered = {s["attrs"]["consumer"] for s in spans if s["name"] == "ws.deliver"}
+    assert delivered == {"QueueConsumer", "NotificationConsumer"}
+    assert all(s["attrs"]["e2e_ms"] > 0 for s in spans if s["name"] == "ws.deliver")
+
+    views, _ = summarize({trace_id: spans})
+    assert views[0]["view"] == "PATCH admin-tickets" and views[0]["deliveries"] >= 2